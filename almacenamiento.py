@@ -0,0 +1,1536 @@
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+from contextlib import contextmanager
+
+import pandas as pd
+
+from busqueda import IndiceConceptos
+from eventos import QUIENES, CalendarioEventos, compactar_eventos, eventos_en_rango
+from gastos import ResumenMensual, traspasar_gastos
+from historial import Historial, INSTANTANEAS_GUARDADAS, OPERACIONES_POR_INSTANTANEA, accion, accion_actual, aplicar, ultima_accion
+from persistencia import (bloqueo_archivo, cache, escribir_atomico, escritor, filas_modificadas, firma_archivo,
+                          vista)
+
+COLUMNAS_GASTOS = ["Mes", "Concepto", "Cantidad", "Pagado", "Categoría", "Fecha"]
+# Cada evento es un rango de días (Fecha - Fecha_fin) que puede repetirse según "Recurrencia"
+COLUMNAS_EVENTOS = ["Fecha", "Fecha_fin", "Hora", "Quien", "Concepto", "Todo_el_dia", "Recurrencia"]
+COLUMNAS = {"gastos": COLUMNAS_GASTOS, "eventos": COLUMNAS_EVENTOS}
+COLUMNAS_BOOLEANAS = {"gastos": ["Pagado"], "eventos": ["Todo_el_dia"]}
+
+CATEGORIAS_POR_DEFECTO = ["Casa", "Deporte", "Alimentación / Hogar", "Salir Fuera"]
+ARCHIVO_CATEGORIAS = "categorias.json"
+# Sesiones de las que se guardan conflictos pendientes de avisar (las más antiguas se olvidan)
+MAXIMO_SESIONES_CON_CONFLICTOS = 100
+
+# Columnas que repiten unos pocos valores en todas las filas: en memoria se guardan como
+# categóricas (un código entero por fila), así los filtros y agrupaciones comparan enteros
+COLUMNAS_CATEGORICAS = {"gastos": ["Mes", "Categoría"], "eventos": ["Hora", "Quien"]}
+
+
+# Asegura que la tabla tiene todas las columnas y un índice "id" estable por fila
+def _normalizar(tabla, datos):
+    for columna in COLUMNAS[tabla]:
+        if columna not in datos.columns:
+            datos[columna] = None
+
+    if "id" in datos.columns:
+        ids = pd.to_numeric(datos["id"], errors="coerce")
+        faltan = ids.isna()
+        if faltan.any():
+            siguiente = int(ids.max()) + 1 if ids.notna().any() else 0
+            ids[faltan] = range(siguiente, siguiente + int(faltan.sum()))
+        datos = datos.drop(columns="id")
+        datos.index = pd.Index(ids.astype("int64"), name="id")
+    elif datos.index.name != "id":
+        # Tablas construidas a mano (p. ej. con pd.concat): se numeran de nuevo
+        datos.index = pd.RangeIndex(len(datos), name="id")
+    return _codificar(tabla, datos)
+
+
+# Las categorías de "Categoría" y "Quien" empiezan por las de la aplicación, para que sus códigos
+# no dependan de los datos; después van los demás valores que aparezcan
+def _valores_conocidos(columna):
+    if columna == "Categoría":
+        return cargar_categorias(ARCHIVO_CATEGORIAS)
+    if columna == "Quien":
+        return QUIENES
+    return []
+
+
+def _codificar(tabla, datos):
+    for columna in COLUMNAS_CATEGORICAS[tabla]:
+        if not isinstance(datos[columna].dtype, pd.CategoricalDtype):
+            categorias = pd.Index(_valores_conocidos(columna), dtype=object)
+            categorias = categorias.append(pd.Index(datos[columna].dropna().unique(), dtype=object)).unique()
+            datos[columna] = pd.Categorical(datos[columna], categories=categorias)
+    return datos
+
+
+# pd.concat convierte las columnas categóricas en texto si sus categorías no coinciden:
+# antes de unir las tablas se les da a todas las de la primera, añadiendo al final las que falten
+# (así no cambian los códigos de la primera tabla, que suele ser la grande)
+def _concatenar(tablas):
+    tablas = [tabla.copy(deep=False) for tabla in tablas]
+    for columna in tablas[0].columns:
+        if not isinstance(tablas[0][columna].dtype, pd.CategoricalDtype):
+            continue
+        for tabla in tablas[1:]:
+            valores = tabla[columna].cat.categories if isinstance(tabla[columna].dtype, pd.CategoricalDtype) \
+                else tabla[columna].dropna().unique()
+            faltan = pd.Index(valores, dtype=object).difference(tablas[0][columna].cat.categories)
+            if len(faltan):
+                tablas[0][columna] = tablas[0][columna].cat.add_categories(faltan)
+        tipo = tablas[0][columna].dtype
+        for tabla in tablas[1:]:
+            if tabla[columna].dtype != tipo:
+                tabla[columna] = tabla[columna].astype(tipo)
+    return pd.concat(tablas)
+
+
+# Asigna valores a una fila; en las columnas categóricas se añade antes la categoría si es nueva
+def _asignar(datos, id, cambios):
+    for columna, valor in cambios.items():
+        if isinstance(datos[columna].dtype, pd.CategoricalDtype) and not pd.isna(valor) \
+                and valor not in datos[columna].cat.categories:
+            datos[columna] = datos[columna].cat.add_categories([valor])
+        datos.at[id, columna] = valor
+
+
+def _filtrar(datos, mes=None, desde=None, hasta=None):
+    if mes is None and desde is None and hasta is None:
+        return vista(datos)
+    mascara = pd.Series(True, index=datos.index)
+    if mes is not None:
+        mascara &= datos["Mes"] == mes
+    if desde is not None:
+        mascara &= datos["Fecha"].astype(str) >= desde
+    if hasta is not None:
+        mascara &= datos["Fecha"].astype(str) < hasta
+    return datos[mascara]
+
+
+def _leer_json(tabla, nombre_archivo):
+    if os.path.exists(nombre_archivo):
+        try:
+            with open(nombre_archivo, 'r') as archivo:
+                data = archivo.read()
+            if data.strip():  # Verifica si el archivo no está vacío
+                return pd.read_json(io.StringIO(data))
+            else:
+                return pd.DataFrame(columns=COLUMNAS[tabla])
+        except ValueError:  # Atrapa cualquier error de lectura de JSON
+            return pd.DataFrame(columns=COLUMNAS[tabla])
+    else:
+        return pd.DataFrame(columns=COLUMNAS[tabla])
+
+
+def _serializar(datos):
+    return datos.reset_index().to_json(orient='records', date_format='iso')
+
+
+class ConflictoEdicion(Exception):
+    """El gasto ha cambiado (o se ha borrado) desde que se leyó, p. ej. en otra sesión."""
+
+
+def _iguales(a, b):
+    if pd.isna(a) and pd.isna(b):
+        return True
+    return bool(a == b)
+
+
+# Falla si los valores que el usuario vio (`antes`) ya no son los guardados
+def _comprobar_antes(datos, id, antes):
+    if id not in datos.index:
+        raise ConflictoEdicion(f"El registro {id} ya no existe.")
+    if antes and not all(_iguales(datos.at[id, columna], valor) for columna, valor in antes.items()):
+        raise ConflictoEdicion(f"El registro {id} ha cambiado mientras se editaba.")
+
+
+# Cambios entre dos versiones de una tabla como operaciones (tipo, id, antes, después)
+def _operaciones(antes, despues):
+    # Sólo filas nuevas o sólo filas borradas: no hace falta comparar
+    if antes.empty:
+        return [("insertar", id, None, fila) for id, fila in zip(despues.index, despues.to_dict("records"))]
+    if despues.empty:
+        return [("eliminar", id, fila, None) for id, fila in zip(antes.index, antes.to_dict("records"))]
+    operaciones = []
+    for id in filas_modificadas(antes, despues):
+        if id not in despues.index:
+            operaciones.append(("eliminar", id, antes.loc[id].to_dict(), None))
+        elif id not in antes.index:
+            operaciones.append(("insertar", id, None, despues.loc[id].to_dict()))
+        else:
+            fila_antes, fila_despues = antes.loc[id].to_dict(), despues.loc[id].to_dict()
+            columnas = [columna for columna in fila_despues if not _iguales(fila_antes.get(columna), fila_despues[columna])]
+            operaciones.append(("actualizar", id, {columna: fila_antes.get(columna) for columna in columnas},
+                                {columna: fila_despues[columna] for columna in columnas}))
+    return operaciones
+
+
+# Repite las operaciones de una sesión sobre la tabla que hay en disco. Se descartan las que
+# chocan con lo que ha cambiado otro proceso: editar un valor que él también ha editado,
+# o borrar una fila que ha modificado. Devuelve la tabla resultante y las descartadas
+def _aplicar_operaciones(datos, operaciones):
+    datos = datos.copy()
+    descartadas = []
+    for operacion in operaciones:
+        tipo, id, antes, despues = operacion
+        if tipo == "insertar":
+            datos = _concatenar([datos.drop(index=id, errors="ignore"),
+                                 pd.DataFrame([despues], index=pd.Index([id], name="id"))])
+        elif id not in datos.index:
+            if tipo == "actualizar":
+                descartadas.append(operacion)
+        elif any(not _iguales(datos.at[id, columna], valor) and
+                 (tipo == "eliminar" or not _iguales(datos.at[id, columna], despues[columna]))
+                 for columna, valor in antes.items()):
+            descartadas.append(operacion)
+        elif tipo == "actualizar":
+            _asignar(datos, id, despues)
+        else:
+            datos = datos.drop(index=id)
+    return datos, descartadas
+
+
+# Concepto de la fila de una operación, para nombrarla al avisar de un conflicto: el que tenía antes
+# del cambio si lo cambiaba (o la borraba), si no el de la tabla del proceso, `datos`
+def _concepto(datos, operacion):
+    _, id, antes, despues = operacion
+    if antes and "Concepto" in antes:
+        return antes["Concepto"]
+    if id in datos.index:
+        return datos.at[id, "Concepto"]
+    return (despues or {}).get("Concepto")
+
+
+_sesion_local = threading.local()
+
+
+# Sesión (p. ej. de la aplicación web) a la que pertenecen los cambios que hace este hilo: los
+# conflictos de sus cambios sólo se le devuelven a ella, con tomar_conflictos(sesion)
+def fijar_sesion(sesion):
+    _sesion_local.sesion = sesion
+
+
+def _sesion_actual():
+    return getattr(_sesion_local, "sesion", None)
+
+
+class _Diario:
+    """Operaciones de un archivo que aún no están en disco, y la firma del archivo sobre el que se hicieron."""
+
+    def __init__(self):
+        self.firma = None
+        self.operaciones = []  # (número de secuencia, operación); las de un mismo cambio comparten número
+        self.acciones = {}  # número de secuencia -> (acción, acción que deshace), para el historial
+        self.sesiones = {}  # número de secuencia -> sesión que hizo el cambio, para avisarle de sus conflictos
+        self.secuencia = 0
+        self.confirmada = 0  # Última secuencia ya escrita en disco
+
+
+# Las operaciones escritas, agrupadas en los cambios del historial (uno por número de secuencia)
+def _cambios_historial(operaciones, descartadas, acciones):
+    descartadas = {id(operacion) for operacion in descartadas}
+    cambios = {}
+    for numero, operacion in operaciones:
+        if id(operacion) not in descartadas:
+            cambios.setdefault(numero, []).append(list(operacion))
+    return [{"accion": acciones[numero][0], **({"deshace": acciones[numero][1]} if acciones[numero][1] else {}),
+             "operaciones": cambio} for numero, cambio in cambios.items()]
+
+
+class AlmacenJSON:
+    """Guarda cada tabla como un array JSON en su archivo (formato original).
+
+    Varios procesos pueden usar los mismos archivos: cada escritura se hace con el
+    archivo bloqueado y, si otro proceso lo ha cambiado desde que se leyó, los
+    cambios propios se repiten sobre lo que hay en disco en vez de sobrescribirlo.
+    Lo escrito queda además en el historial del archivo (ver historial.Historial).
+    """
+
+    def __init__(self):
+        self._bloqueo = threading.RLock()
+        self._versiones = {}  # nombre_archivo -> (tabla en memoria, número de versión)
+        self._diarios = {}  # nombre_archivo -> _Diario
+        self.conflictos = {}  # sesión -> operaciones suyas descartadas al fusionar con los cambios de otro proceso
+
+    def cargar(self, tabla, nombre_archivo, mes=None, desde=None, hasta=None):
+        if tabla == "eventos" and desde is not None and hasta is not None:
+            return eventos_en_rango(self._actual(tabla, nombre_archivo), desde, hasta)
+        return _filtrar(self._actual(tabla, nombre_archivo), mes, desde, hasta)
+
+    def guardar(self, tabla, nombre_archivo, datos):
+        self._reemplazar(tabla, nombre_archivo, _normalizar(tabla, datos.copy()))
+
+    def insertar(self, tabla, nombre_archivo, filas):
+        with self._bloqueo:
+            actual = self._actual(tabla, nombre_archivo)
+            nuevas = pd.DataFrame(filas, columns=COLUMNAS[tabla])
+            siguiente = self._reservar_ids(nombre_archivo, len(nuevas),
+                                           lambda: int(actual.index.max()) + 1 if len(actual) else 0)
+            nuevas.index = pd.RangeIndex(siguiente, siguiente + len(nuevas), name="id")
+            self._programar(tabla, nombre_archivo, _concatenar([actual, nuevas]), _operaciones(actual.iloc[0:0], nuevas))
+        return list(nuevas.index)
+
+    # Con `antes` (los valores que se vieron al editar) falla con ConflictoEdicion si ya no coinciden
+    def actualizar(self, tabla, nombre_archivo, id, cambios, mes=None, antes=None):
+        with self._bloqueo:
+            actual = self._actual(tabla, nombre_archivo)
+            _comprobar_antes(actual, id, antes)
+            previos = {columna: actual.at[id, columna] for columna in cambios}
+            cambios = {columna: valor for columna, valor in cambios.items() if not _iguales(previos[columna], valor)}
+            if not cambios:
+                return
+            datos = actual.copy()
+            _asignar(datos, id, cambios)
+            self._programar(tabla, nombre_archivo, datos,
+                            [("actualizar", id, {columna: previos[columna] for columna in cambios}, cambios)])
+
+    def eliminar(self, tabla, nombre_archivo, ids, mes=None):
+        with self._bloqueo:
+            actual = self._actual(tabla, nombre_archivo)
+            ids = [id for id in ids if id in actual.index]
+            if ids:
+                self._programar(tabla, nombre_archivo, actual.drop(index=ids), _operaciones(actual.loc[ids], actual.iloc[0:0]))
+
+    # Cambia un valor de una columna categórica en todas las filas. En memoria basta con
+    # renombrar la categoría; en disco se reescriben las filas afectadas
+    def renombrar(self, tabla, nombre_archivo, columna, anterior, nuevo):
+        with self._bloqueo:
+            actual = self._actual(tabla, nombre_archivo)
+            afectadas = actual.index[actual[columna] == anterior]
+            if not len(afectadas):
+                return
+            datos = actual.copy(deep=False)
+            if isinstance(datos[columna].dtype, pd.CategoricalDtype) and nuevo not in datos[columna].cat.categories:
+                datos[columna] = datos[columna].cat.rename_categories({anterior: nuevo})
+            else:
+                datos[columna] = datos[columna].where(datos[columna] != anterior, nuevo)
+            self._programar(tabla, nombre_archivo, datos,
+                            [("actualizar", id, {columna: anterior}, {columna: nuevo}) for id in afectadas])
+
+    # Vuelve a poner filas borradas con sus ids (p. ej. al deshacer un borrado). Las que ya
+    # existen no se tocan. Devuelve los ids puestos
+    def restaurar(self, tabla, nombre_archivo, filas):
+        with self._bloqueo:
+            actual = self._actual(tabla, nombre_archivo)
+            filas = filas[~filas.index.isin(actual.index)]
+            if len(filas):
+                self._programar(tabla, nombre_archivo, _concatenar([actual, filas]), _operaciones(actual.iloc[0:0], filas))
+        return list(filas.index)
+
+    # Cambios del historial entre `desde` y `hasta`, del más antiguo al más reciente
+    def cambios(self, tabla, nombre_archivo, desde=None, hasta=None):
+        cambios = [cambio for archivo in self._archivos(tabla, nombre_archivo)
+                   for cambio in Historial(archivo).cambios(desde, hasta)]
+        return sorted(cambios, key=lambda cambio: cambio["momento"])
+
+    # La última acción que se puede deshacer (ver historial.ultima_accion). Se leen los últimos
+    # tramos del historial de cada archivo, y más si en ellos no hay ninguna
+    def ultima_accion(self, tabla, nombre_archivo):
+        historiales = [Historial(archivo) for archivo in self._archivos(tabla, nombre_archivo)]
+        cantidad = 2
+        while True:
+            cambios, completos = [], True
+            for historial in historiales:
+                recientes, todos = historial.recientes(cantidad)
+                cambios += recientes
+                completos &= todos
+            ultima = ultima_accion(sorted(cambios, key=lambda cambio: cambio["momento"]))
+            if ultima is not None or completos:
+                return ultima
+            cantidad *= 2
+
+    # La tabla tal como estaba en `momento` (texto ISO)
+    def estado(self, tabla, nombre_archivo, momento, mes=None):
+        filas = Historial(nombre_archivo).estado(momento)
+        if filas is None:  # Sin historial: no ha cambiado desde que se empezó a guardar
+            return _filtrar(self._actual(tabla, nombre_archivo), mes)
+        return _filtrar(_normalizar(tabla, pd.DataFrame(filas, columns=["id"] + COLUMNAS[tabla])), mes)
+
+    # Archivos en los que se guarda la tabla (y cada uno con su historial)
+    def _archivos(self, tabla, nombre_archivo):
+        return [nombre_archivo]
+
+    # El historial de la tabla vuelve a empezar con lo que hay ahora en sus archivos, como en
+    # AlmacenSQLite: lo escrito hasta aquí (p. ej. compactar los eventos) no se puede deshacer
+    def _empezar_historial(self, tabla, nombre_archivo):
+        escritor.vaciar()
+        for archivo in self._archivos(tabla, nombre_archivo):
+            with bloqueo_archivo(archivo):
+                Historial(archivo).borrar()
+
+    # Devuelve y olvida las operaciones de `sesion` descartadas por chocar con cambios de otro proceso
+    def tomar_conflictos(self, sesion=None):
+        with self._bloqueo:
+            return self.conflictos.pop(sesion, [])
+
+    def _reemplazar(self, tabla, nombre_archivo, datos):
+        with self._bloqueo:
+            operaciones = _operaciones(self._actual(tabla, nombre_archivo), datos)
+            if operaciones:
+                self._programar(tabla, nombre_archivo, datos, operaciones)
+
+    def _actual(self, tabla, nombre_archivo):
+        pendiente = escritor.pendiente(nombre_archivo)
+        if pendiente is not None:  # Datos guardados que el escritor aún no ha volcado a disco
+            return pendiente[0]
+        # Sólo se vuelve a leer el archivo si ha cambiado en disco desde la última lectura
+        datos, firma = cache.obtener(nombre_archivo, lambda nombre_archivo: _normalizar(tabla, _leer_json(tabla, nombre_archivo)),
+                                     tipo=tabla, con_firma=True)
+        with self._bloqueo:
+            diario = self._diarios.setdefault(nombre_archivo, _Diario())
+            if not diario.operaciones:
+                diario.firma = firma
+        return datos
+
+    def _programar(self, tabla, nombre_archivo, datos, operaciones):
+        # La escritura se hace en segundo plano; varias seguidas se agrupan en una sola.
+        # Las operaciones se guardan aparte por si hay que fusionarlas con lo que haya en disco
+        with self._bloqueo:
+            diario = self._diarios.setdefault(nombre_archivo, _Diario())
+            diario.secuencia += 1
+            diario.operaciones += [(diario.secuencia, operacion) for operacion in operaciones]
+            diario.acciones[diario.secuencia] = accion_actual()
+            diario.sesiones[diario.secuencia] = _sesion_actual()
+            escritor.programar(nombre_archivo, (datos, diario.secuencia),
+                               lambda pendiente: self._confirmar(tabla, nombre_archivo, *pendiente))
+
+    # Escribe en disco (desde el hilo del escritor) la tabla con las operaciones hasta `secuencia`
+    def _confirmar(self, tabla, nombre_archivo, datos, secuencia):
+        with bloqueo_archivo(nombre_archivo):
+            with self._bloqueo:
+                diario = self._diarios[nombre_archivo]
+                if secuencia <= diario.confirmada:
+                    return  # Una escritura posterior (p. ej. desde vaciar()) ya incluía estos cambios
+                operaciones = [(numero, operacion) for numero, operacion in diario.operaciones if numero <= secuencia]
+                acciones = dict(diario.acciones)
+                sesiones = dict(diario.sesiones)
+                base = diario.firma
+            propios = datos
+            descartadas = []
+            # (una firma None es un archivo que aún no existía, o uno cuya lectura no se pudo fijar)
+            fusionado = firma_archivo(nombre_archivo) != base
+            if fusionado:
+                # Otro proceso ha escrito el archivo después de leerlo: se parte de lo que hay en disco
+                datos, descartadas = _aplicar_operaciones(_normalizar(tabla, _leer_json(tabla, nombre_archivo)),
+                                                          [operacion for _, operacion in operaciones])
+            historial = Historial(nombre_archivo)
+            # La primera vez, la tabla que había es la instantánea de partida (con sus ids)
+            anterior = None if historial.existe() else _serializar(_normalizar(tabla, _leer_json(tabla, nombre_archivo)))
+            contenido = _serializar(datos)
+            firma = escribir_atomico(nombre_archivo, contenido)
+            historial.registrar(_cambios_historial(operaciones, descartadas, acciones), contenido, anterior)
+        # Lo escrito queda en la caché, así no hay que volver a leer el archivo
+        cache.poner(nombre_archivo, datos, firma, tipo=tabla)
+        with self._bloqueo:
+            diario.operaciones = [(numero, operacion) for numero, operacion in diario.operaciones if numero > secuencia]
+            diario.acciones = {numero: valor for numero, valor in diario.acciones.items() if numero > secuencia}
+            diario.sesiones = {numero: valor for numero, valor in diario.sesiones.items() if numero > secuencia}
+            diario.confirmada = secuencia
+            # Si se ha fusionado y quedan cambios pendientes, estos se hicieron sobre la tabla
+            # anterior: se deja la firma antigua para que también se fusionen al escribirlos
+            if not fusionado or not diario.operaciones:
+                diario.firma = firma
+            numeros = {id(operacion): numero for numero, operacion in operaciones}
+            for operacion in descartadas:
+                self.conflictos.setdefault(sesiones[numeros[id(operacion)]], []).append(
+                    (tabla, nombre_archivo, operacion, _concepto(propios, operacion)))
+            # Las sesiones que ya no vuelven a preguntar no se guardan para siempre
+            while len(self.conflictos) > MAXIMO_SESIONES_CON_CONFLICTOS:
+                del self.conflictos[next(iter(self.conflictos))]
+
+    # Reserva `cantidad` ids consecutivos con un contador en disco compartido por todos los procesos.
+    # `minimo` da el primer id libre cuando aún no existe el contador
+    def _reservar_ids(self, nombre_archivo, cantidad, minimo):
+        ruta = f"{nombre_archivo}.contador"
+        with bloqueo_archivo(ruta):
+            try:
+                with open(ruta, 'r') as archivo:
+                    siguiente = int(archivo.read())
+            except (FileNotFoundError, ValueError):
+                siguiente = minimo()
+            escribir_atomico(ruta, str(siguiente + cantidad))
+        return siguiente
+
+    # Número que cambia cada vez que cambian los datos de la tabla
+    def version(self, tabla, nombre_archivo):
+        actual = self._actual(tabla, nombre_archivo)
+        with self._bloqueo:
+            objeto, numero = self._versiones.get(nombre_archivo, (None, 0))
+            if objeto is not actual:
+                numero += 1
+                self._versiones[nombre_archivo] = (actual, numero)
+            return numero
+
+    # Una fila como diccionario, o None si no existe
+    def fila(self, tabla, nombre_archivo, id, mes=None):
+        actual = self._actual(tabla, nombre_archivo)
+        return actual.loc[id].to_dict() if id in actual.index else None
+
+    # Identifica los datos guardados en disco aunque se reinicie el proceso: la firma del archivo.
+    # None mientras quedan cambios sin escribir
+    def huella(self, tabla, nombre_archivo):
+        if escritor.pendiente(nombre_archivo) is not None:
+            return None
+        firma = firma_archivo(nombre_archivo)
+        return list(firma) if firma else None
+
+
+# Nombre de archivo para la partición de un mes: "Octubre 2024" -> "octubre-2024.json"
+def _nombre_particion(mes):
+    texto = unicodedata.normalize("NFKD", mes or "sin mes").encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "-", texto.lower()).strip("-") + ".json"
+
+
+def _leer_manifiesto(ruta):
+    with open(ruta, 'r') as archivo:
+        return json.load(archivo)
+
+
+class AlmacenParticionado(AlmacenJSON):
+    """Guarda los gastos en un archivo por mes dentro de un directorio, con un manifiesto.
+
+    Cargar o guardar un mes sólo lee o escribe el archivo de ese mes, y cada mes
+    tiene su historial. Un cambio que toca varios meses (p. ej. mover un gasto de
+    mes) es una sola acción. Los eventos siguen en un único archivo, como en AlmacenJSON.
+    """
+
+    def cargar(self, tabla, nombre_archivo, mes=None, desde=None, hasta=None):
+        if tabla != "gastos":
+            return super().cargar(tabla, nombre_archivo, mes=mes, desde=desde, hasta=hasta)
+        meses = self._manifiesto(nombre_archivo)["meses"]
+        if mes is not None:
+            meses = {mes: meses[mes]} if mes in meses else {}
+        particiones = [self._actual(tabla, self._ruta_particion(nombre_archivo, nombre)) for nombre in meses.values()]
+        if not particiones:
+            return _normalizar(tabla, pd.DataFrame(columns=COLUMNAS[tabla]))
+        datos = particiones[0] if len(particiones) == 1 else _concatenar(particiones)
+        return _filtrar(datos, mes, desde, hasta)
+
+    def guardar(self, tabla, nombre_archivo, datos):
+        if tabla != "gastos":
+            return super().guardar(tabla, nombre_archivo, datos)
+        datos = _normalizar(tabla, datos.copy())
+        with self._bloqueo, accion():
+            grupos = dict(iter(datos.groupby(datos["Mes"].fillna(""), sort=False)))
+            self._registrar_meses(nombre_archivo, grupos)
+            for mes, nombre in self._manifiesto(nombre_archivo)["meses"].items():
+                ruta = self._ruta_particion(nombre_archivo, nombre)
+                # Los meses que ya no tienen gastos se quedan con la partición vacía
+                self._reemplazar(tabla, ruta, grupos[mes] if mes in grupos else self._actual(tabla, ruta).iloc[0:0])
+
+    def insertar(self, tabla, nombre_archivo, filas):
+        if tabla != "gastos":
+            return super().insertar(tabla, nombre_archivo, filas)
+        with self._bloqueo, accion():
+            nuevas = pd.DataFrame(filas, columns=COLUMNAS[tabla])
+            siguiente = self._reservar_ids(nombre_archivo, len(nuevas), lambda: self._primer_id_libre(nombre_archivo))
+            nuevas.index = pd.RangeIndex(siguiente, siguiente + len(nuevas), name="id")
+            grupos = dict(iter(nuevas.groupby(nuevas["Mes"].fillna(""), sort=False)))
+            self._registrar_meses(nombre_archivo, grupos)
+            for mes, grupo in grupos.items():
+                self._anadir_a_particion(nombre_archivo, mes, grupo)
+        return list(nuevas.index)
+
+    def actualizar(self, tabla, nombre_archivo, id, cambios, mes=None, antes=None):
+        if tabla != "gastos":
+            return super().actualizar(tabla, nombre_archivo, id, cambios, antes=antes)
+        with self._bloqueo, accion():
+            mes = self._buscar_mes(nombre_archivo, id, mes)
+            if mes is None:
+                raise ConflictoEdicion(f"El registro {id} ya no existe.")
+            nuevo_mes = cambios.get("Mes", mes) or ""
+            if nuevo_mes == mes:
+                ruta = self._ruta_particion(nombre_archivo, self._manifiesto(nombre_archivo)["meses"][mes])
+                return super().actualizar(tabla, ruta, id, cambios, antes=antes)
+
+            # El gasto cambia de mes: pasa a la partición del nuevo mes con el mismo id
+            ruta = self._ruta_particion(nombre_archivo, self._manifiesto(nombre_archivo)["meses"][mes])
+            actual = self._actual(tabla, ruta)
+            _comprobar_antes(actual, id, antes)
+            fila = actual.loc[[id]].copy()
+            _asignar(fila, id, cambios)
+            self._registrar_meses(nombre_archivo, [nuevo_mes])
+            super().eliminar(tabla, ruta, [id])
+            self._anadir_a_particion(nombre_archivo, nuevo_mes, fila)
+
+    def eliminar(self, tabla, nombre_archivo, ids, mes=None):
+        if tabla != "gastos":
+            return super().eliminar(tabla, nombre_archivo, ids)
+        with self._bloqueo, accion():
+            meses = self._manifiesto(nombre_archivo)["meses"]
+            for id in ids:
+                mes_id = self._buscar_mes(nombre_archivo, id, mes)
+                if mes_id is not None:
+                    super().eliminar(tabla, self._ruta_particion(nombre_archivo, meses[mes_id]), [id])
+
+    def renombrar(self, tabla, nombre_archivo, columna, anterior, nuevo):
+        if tabla != "gastos":
+            return super().renombrar(tabla, nombre_archivo, columna, anterior, nuevo)
+        with self._bloqueo, accion():
+            for nombre in self._manifiesto(nombre_archivo)["meses"].values():
+                super().renombrar(tabla, self._ruta_particion(nombre_archivo, nombre), columna, anterior, nuevo)
+
+    def restaurar(self, tabla, nombre_archivo, filas):
+        if tabla != "gastos":
+            return super().restaurar(tabla, nombre_archivo, filas)
+        with self._bloqueo, accion():
+            filas = filas[[self._buscar_mes(nombre_archivo, id) is None for id in filas.index]]
+            grupos = dict(iter(filas.groupby(filas["Mes"].fillna(""), sort=False)))
+            self._registrar_meses(nombre_archivo, grupos)
+            for mes, grupo in grupos.items():
+                self._anadir_a_particion(nombre_archivo, mes, grupo)
+        return list(filas.index)
+
+    # Con `mes` sólo se reconstruye la partición de ese mes
+    def estado(self, tabla, nombre_archivo, momento, mes=None):
+        if tabla != "gastos":
+            return super().estado(tabla, nombre_archivo, momento, mes=mes)
+        meses = self._manifiesto(nombre_archivo)["meses"]
+        if mes is not None:
+            meses = {mes: meses[mes]} if mes in meses else {}
+        particiones = [super(AlmacenParticionado, self).estado(tabla, self._ruta_particion(nombre_archivo, nombre), momento)
+                       for nombre in meses.values()]
+        particiones = [datos for datos in particiones if len(datos)]  # Meses que aún no tenían gastos
+        if not particiones:
+            return _normalizar(tabla, pd.DataFrame(columns=COLUMNAS[tabla]))
+        return particiones[0] if len(particiones) == 1 else _concatenar(particiones)
+
+    def _archivos(self, tabla, nombre_archivo):
+        if tabla != "gastos":
+            return super()._archivos(tabla, nombre_archivo)
+        return [self._ruta_particion(nombre_archivo, nombre) for nombre in self._manifiesto(nombre_archivo)["meses"].values()]
+
+    # Cada partición tiene su número de versión, que sólo crece: su suma cambia con cualquier cambio
+    def version(self, tabla, nombre_archivo):
+        if tabla != "gastos":
+            return super().version(tabla, nombre_archivo)
+        return sum(super(AlmacenParticionado, self).version(tabla, self._ruta_particion(nombre_archivo, nombre))
+                   for nombre in self._manifiesto(nombre_archivo)["meses"].values())
+
+    def fila(self, tabla, nombre_archivo, id, mes=None):
+        if tabla != "gastos":
+            return super().fila(tabla, nombre_archivo, id)
+        mes = self._buscar_mes(nombre_archivo, id, mes)
+        if mes is None:
+            return None
+        return super().fila(tabla, self._ruta_particion(nombre_archivo, self._manifiesto(nombre_archivo)["meses"][mes]), id)
+
+    def huella(self, tabla, nombre_archivo):
+        if tabla != "gastos":
+            return super().huella(tabla, nombre_archivo)
+        huellas = {nombre: super(AlmacenParticionado, self).huella(tabla, self._ruta_particion(nombre_archivo, nombre))
+                   for nombre in self._manifiesto(nombre_archivo)["meses"].values()}
+        return None if None in huellas.values() else huellas
+
+    def _directorio(self, nombre_archivo):
+        return os.path.splitext(nombre_archivo)[0]
+
+    def _ruta_particion(self, nombre_archivo, nombre):
+        return os.path.join(self._directorio(nombre_archivo), nombre)
+
+    def _ruta_manifiesto(self, nombre_archivo):
+        return os.path.join(self._directorio(nombre_archivo), "manifiesto.json")
+
+    def _manifiesto(self, nombre_archivo):
+        ruta = self._ruta_manifiesto(nombre_archivo)
+        if not os.path.exists(ruta):
+            with bloqueo_archivo(self._directorio(nombre_archivo)):
+                if not os.path.exists(ruta):  # Otro proceso puede haberlo convertido mientras se esperaba
+                    self._convertir(nombre_archivo)
+        return cache.obtener(ruta, _leer_manifiesto, tipo="manifiesto")
+
+    # Añade al manifiesto los meses que aún no tiene. Se lee y escribe con el manifiesto
+    # bloqueado, para no perder los meses que haya añadido otro proceso
+    def _registrar_meses(self, nombre_archivo, meses):
+        if all(mes in self._manifiesto(nombre_archivo)["meses"] for mes in meses):
+            return
+        ruta = self._ruta_manifiesto(nombre_archivo)
+        with bloqueo_archivo(ruta):
+            manifiesto = _leer_manifiesto(ruta)
+            for mes in meses:
+                manifiesto["meses"].setdefault(mes, _nombre_particion(mes))
+            cache.poner(ruta, manifiesto, escribir_atomico(ruta, json.dumps(manifiesto)), tipo="manifiesto")
+
+    def _anadir_a_particion(self, nombre_archivo, mes, filas):
+        ruta = self._ruta_particion(nombre_archivo, self._manifiesto(nombre_archivo)["meses"][mes])
+        actual = self._actual("gastos", ruta)
+        self._programar("gastos", ruta, _concatenar([actual, filas]), _operaciones(actual.iloc[0:0], filas))
+
+    # Mes en el que está guardado un gasto; si no se indica, se busca en todas las particiones
+    def _buscar_mes(self, nombre_archivo, id, mes=None):
+        meses = self._manifiesto(nombre_archivo)["meses"]
+        candidatos = [mes] if mes in meses else []
+        candidatos += [otro for otro in meses if otro != mes]
+        for candidato in candidatos:
+            if id in self._actual("gastos", self._ruta_particion(nombre_archivo, meses[candidato])).index:
+                return candidato
+        return None
+
+    # Primer id sin usar en ninguna partición (manifiestos antiguos lo guardaban en "siguiente_id")
+    def _primer_id_libre(self, nombre_archivo):
+        manifiesto = self._manifiesto(nombre_archivo)
+        if "siguiente_id" in manifiesto:
+            return manifiesto["siguiente_id"]
+        ids = [int(datos.index.max()) + 1 for datos in
+               (self._actual("gastos", self._ruta_particion(nombre_archivo, nombre)) for nombre in manifiesto["meses"].values())
+               if len(datos)]
+        return max(ids, default=0)
+
+    # Reparte el archivo único de gastos en un archivo por mes (sólo la primera vez)
+    def _convertir(self, nombre_archivo):
+        datos = super()._actual("gastos", nombre_archivo)
+        os.makedirs(self._directorio(nombre_archivo), exist_ok=True)
+        manifiesto = {"meses": {}}
+        for mes, filas in datos.groupby(datos["Mes"].fillna(""), sort=False):
+            manifiesto["meses"][mes] = _nombre_particion(mes)
+            escribir_atomico(self._ruta_particion(nombre_archivo, manifiesto["meses"][mes]), _serializar(filas))
+        escribir_atomico(self._ruta_manifiesto(nombre_archivo), json.dumps(manifiesto))
+
+
+ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS gastos (
+    id INTEGER PRIMARY KEY,
+    "Mes" TEXT,
+    "Concepto" TEXT,
+    "Cantidad" NUMERIC,
+    "Pagado" INTEGER,
+    "Categoría" TEXT,
+    "Fecha" TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_gastos_mes_categoria ON gastos ("Mes", "Categoría");
+CREATE INDEX IF NOT EXISTS idx_gastos_fecha ON gastos ("Fecha");
+
+CREATE TABLE IF NOT EXISTS eventos (
+    id INTEGER PRIMARY KEY,
+    "Fecha" TEXT,
+    "Fecha_fin" TEXT,
+    "Hora" TEXT,
+    "Quien" TEXT,
+    "Concepto" TEXT,
+    "Todo_el_dia" INTEGER,
+    "Recurrencia" TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_eventos_fecha ON eventos ("Fecha");
+"""
+
+# Columnas añadidas después de crear la primera versión de la base
+COLUMNAS_NUEVAS_SQLITE = {"eventos": {"Fecha_fin": "TEXT", "Recurrencia": "TEXT"}}
+ESQUEMA_SQLITE_ADICIONAL = """
+CREATE INDEX IF NOT EXISTS idx_eventos_fin ON eventos ("Fecha_fin");
+
+-- Número de versión por tabla, lo incrementan los triggers en cada cambio
+CREATE TABLE IF NOT EXISTS versiones (tabla TEXT PRIMARY KEY, version INTEGER NOT NULL);
+INSERT OR IGNORE INTO versiones VALUES ('gastos', 0), ('eventos', 0);
+""" + "".join(f"""
+CREATE TRIGGER IF NOT EXISTS version_{tabla}_{operacion} AFTER {operacion} ON {tabla}
+BEGIN UPDATE versiones SET version = version + 1 WHERE tabla = '{tabla}'; END;
+""" for tabla in ("gastos", "eventos") for operacion in ("INSERT", "UPDATE", "DELETE"))
+
+
+def _fila_json(fila, tabla):
+    return "json_object(" + ", ".join(f"'{columna}', {fila}.\"{columna}\"" for columna in COLUMNAS[tabla]) + ")"
+
+
+def _columnas_fila(fila, tabla):
+    return "(" + ", ".join(f'{fila}."{columna}"' for columna in COLUMNAS[tabla]) + ")"
+
+
+# Historial de cambios: los triggers guardan cada fila insertada, editada o borrada con sus valores
+# de antes y de después; el almacén marca después a qué acción pertenecen. Cada cierto número de
+# operaciones se guarda una instantánea de la tabla entera (ver historial.Historial)
+_AHORA_SQLITE = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+ESQUEMA_SQLITE_HISTORIAL = """
+CREATE TABLE IF NOT EXISTS historial (
+    n INTEGER PRIMARY KEY AUTOINCREMENT,
+    tabla TEXT NOT NULL,
+    momento TEXT NOT NULL,
+    accion TEXT,
+    deshace TEXT,
+    tipo TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    antes TEXT,
+    despues TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_historial_momento ON historial (tabla, momento);
+CREATE INDEX IF NOT EXISTS idx_historial_accion ON historial (accion);
+CREATE INDEX IF NOT EXISTS idx_historial_deshace ON historial (deshace);
+CREATE TABLE IF NOT EXISTS instantaneas (
+    tabla TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    momento TEXT NOT NULL,
+    filas TEXT NOT NULL,
+    PRIMARY KEY (tabla, n)
+);
+""" + "".join(f"""
+CREATE TRIGGER IF NOT EXISTS historial_{tabla}_insert AFTER INSERT ON {tabla}
+BEGIN INSERT INTO historial (tabla, momento, tipo, id, despues)
+      VALUES ('{tabla}', {_AHORA_SQLITE}, 'insertar', NEW.id, {_fila_json("NEW", tabla)}); END;
+CREATE TRIGGER IF NOT EXISTS historial_{tabla}_update AFTER UPDATE ON {tabla}
+WHEN {_columnas_fila("OLD", tabla)} IS NOT {_columnas_fila("NEW", tabla)}
+BEGIN INSERT INTO historial (tabla, momento, tipo, id, antes, despues)
+      VALUES ('{tabla}', {_AHORA_SQLITE}, 'actualizar', NEW.id, {_fila_json("OLD", tabla)}, {_fila_json("NEW", tabla)}); END;
+CREATE TRIGGER IF NOT EXISTS historial_{tabla}_delete AFTER DELETE ON {tabla}
+BEGIN INSERT INTO historial (tabla, momento, tipo, id, antes)
+      VALUES ('{tabla}', {_AHORA_SQLITE}, 'eliminar', OLD.id, {_fila_json("OLD", tabla)}); END;
+""" for tabla in ("gastos", "eventos"))
+
+
+# Una fila del historial de SQLite como operación (tipo, id, antes, después), como las de AlmacenJSON:
+# en las ediciones sólo con las columnas que cambian
+def _operacion_sqlite(tabla, tipo, id, antes, despues):
+    antes = json.loads(antes) if antes else None
+    despues = json.loads(despues) if despues else None
+    for fila in (antes, despues):
+        for columna in COLUMNAS_BOOLEANAS[tabla]:
+            if fila is not None and fila.get(columna) is not None:
+                fila[columna] = bool(fila[columna])
+    if tipo == "actualizar":
+        columnas = [columna for columna in despues if not _iguales(antes.get(columna), despues[columna])]
+        antes, despues = {columna: antes[columna] for columna in columnas}, {columna: despues[columna] for columna in columnas}
+    return [tipo, id, antes, despues]
+
+
+# sqlite3 no acepta tipos de numpy ni NaN
+def _valor_sqlite(valor):
+    if hasattr(valor, "item"):
+        valor = valor.item()
+    if valor is None or (isinstance(valor, float) and valor != valor):
+        return None
+    return valor
+
+
+class AlmacenSQLite:
+    """Guarda gastos y eventos en una base SQLite con índices por mes, categoría y fecha.
+
+    Las inserciones, ediciones y borrados tocan sólo las filas afectadas. Varios
+    procesos pueden escribir a la vez: SQLite se encarga de los bloqueos. Los
+    triggers guardan cada cambio en la tabla "historial".
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._bloqueo = threading.RLock()
+        # Si otro proceso está escribiendo se espera hasta `timeout` segundos
+        self._conexion_proceso = sqlite3.connect(ruta, timeout=30, check_same_thread=False)
+        with self._transaccion() as conexion:
+            # Con WAL los lectores no esperan a quien está escribiendo
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.executescript(ESQUEMA_SQLITE)
+            for tabla, columnas in COLUMNAS_NUEVAS_SQLITE.items():
+                existentes = {fila[1] for fila in conexion.execute(f"PRAGMA table_info({tabla})")}
+                for columna, tipo in columnas.items():
+                    if columna not in existentes:
+                        conexion.execute(f'ALTER TABLE {tabla} ADD COLUMN "{columna}" {tipo}')
+            conexion.executescript(ESQUEMA_SQLITE_ADICIONAL)
+            sin_historial = conexion.execute("SELECT 1 FROM sqlite_master WHERE name = 'historial'").fetchone() is None
+            conexion.executescript(ESQUEMA_SQLITE_HISTORIAL)
+            if sin_historial:
+                # El historial empieza con lo que ya hay en la base
+                for tabla in COLUMNAS:
+                    self._instantanea(conexion, tabla, 0)
+
+    # Una sola conexión para todo el proceso: Streamlit ejecuta cada rerun en un hilo nuevo, así que
+    # una por hilo sería abrir una nueva en cada rerun. Se usa siempre con el bloqueo tomado, para
+    # que las consultas y transacciones de dos sesiones no se mezclen
+    @contextmanager
+    def _conexion(self):
+        with self._bloqueo:
+            yield self._conexion_proceso
+
+    # Lo mismo en una transacción: se confirma al salir, o se deshace si hay un error
+    @contextmanager
+    def _transaccion(self):
+        with self._conexion() as conexion, conexion:
+            yield conexion
+
+    def version(self, tabla, nombre_archivo):
+        with self._conexion() as conexion:
+            return conexion.execute("SELECT version FROM versiones WHERE tabla = ?", (tabla,)).fetchone()[0]
+
+    # El número de versión lo guarda la propia base, así que sirve también entre procesos y reinicios
+    def huella(self, tabla, nombre_archivo):
+        return ["sqlite", self.version(tabla, nombre_archivo)]
+
+    def fila(self, tabla, nombre_archivo, id, mes=None):
+        columnas = ", ".join(f'"{columna}"' for columna in COLUMNAS[tabla])
+        with self._conexion() as conexion:
+            valores = conexion.execute(f"SELECT {columnas} FROM {tabla} WHERE id = ?", (_valor_sqlite(id),)).fetchone()
+        if valores is None:
+            return None
+        fila = dict(zip(COLUMNAS[tabla], valores))
+        for columna in COLUMNAS_BOOLEANAS[tabla]:
+            fila[columna] = bool(fila[columna])
+        return fila
+
+    def contar(self, tabla):
+        with self._conexion() as conexion:
+            return conexion.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+
+    def cargar(self, tabla, nombre_archivo, mes=None, desde=None, hasta=None):
+        condiciones, parametros = [], []
+        if mes is not None:
+            condiciones.append('"Mes" = ?')
+            parametros.append(mes)
+        if tabla == "eventos" and desde is not None and hasta is not None:
+            # Eventos cuyo rango toca [desde, hasta), más los recurrentes que ya han empezado
+            # (sin Fecha_fin, un evento antiguo de un solo día)
+            condiciones.append('"Fecha" < ? AND (COALESCE("Fecha_fin", "Fecha") >= ? OR "Recurrencia" IS NOT NULL)')
+            parametros += [hasta, desde]
+        else:
+            if desde is not None:
+                condiciones.append('"Fecha" >= ?')
+                parametros.append(desde)
+            if hasta is not None:
+                condiciones.append('"Fecha" < ?')
+                parametros.append(hasta)
+
+        columnas = ", ".join(f'"{columna}"' for columna in COLUMNAS[tabla])
+        consulta = f"SELECT id, {columnas} FROM {tabla}"
+        if condiciones:
+            consulta += " WHERE " + " AND ".join(condiciones)
+        with self._conexion() as conexion:
+            datos = pd.read_sql_query(consulta + " ORDER BY id", conexion, params=parametros, index_col="id")
+        for columna in COLUMNAS_BOOLEANAS[tabla]:
+            datos[columna] = datos[columna].astype(bool)
+        return _codificar(tabla, datos)
+
+    def guardar(self, tabla, nombre_archivo, datos):
+        datos = _normalizar(tabla, datos.copy())
+        actual = self.cargar(tabla, nombre_archivo)
+        cambiadas = filas_modificadas(actual, datos)
+        if not cambiadas:
+            return
+        borradas = [id for id in cambiadas if id not in datos.index]
+        escritas = datos.loc[[id for id in cambiadas if id in datos.index]]
+        with self._transaccion() as conexion:
+            self._borrar(conexion, tabla, borradas)
+            self._escribir_filas(conexion, tabla, escritas, reemplazar=True)
+            self._registrar(conexion, tabla)
+
+    def insertar(self, tabla, nombre_archivo, filas):
+        nuevas = pd.DataFrame(filas, columns=COLUMNAS[tabla])
+        with self._transaccion() as conexion:
+            ids = self._escribir_filas(conexion, tabla, nuevas, reemplazar=False)
+            self._registrar(conexion, tabla)
+        return ids
+
+    def actualizar(self, tabla, nombre_archivo, id, cambios, mes=None, antes=None):
+        asignaciones = ", ".join(f'"{columna}" = ?' for columna in cambios)
+        # La fila sólo se actualiza si sigue teniendo los valores que se vieron al editar
+        condiciones = "".join(f' AND "{columna}" IS ?' for columna in antes or {})
+        with self._transaccion() as conexion:
+            cursor = conexion.execute(f"UPDATE {tabla} SET {asignaciones} WHERE id = ?{condiciones}",
+                                      [_valor_sqlite(valor) for valor in cambios.values()] + [_valor_sqlite(id)] +
+                                      [_valor_sqlite(valor) for valor in (antes or {}).values()])
+            self._registrar(conexion, tabla)
+        if cursor.rowcount == 0:
+            raise ConflictoEdicion(f"El registro {id} ha cambiado o ya no existe.")
+
+    def eliminar(self, tabla, nombre_archivo, ids, mes=None):
+        with self._transaccion() as conexion:
+            self._borrar(conexion, tabla, ids)
+            self._registrar(conexion, tabla)
+
+    def renombrar(self, tabla, nombre_archivo, columna, anterior, nuevo):
+        with self._transaccion() as conexion:
+            conexion.execute(f'UPDATE {tabla} SET "{columna}" = ? WHERE "{columna}" = ?', (nuevo, anterior))
+            self._registrar(conexion, tabla)
+
+    def restaurar(self, tabla, nombre_archivo, filas):
+        with self._transaccion() as conexion:
+            existentes = {fila[0] for fila in conexion.execute(
+                f"SELECT id FROM {tabla} WHERE id IN ({', '.join('?' * len(filas))})",
+                [_valor_sqlite(id) for id in filas.index])}
+            filas = filas[~filas.index.isin(existentes)]
+            self._escribir_filas(conexion, tabla, filas, reemplazar=True)
+            self._registrar(conexion, tabla)
+        return list(filas.index)
+
+    def cambios(self, tabla, nombre_archivo, desde=None, hasta=None):
+        condiciones, parametros = ["tabla = ?"], [tabla]
+        if desde is not None:
+            condiciones.append("momento >= ?")
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append("momento <= ?")
+            parametros.append(hasta)
+        with self._conexion() as conexion:
+            filas = conexion.execute(
+                "SELECT momento, COALESCE(accion, 'n' || n), deshace, tipo, id, antes, despues FROM historial "
+                f"WHERE {' AND '.join(condiciones)} ORDER BY n", parametros).fetchall()
+        return self._agrupar_cambios(tabla, filas)
+
+    def ultima_accion(self, tabla, nombre_archivo):
+        with self._conexion() as conexion:
+            fila = conexion.execute(
+                "SELECT accion FROM historial WHERE tabla = ? AND accion IS NOT NULL AND deshace IS NULL "
+                "AND accion NOT IN (SELECT deshace FROM historial WHERE tabla = ? AND deshace IS NOT NULL) "
+                "ORDER BY n DESC LIMIT 1", (tabla, tabla)).fetchone()
+            if fila is None:
+                return None
+            filas = conexion.execute("SELECT momento, accion, deshace, tipo, id, antes, despues FROM historial "
+                                     "WHERE accion = ? ORDER BY n", fila).fetchall()
+        return ultima_accion(self._agrupar_cambios(tabla, filas))
+
+    # La instantánea anterior a `momento` (o la más antigua que se guarda) más las operaciones que la
+    # siguen hasta ese momento
+    def estado(self, tabla, nombre_archivo, momento, mes=None):
+        with self._conexion() as conexion:
+            n, filas = conexion.execute(
+                "SELECT n, filas FROM instantaneas WHERE tabla = ? AND n = COALESCE("
+                "(SELECT MAX(n) FROM instantaneas WHERE tabla = ? AND momento <= ?), "
+                "(SELECT MIN(n) FROM instantaneas WHERE tabla = ?))", (tabla, tabla, momento, tabla)).fetchone()
+            operaciones = conexion.execute(
+                "SELECT tipo, id, antes, despues FROM historial WHERE n > ? AND tabla = ? AND momento <= ? ORDER BY n",
+                (n, tabla, momento)).fetchall()
+        filas = {fila["id"]: fila for fila in json.loads(filas)}
+        aplicar(filas, [_operacion_sqlite(tabla, *operacion) for operacion in operaciones])
+        datos = pd.DataFrame(list(filas.values()), columns=["id"] + COLUMNAS[tabla]).set_index("id")
+        for columna in COLUMNAS_BOOLEANAS[tabla]:
+            datos[columna] = datos[columna].astype(bool)
+        return _filtrar(_codificar(tabla, datos.sort_index()), mes)
+
+    # Los conflictos se resuelven al escribir cada cambio, no queda ninguno pendiente
+    def tomar_conflictos(self, sesion=None):
+        return []
+
+    # Al final de cada escritura: sus filas del historial se marcan con la acción en curso y, si desde
+    # la última instantánea hay más de OPERACIONES_POR_INSTANTANEA operaciones y más que filas tiene la
+    # tabla, se guarda otra. De las anteriores se guardan INSTANTANEAS_GUARDADAS, y del historial sólo
+    # lo que sigue a la más antigua
+    def _registrar(self, conexion, tabla):
+        conexion.execute("UPDATE historial SET accion = ?, deshace = ? WHERE accion IS NULL", accion_actual())
+        ultima = conexion.execute("SELECT MAX(n) FROM instantaneas WHERE tabla = ?", (tabla,)).fetchone()[0] or 0
+        operaciones, n = conexion.execute("SELECT COUNT(*), MAX(n) FROM historial WHERE n > ? AND tabla = ?",
+                                          (ultima, tabla)).fetchone()
+        if operaciones <= OPERACIONES_POR_INSTANTANEA:
+            return
+        if operaciones <= conexion.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]:
+            return
+        self._instantanea(conexion, tabla, n)
+        conexion.execute("DELETE FROM instantaneas WHERE tabla = ? AND n NOT IN "
+                         "(SELECT n FROM instantaneas WHERE tabla = ? ORDER BY n DESC LIMIT ?)",
+                         (tabla, tabla, INSTANTANEAS_GUARDADAS))
+        conexion.execute("DELETE FROM historial WHERE tabla = ? AND n <= "
+                         "(SELECT MIN(n) FROM instantaneas WHERE tabla = ?)", (tabla, tabla))
+
+    def _instantanea(self, conexion, tabla, n):
+        conexion.execute(f"INSERT OR REPLACE INTO instantaneas SELECT ?, ?, {_AHORA_SQLITE}, "
+                         f"COALESCE(json_group_array(json_insert({_fila_json(tabla, tabla)}, '$.id', id)), '[]') "
+                         f"FROM {tabla}", (tabla, n))
+
+    # Filas (momento, acción, deshace, tipo, id, antes, después) seguidas de una misma acción -> un cambio
+    def _agrupar_cambios(self, tabla, filas):
+        cambios = []
+        for momento, accion_fila, deshace, *operacion in filas:
+            if not cambios or cambios[-1]["accion"] != accion_fila:
+                cambios.append({"momento": momento, "accion": accion_fila, "deshace": deshace, "operaciones": []})
+            cambios[-1]["operaciones"].append(_operacion_sqlite(tabla, *operacion))
+        return cambios
+
+    # El historial de la tabla empieza de nuevo con sus datos actuales (p. ej. tras copiar los JSON)
+    def _empezar_historial(self, tabla, nombre_archivo=None):
+        with self._transaccion() as conexion:
+            conexion.execute("DELETE FROM historial WHERE tabla = ?", (tabla,))
+            conexion.execute("DELETE FROM instantaneas WHERE tabla = ?", (tabla,))
+            self._instantanea(conexion, tabla, 0)
+
+    def _borrar(self, conexion, tabla, ids):
+        conexion.executemany(f"DELETE FROM {tabla} WHERE id = ?", [(_valor_sqlite(id),) for id in ids])
+
+    def _escribir_filas(self, conexion, tabla, filas, reemplazar):
+        columnas = COLUMNAS[tabla]
+        if reemplazar:
+            # Si el id ya existe se actualiza la fila (no se borra y se vuelve a insertar, como con
+            # INSERT OR REPLACE): así el historial la registra como una edición
+            nombres = ", ".join(["id"] + [f'"{columna}"' for columna in columnas])
+            asignaciones = ", ".join(f'"{columna}" = excluded."{columna}"' for columna in columnas)
+            consulta = (f"INSERT INTO {tabla} ({nombres}) VALUES ({', '.join('?' * (len(columnas) + 1))}) "
+                        f"ON CONFLICT(id) DO UPDATE SET {asignaciones}")
+        else:
+            nombres = ", ".join(f'"{columna}"' for columna in columnas)
+            consulta = f"INSERT INTO {tabla} ({nombres}) VALUES ({', '.join('?' * len(columnas))})"
+
+        ids = []
+        for id, fila in zip(filas.index, filas[columnas].itertuples(index=False)):
+            valores = [_valor_sqlite(valor) for valor in fila]
+            if reemplazar:
+                valores = [_valor_sqlite(id)] + valores
+            ids.append(conexion.execute(consulta, valores).lastrowid)
+        return ids
+
+
+# Copia una sola vez los gastos y eventos de los archivos JSON a la base SQLite
+def migrar_json_a_sqlite(almacen, archivo_gastos="gastos_fijos.json", archivo_eventos="eventos.json"):
+    origen = AlmacenJSON()
+    for tabla, nombre_archivo in (("gastos", archivo_gastos), ("eventos", archivo_eventos)):
+        if almacen.contar(tabla) == 0:
+            datos = origen.cargar(tabla, nombre_archivo)
+            almacen.guardar(tabla, nombre_archivo, compactar_eventos(datos) if tabla == "eventos" else datos)
+            # Lo copiado es el punto de partida del historial, no un cambio que se pueda deshacer
+            almacen._empezar_historial(tabla, nombre_archivo)
+
+
+_almacen = None
+_bloqueo_almacen = threading.Lock()
+
+
+# El tipo de almacén se elige con la variable de entorno PRESUPUESTO_ALMACEN
+# ("json", "particionado" o "sqlite")
+def obtener_almacen():
+    global _almacen
+    with _bloqueo_almacen:
+        if _almacen is None:
+            tipo = os.environ.get("PRESUPUESTO_ALMACEN", "json")
+            if tipo == "sqlite":
+                ruta = os.environ.get("PRESUPUESTO_DB", "presupuesto.db")
+                # Si varios procesos arrancan a la vez, sólo el que crea la base copia los JSON
+                with bloqueo_archivo(ruta):
+                    nueva = not os.path.exists(ruta)
+                    _almacen = AlmacenSQLite(ruta)
+                    if nueva:
+                        migrar_json_a_sqlite(_almacen)
+            elif tipo == "particionado":
+                _almacen = AlmacenParticionado()
+            else:
+                _almacen = AlmacenJSON()
+        return _almacen
+
+
+# Funciones para guardar y cargar los datos
+def cargar_datos(nombre_archivo, mes=None):
+    return obtener_almacen().cargar("gastos", nombre_archivo, mes=mes)
+
+def guardar_datos(nombre_archivo, datos):
+    obtener_almacen().guardar("gastos", nombre_archivo, datos)
+
+def insertar_gasto(nombre_archivo, gasto):
+    return insertar_gastos(nombre_archivo, [gasto])[0]
+
+# Varios gastos en una sola escritura. Devuelve sus ids
+def insertar_gastos(nombre_archivo, gastos):
+    almacen = obtener_almacen()
+    with _bloqueo_resumenes, _bloqueo_indices:
+        resumen = _resumen_al_dia(nombre_archivo)
+        indice = _indice_al_dia("gastos", nombre_archivo)
+        ids = almacen.insertar("gastos", nombre_archivo, gastos)
+
+        def anadir(resumen):
+            for gasto in gastos:
+                resumen.anadir(gasto)
+        _ajustar_resumen(nombre_archivo, resumen, anadir)
+        _ajustar_indice("gastos", nombre_archivo, indice, lambda indice: indice.anadir(
+            pd.DataFrame(gastos, columns=COLUMNAS_GASTOS).set_index(pd.Index(ids, name="id"))))
+    return ids
+
+# Copia los gastos de un mes a otro nuevo (ver gastos.traspasar_gastos). Devuelve los ids creados
+def traspasar_mes(nombre_archivo, mes_origen, mes_destino):
+    almacen = obtener_almacen()
+    nuevos = traspasar_gastos(almacen.cargar("gastos", nombre_archivo, mes=mes_origen), mes_origen, mes_destino,
+                              almacen.cargar("gastos", nombre_archivo, mes=mes_destino))
+    return insertar_gastos(nombre_archivo, nuevos.to_dict("records")) if len(nuevos) else []
+
+# `mes` es opcional: ayuda al almacén particionado a encontrar el gasto sin recorrer todos los meses.
+# `antes` son los valores que tenía el gasto al editarlo; si ya no coinciden se lanza ConflictoEdicion
+def actualizar_gasto(nombre_archivo, id, cambios, mes=None, antes=None):
+    almacen = obtener_almacen()
+    with _bloqueo_resumenes, _bloqueo_indices:
+        resumen = _resumen_al_dia(nombre_archivo)
+        indice = _indice_al_dia("gastos", nombre_archivo)
+        fila = almacen.fila("gastos", nombre_archivo, id, mes=mes) if resumen is not None else None
+        almacen.actualizar("gastos", nombre_archivo, id, cambios, mes=mes, antes=antes)
+        if fila is not None:
+            _ajustar_resumen(nombre_archivo, resumen, lambda resumen: resumen.actualizar(fila, cambios))
+        _ajustar_indice("gastos", nombre_archivo, indice, lambda indice: indice.actualizar(id, cambios))
+
+def eliminar_gasto(nombre_archivo, id, mes=None):
+    almacen = obtener_almacen()
+    with _bloqueo_resumenes, _bloqueo_indices:
+        resumen = _resumen_al_dia(nombre_archivo)
+        indice = _indice_al_dia("gastos", nombre_archivo)
+        fila = almacen.fila("gastos", nombre_archivo, id, mes=mes) if resumen is not None else None
+        almacen.eliminar("gastos", nombre_archivo, [id], mes=mes)
+        if fila is not None:
+            _ajustar_resumen(nombre_archivo, resumen, lambda resumen: resumen.eliminar(fila))
+        _ajustar_indice("gastos", nombre_archivo, indice, lambda indice: indice.eliminar([id]))
+
+# Cambios de `sesion` descartados al escribir porque chocaban con los de otro proceso:
+# (tabla, archivo, operación, Concepto de la fila)
+def tomar_conflictos(sesion=None):
+    return obtener_almacen().tomar_conflictos(sesion)
+
+
+# Funciones para guardar y cargar los eventos
+_eventos_compactados = set()
+
+
+# Convierte a rangos los eventos guardados con una fila por día (formato antiguo) y los guarda.
+# Es un paso de migración que se pide explícitamente (la aplicación al arrancar, la migración a
+# SQLite o "python almacenamiento.py compactar"): leer nunca escribe. Mientras tanto, los eventos
+# antiguos se leen como eventos de un solo día. Se hace una vez por archivo y proceso
+def compactar_eventos_guardados(nombre_archivo):
+    with _bloqueo_almacen:
+        if nombre_archivo in _eventos_compactados:
+            return False
+        _eventos_compactados.add(nombre_archivo)
+    eventos = obtener_almacen().cargar("eventos", nombre_archivo)
+    if not eventos["Fecha_fin"].isna().any():
+        return False
+    almacen = obtener_almacen()
+    almacen.guardar("eventos", nombre_archivo, compactar_eventos(eventos))
+    # Es una migración del formato, no un cambio que se pueda deshacer
+    almacen._empezar_historial("eventos", nombre_archivo)
+    return True
+
+
+# `desde` y `hasta` (fechas "AAAA-MM-DD") devuelven los eventos cuyo rango toca ese periodo
+def cargar_eventos(nombre_archivo, desde=None, hasta=None):
+    return obtener_almacen().cargar("eventos", nombre_archivo, desde=desde, hasta=hasta)
+
+def guardar_eventos(nombre_archivo, eventos):
+    obtener_almacen().guardar("eventos", nombre_archivo, eventos)
+
+def insertar_eventos(nombre_archivo, eventos):
+    almacen = obtener_almacen()
+    with _bloqueo_calendarios, _bloqueo_indices:
+        version = almacen.version("eventos", nombre_archivo)
+        indice = _indice_al_dia("eventos", nombre_archivo)
+        ids = almacen.insertar("eventos", nombre_archivo, eventos)
+        nuevos = pd.DataFrame(eventos, columns=COLUMNAS_EVENTOS).set_index(pd.Index(ids, name="id"))
+        calendario = _calendarios.get(nombre_archivo)
+        if calendario is not None and calendario.version == version:
+            calendario.anadir(nuevos)
+            calendario.version = almacen.version("eventos", nombre_archivo)
+        _ajustar_indice("eventos", nombre_archivo, indice, lambda indice: indice.anadir(nuevos))
+    return ids
+
+def eliminar_evento(nombre_archivo, id):
+    almacen = obtener_almacen()
+    with _bloqueo_calendarios, _bloqueo_indices:
+        version = almacen.version("eventos", nombre_archivo)
+        indice = _indice_al_dia("eventos", nombre_archivo)
+        almacen.eliminar("eventos", nombre_archivo, [id])
+        calendario = _calendarios.get(nombre_archivo)
+        if calendario is not None and calendario.version == version:
+            calendario.eliminar([id])
+            calendario.version = almacen.version("eventos", nombre_archivo)
+        _ajustar_indice("eventos", nombre_archivo, indice, lambda indice: indice.eliminar([id]))
+
+
+# Un calendario por archivo de eventos, compartido por todas las sesiones del proceso.
+# Los cambios hechos con insertar_eventos/eliminar_evento se le aplican directamente;
+# si los datos cambian por otro lado (otra versión en el almacén) se vuelve a construir
+_calendarios = {}
+_bloqueo_calendarios = threading.RLock()
+
+def calendario_eventos(nombre_archivo):
+    almacen = obtener_almacen()
+    with _bloqueo_calendarios:
+        version = almacen.version("eventos", nombre_archivo)
+        calendario = _calendarios.get(nombre_archivo)
+        if calendario is None or calendario.version != version:
+            calendario = CalendarioEventos(almacen.cargar("eventos", nombre_archivo), version)
+            _calendarios[nombre_archivo] = calendario
+        return calendario
+
+
+# Un resumen por (Mes, Categoría) de cada archivo de gastos, compartido por todas las sesiones.
+# Igual que con los calendarios, los cambios hechos con insertar_gasto/actualizar_gasto/eliminar_gasto
+# se le aplican directamente. Se guarda en "<archivo>.resumen.json" junto con la huella de los datos,
+# así al arrancar no hay que recorrer todos los gastos si no han cambiado
+_resumenes = {}
+_bloqueo_resumenes = threading.RLock()
+
+
+def _ruta_resumen(nombre_archivo):
+    return f"{os.path.splitext(nombre_archivo)[0]}.resumen.json"
+
+
+def _leer_resumen(ruta):
+    try:
+        with open(ruta, 'r') as archivo:
+            return json.load(archivo)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# El resumen si está al día con los datos (se va a cambiar a la vez que ellos), o None.
+# Uno leído de disco se compara por la huella, que no obliga a leer los gastos
+def _resumen_al_dia(nombre_archivo):
+    resumen = _resumenes.get(nombre_archivo)
+    if resumen is None:
+        return None
+    if resumen.version is None:
+        huella = obtener_almacen().huella("gastos", nombre_archivo)
+        return resumen if huella is not None and huella == resumen.huella else None
+    return resumen if resumen.version == obtener_almacen().version("gastos", nombre_archivo) else None
+
+
+def _ajustar_resumen(nombre_archivo, resumen, ajuste):
+    if resumen is None:
+        return
+    ajuste(resumen)
+    resumen.version = obtener_almacen().version("gastos", nombre_archivo)
+    _guardar_resumen(nombre_archivo, resumen)
+
+
+# Se escribe en segundo plano, después de los datos. Si para entonces los datos aún no están en
+# disco se vuelve a programar; si el resumen ya no está al día no se guarda
+def _guardar_resumen(nombre_archivo, resumen):
+    def escribir(resumen):
+        with _bloqueo_resumenes:
+            if resumen is not _resumen_al_dia(nombre_archivo):
+                return
+            huella = obtener_almacen().huella("gastos", nombre_archivo)
+            if huella is None:
+                escritor.programar(_ruta_resumen(nombre_archivo), resumen, escribir)
+                return
+            contenido = json.dumps({"huella": huella, "filas": resumen.registros()}, default=lambda valor: valor.item())
+        escribir_atomico(_ruta_resumen(nombre_archivo), contenido)
+
+    escritor.programar(_ruta_resumen(nombre_archivo), resumen, escribir)
+
+
+def resumen_mensual(nombre_archivo):
+    almacen = obtener_almacen()
+    with _bloqueo_resumenes:
+        resumen = _resumen_al_dia(nombre_archivo)
+        if resumen is None:
+            guardado = _leer_resumen(_ruta_resumen(nombre_archivo))
+            huella = almacen.huella("gastos", nombre_archivo)
+            if guardado is not None and huella is not None and guardado["huella"] == huella:
+                resumen = ResumenMensual.desde_registros(guardado["filas"], huella)
+                _resumenes[nombre_archivo] = resumen
+            else:
+                version = almacen.version("gastos", nombre_archivo)
+                resumen = ResumenMensual.desde_gastos(almacen.cargar("gastos", nombre_archivo), version)
+                _resumenes[nombre_archivo] = resumen
+                _guardar_resumen(nombre_archivo, resumen)
+        return resumen
+
+
+# Un índice de búsqueda por archivo de gastos o de eventos, compartido por todas las sesiones.
+# Como los calendarios, recibe los cambios hechos con las funciones de arriba y se vuelve a
+# construir si los datos cambian por otro lado (p. ej. al guardar la tabla entera)
+_indices = {}
+_bloqueo_indices = threading.RLock()
+
+
+def _indice_al_dia(tabla, nombre_archivo):
+    indice = _indices.get((tabla, nombre_archivo))
+    if indice is None or indice.version != obtener_almacen().version(tabla, nombre_archivo):
+        return None
+    return indice
+
+
+def _ajustar_indice(tabla, nombre_archivo, indice, ajuste):
+    if indice is None:
+        return
+    ajuste(indice)
+    indice.version = obtener_almacen().version(tabla, nombre_archivo)
+
+
+# `tabla` es "gastos" o "eventos"
+def indice_conceptos(tabla, nombre_archivo):
+    almacen = obtener_almacen()
+    with _bloqueo_indices:
+        indice = _indice_al_dia(tabla, nombre_archivo)
+        if indice is None:
+            version = almacen.version(tabla, nombre_archivo)
+            indice = IndiceConceptos(almacen.cargar(tabla, nombre_archivo), version)
+            _indices[(tabla, nombre_archivo)] = indice
+        return indice
+
+
+# Historial de cambios de "gastos" o "eventos" (ver historial.Historial y ESQUEMA_SQLITE_HISTORIAL).
+# Los momentos son textos ISO ("2024-11-30T18:05:00.000") y los límites se incluyen. Antes de
+# leer el historial se escribe lo pendiente, para que esté completo
+COLUMNAS_HISTORIAL = ["momento", "accion", "deshace", "tipo", "id", "antes", "despues"]
+_bloqueo_deshacer = threading.Lock()
+
+
+# Una fila por operación, de la más antigua a la más reciente; con `id`, sólo las de ese registro
+def historial_cambios(tabla, nombre_archivo, desde=None, hasta=None, id=None):
+    escritor.vaciar()
+    filas = [(cambio["momento"], cambio["accion"], cambio.get("deshace"), tipo, id_fila, antes, despues)
+             for cambio in obtener_almacen().cambios(tabla, nombre_archivo, desde, hasta)
+             for tipo, id_fila, antes, despues in cambio["operaciones"] if id is None or id_fila == id]
+    return pd.DataFrame(filas, columns=COLUMNAS_HISTORIAL)
+
+# La tabla tal como estaba en `momento`; con `mes`, sólo los gastos de ese mes
+def datos_a_fecha(tabla, nombre_archivo, momento, mes=None):
+    escritor.vaciar()
+    return obtener_almacen().estado(tabla, nombre_archivo, momento, mes=mes)
+
+# La acción que se desharía ahora: {"accion", "momento", "operaciones"} o None
+def ultimo_cambio(tabla, nombre_archivo):
+    escritor.vaciar()
+    return obtener_almacen().ultima_accion(tabla, nombre_archivo)
+
+# Deshace la última acción con los cambios contrarios, que quedan en el historial como otra acción:
+# al volver a llamarla se deshace la anterior. Los calendarios, resúmenes e índices se reconstruyen
+# al ver la nueva versión. Devuelve (acción deshecha, operaciones que no se han podido deshacer
+# porque esas filas han vuelto a cambiar) o None si no hay nada que deshacer
+def deshacer_ultimo_cambio(tabla, nombre_archivo):
+    almacen = obtener_almacen()
+    with _bloqueo_deshacer:
+        escritor.vaciar()
+        ultima = almacen.ultima_accion(tabla, nombre_archivo)
+        if ultima is None:
+            return None
+        with accion(deshace=ultima["accion"]):
+            conflictos = _revertir(almacen, tabla, nombre_archivo, ultima["operaciones"])
+        escritor.vaciar()
+        if tabla == "gastos":
+            _deshacer_renombrado(nombre_archivo, ultima["accion"])
+    return ultima, conflictos
+
+
+# Las operaciones contrarias, de la última a la primera: se borran las filas insertadas que no han
+# cambiado desde entonces, se vuelven a poner las borradas y las editadas recuperan sus valores.
+# Las operaciones seguidas del mismo tipo se hacen juntas
+def _revertir(almacen, tabla, nombre_archivo, operaciones):
+    conflictos = []
+    operaciones = list(reversed(operaciones))
+    inicio = 0
+    while inicio < len(operaciones):
+        tipo = operaciones[inicio][0]
+        fin = inicio
+        while fin < len(operaciones) and operaciones[fin][0] == tipo:
+            fin += 1
+        grupo, inicio = operaciones[inicio:fin], fin
+        if tipo == "insertar":
+            ids = []
+            for operacion in grupo:
+                fila = almacen.fila(tabla, nombre_archivo, operacion[1])
+                if fila is not None and all(_iguales(fila.get(columna), valor) for columna, valor in operacion[3].items()):
+                    ids.append(operacion[1])
+                else:
+                    conflictos.append(operacion)
+            if ids:
+                almacen.eliminar(tabla, nombre_archivo, ids)
+        elif tipo == "eliminar":
+            filas = pd.DataFrame([operacion[2] for operacion in grupo], columns=COLUMNAS[tabla],
+                                 index=pd.Index([operacion[1] for operacion in grupo], name="id", dtype="int64"))
+            puestos = set(almacen.restaurar(tabla, nombre_archivo, filas))
+            conflictos += [operacion for operacion in grupo if operacion[1] not in puestos]
+        else:
+            for operacion in grupo:
+                try:
+                    almacen.actualizar(tabla, nombre_archivo, operacion[1], operacion[2], antes=operacion[3])
+                except ConflictoEdicion:
+                    conflictos.append(operacion)
+    return conflictos
+
+
+# Funciones para gestionar categorías
+def _leer_categorias(nombre_archivo):
+    if os.path.exists(nombre_archivo):
+        try:
+            with open(nombre_archivo, 'r') as archivo:
+                return json.load(archivo)
+        except ValueError:
+            return CATEGORIAS_POR_DEFECTO  # Categorías por defecto
+    else:
+        return CATEGORIAS_POR_DEFECTO
+
+def cargar_categorias(nombre_archivo):
+    # Copia de la lista de la caché, la aplicación la modifica al añadir o borrar categorías
+    return list(cache.obtener(nombre_archivo, _leer_categorias, tipo="categorias"))
+
+def guardar_categorias(nombre_archivo, categorias):
+    escribir_atomico(nombre_archivo, json.dumps(categorias))
+
+# Cambia el nombre de una categoría en la lista y en todos los gastos que la usan. Devuelve la lista nueva.
+# El historial sólo guarda los gastos: el cambio de la lista se apunta aparte para deshacerlo con ellos
+def renombrar_categoria(archivo_categorias, nombre_archivo, anterior, nueva):
+    categorias = cargar_categorias(archivo_categorias)
+    categorias[categorias.index(anterior)] = nueva
+    guardar_categorias(archivo_categorias, categorias)
+    with accion(), _bloqueo_resumenes:
+        resumen = _resumen_al_dia(nombre_archivo)
+        obtener_almacen().renombrar("gastos", nombre_archivo, "Categoría", anterior, nueva)
+        _ajustar_resumen(nombre_archivo, resumen, lambda resumen: resumen.renombrar_categoria(anterior, nueva))
+        identificador = accion_actual()[0]
+    with _bloqueo_deshacer:
+        ruta = _ruta_renombrados(nombre_archivo)
+        renombrados = _leer_renombrados(ruta)
+        renombrados[identificador] = {"archivo": archivo_categorias, "anterior": anterior, "nueva": nueva}
+        escribir_atomico(ruta, json.dumps(renombrados, ensure_ascii=False))
+    return categorias
+
+
+# Categorías renombradas de un archivo de gastos: "<archivo>.renombrados.json", por acción del historial
+def _ruta_renombrados(nombre_archivo):
+    return f"{os.path.splitext(nombre_archivo)[0]}.renombrados.json"
+
+
+def _leer_renombrados(ruta):
+    try:
+        with open(ruta, 'r', encoding="utf-8") as archivo:
+            return json.load(archivo)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+# Si la acción deshecha renombraba una categoría, la lista vuelve al nombre anterior (salvo que
+# la lista haya cambiado después y ya no tenga el nombre nuevo, o tenga otra vez el anterior)
+def _deshacer_renombrado(nombre_archivo, identificador):
+    ruta = _ruta_renombrados(nombre_archivo)
+    renombrados = _leer_renombrados(ruta)
+    renombrado = renombrados.pop(identificador, None)
+    if renombrado is None:
+        return
+    categorias = cargar_categorias(renombrado["archivo"])
+    if renombrado["nueva"] in categorias and renombrado["anterior"] not in categorias:
+        categorias[categorias.index(renombrado["nueva"])] = renombrado["anterior"]
+        guardar_categorias(renombrado["archivo"], categorias)
+    escribir_atomico(ruta, json.dumps(renombrados, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    # python almacenamiento.py migrar [presupuesto.db]
+    # python almacenamiento.py traspasar "Noviembre 2024" "Diciembre 2024" [gastos_fijos.json]
+    # python almacenamiento.py deshacer gastos|eventos [archivo]
+    # python almacenamiento.py compactar [eventos.json]
+    if len(sys.argv) >= 2 and sys.argv[1] == "migrar":
+        ruta = sys.argv[2] if len(sys.argv) > 2 else "presupuesto.db"
+        almacen = AlmacenSQLite(ruta)
+        migrar_json_a_sqlite(almacen)
+        print(f"Migrados {almacen.contar('gastos')} gastos y {almacen.contar('eventos')} eventos a {ruta}")
+    elif len(sys.argv) >= 4 and sys.argv[1] == "traspasar":
+        try:
+            ids = traspasar_mes(sys.argv[4] if len(sys.argv) > 4 else "gastos_fijos.json", sys.argv[2], sys.argv[3])
+        except ValueError as error:
+            print(error)
+            sys.exit(1)
+        escritor.vaciar()
+        print(f"Copiados {len(ids)} gastos de {sys.argv[2]} a {sys.argv[3]}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "compactar":
+        archivo = sys.argv[2] if len(sys.argv) > 2 else "eventos.json"
+        compactados = compactar_eventos_guardados(archivo)
+        escritor.vaciar()
+        print(f"Eventos de {archivo} convertidos a rangos" if compactados else f"Los eventos de {archivo} ya eran rangos")
+    elif len(sys.argv) >= 3 and sys.argv[1] == "deshacer" and sys.argv[2] in COLUMNAS:
+        archivo = sys.argv[3] if len(sys.argv) > 3 else {"gastos": "gastos_fijos.json", "eventos": "eventos.json"}[sys.argv[2]]
+        resultado = deshacer_ultimo_cambio(sys.argv[2], archivo)
+        if resultado is None:
+            print("No hay nada que deshacer")
+        else:
+            ultima, conflictos = resultado
+            print(f"Deshecho el cambio del {ultima['momento']} ({len(ultima['operaciones']) - len(conflictos)} "
+                  f"de {len(ultima['operaciones'])} operaciones)")
+    else:
+        print("Uso: python almacenamiento.py migrar [presupuesto.db]\n"
+              "     python almacenamiento.py traspasar MES_ORIGEN MES_DESTINO [gastos_fijos.json]\n"
+              "     python almacenamiento.py deshacer gastos|eventos [archivo]\n"
+              "     python almacenamiento.py compactar [eventos.json]")
+        sys.exit(1)
@@ -1,74 +1,129 @@
+import os
+import uuid
 import streamlit as st
 import pandas as pd
-import json
-import os
-from datetime import date, datetime
-
-with st.expander("Opciones avanzadas: Gestión de archivos y categorías"):
-    # Funciones para guardar y cargar los datos en un archivo JSON
-    def cargar_datos(nombre_archivo):
-        if os.path.exists(nombre_archivo):
-            try:
-                with open(nombre_archivo, 'r') as archivo:
-                    data = archivo.read()
-                    if data.strip():  # Verifica si el archivo no está vacío
-                        return pd.read_json(nombre_archivo)
-                    else:
-                        return pd.DataFrame(columns=["Mes", "Concepto", "Cantidad", "Pagado", "Categoría", "Fecha"])
-            except ValueError:  # Atrapa cualquier error de lectura de JSON
-                return pd.DataFrame(columns=["Mes", "Concepto", "Cantidad", "Pagado", "Categoría", "Fecha"])
-        else:
-            return pd.DataFrame(columns=["Mes", "Concepto", "Cantidad", "Pagado", "Categoría", "Fecha"])
-
-    def guardar_datos(nombre_archivo, datos):
-        with open(nombre_archivo, 'w') as archivo:
-            archivo.write(datos.to_json(orient='records', date_format='iso'))
-
-    # Funciones para gestionar categorías
-    def cargar_categorias(nombre_archivo):
-        if os.path.exists(nombre_archivo):
-            try:
-                with open(nombre_archivo, 'r') as archivo:
-                    return json.load(archivo)
-            except ValueError:
-                return ["Casa", "Deporte", "Alimentación / Hogar", "Salir Fuera"]  # Categorías por defecto
-        else:
-            return ["Casa", "Deporte", "Alimentación / Hogar", "Salir Fuera"]
-
-    def guardar_categorias(nombre_archivo, categorias):
-        with open(nombre_archivo, 'w') as archivo:
-            json.dump(categorias, archivo)
-
+from datetime import date, datetime, timedelta
+from almacenamiento import (ConflictoEdicion, actualizar_gasto, calendario_eventos, cargar_categorias, cargar_datos,
+                            compactar_eventos_guardados, datos_a_fecha, deshacer_ultimo_cambio, eliminar_evento,
+                            eliminar_gasto, fijar_sesion, guardar_categorias, historial_cambios, indice_conceptos,
+                            insertar_eventos, insertar_gasto, obtener_almacen, renombrar_categoria, resumen_mensual,
+                            tomar_conflictos, traspasar_mes, ultimo_cambio)
+from eventos import QUIENES, RECURRENCIAS, CalendarioEventos, formatear_hora, proximas_fechas
+from gastos import VistaMes, formatear_euros, totales_por_mes
+from importacion import ExtractoNoValido, importar
+from medicion import Medicion
+from meses import meses_disponibles, nombre_mes, siguiente_mes
+from paginacion import TAMANOS_PAGINA, paginar
+from persistencia import cache, escritor
+
+# Los cambios de esta sesión se marcan con su clave, para avisarle sólo a ella de los que se descarten
+# por chocar con los de otro proceso. Los callbacks de los widgets se ejecutan antes que el resto del
+# guion, así que también la fijan
+st.session_state.setdefault("sesion", uuid.uuid4().hex)
+fijar_sesion(st.session_state.sesion)
+
+# Medición de cada fase de la ejecución: se activa con el panel de rendimiento o con PRESUPUESTO_MEDIR=1
+medicion = Medicion(st.session_state.get("panel_rendimiento", False) or os.environ.get("PRESUPUESTO_MEDIR") == "1")
+
+opciones_avanzadas = st.expander("Opciones avanzadas: Gestión de archivos y categorías")
+with opciones_avanzadas:
     # Archivo para las categorías
     archivo_categorias = "categorias.json"
     categorias = cargar_categorias(archivo_categorias)
 
     nombre_archivo = "gastos_fijos.json"
+medicion.marcar("cargar_categorias", filas=len(categorias))
 
-    # Cargar datos desde el archivo JSON
-    df = cargar_datos(nombre_archivo)
-
-
-# Validar si existe la columna 'Mes' y 'Categoría', si no, agregarla
-if 'Mes' not in df.columns:
-    df['Mes'] = None  # Inicializar la columna 'Mes' si no existe
-if 'Categoría' not in df.columns:
-    df['Categoría'] = None  # Inicializar la columna 'Categoría' si no existe
 
 # Título de la aplicación
 st.title("❤️ Gestión de Gastos Fijos Mensuales")
 
-# Selección de mes en la barra lateral
-mes_seleccionado = st.sidebar.selectbox("Gastos Mes", 
-                                        ["Octubre 2024", "Noviembre 2024", "Diciembre 2024"])
+# Selección de mes en la barra lateral: los meses con gastos (sacados del resumen) y el actual y el siguiente
+meses_gastos = meses_disponibles(resumen_mensual(nombre_archivo).meses(), date.today())
+# (con clave fija, para que no vuelva al mes actual cuando aparece un mes nuevo en la lista)
+mes_seleccionado = st.sidebar.selectbox("Gastos Mes", meses_gastos, key="mes_gastos",
+                                        index=meses_gastos.index(nombre_mes(date.today().year, date.today().month)))
+
+# Tamaño de página de las listas y modo de edición en tabla
+st.sidebar.selectbox("Filas por página", TAMANOS_PAGINA, index=1, key="tamano_pagina")
+st.sidebar.toggle("Editar gastos en tabla", key="edicion_tabla")
+st.sidebar.toggle("Panel de rendimiento", key="panel_rendimiento")
+
+# Columnas que se pueden cambiar en el modo de edición en tabla
+COLUMNAS_EDITABLES = ["Concepto", "Cantidad", "Fecha", "Pagado"]
+
+
+# Guarda sólo las celdas cambiadas en la tabla editable y las filas borradas.
+# Después cambia la clave de las tablas para que se vuelvan a dibujar con los datos guardados
+def aplicar_edicion_tabla(clave_editor, filas, mes):
+    fijar_sesion(st.session_state.sesion)
+    cambios_tabla = st.session_state[clave_editor]
+    ids = list(filas.index)
+    for posicion, cambios in cambios_tabla["edited_rows"].items():
+        id = ids[int(posicion)]
+        if "Fecha" in cambios:
+            # Las fechas se guardan como "AAAA-MM-DD"; una fecha vacía o no válida no se guarda
+            fecha = pd.to_datetime(cambios["Fecha"], format="ISO8601", errors="coerce")
+            if pd.isna(fecha):
+                st.warning(f"'{filas.at[id, 'Concepto']}': la fecha no es válida; no se han guardado tus cambios.")
+                continue
+            cambios = {**cambios, "Fecha": fecha.strftime("%Y-%m-%d")}
+        try:
+            actualizar_gasto(nombre_archivo, id, cambios, mes=mes, antes={columna: filas.at[id, columna] for columna in cambios})
+        except ConflictoEdicion:
+            st.warning(f"'{filas.at[id, 'Concepto']}' se ha modificado en otra sesión; no se han guardado tus cambios.")
+    for posicion in cambios_tabla["deleted_rows"]:
+        eliminar_gasto(nombre_archivo, ids[posicion], mes=mes)
+    st.session_state.version_editor = st.session_state.get("version_editor", 0) + 1
+
+
+# Guarda el clic en la casilla "Pagado" de un gasto. `antes` es lo que mostraba la casilla, no lo que
+# hay ahora en disco: si otra sesión lo ha cambiado entretanto, no se sobrescribe
+def cambiar_pagado(clave, id, concepto, mes):
+    fijar_sesion(st.session_state.sesion)
+    pagado = st.session_state[clave]
+    try:
+        actualizar_gasto(nombre_archivo, id, {"Pagado": pagado}, mes=mes, antes={"Pagado": not pagado})
+    except ConflictoEdicion:
+        st.warning(f"'{concepto}' se ha modificado en otra sesión; no se ha guardado tu cambio.")
+
+
+# Abre el formulario de edición de un gasto con sus valores guardados, que se recuerdan para
+# comprobar al guardar que nadie lo ha cambiado mientras tanto
+def abrir_edicion(id, fila):
+    fecha = pd.to_datetime(fila["Fecha"], format="ISO8601", errors="coerce")
+    st.session_state[f"edit_antes_{id}"] = {"Concepto": fila["Concepto"], "Cantidad": fila["Cantidad"], "Fecha": fila["Fecha"]}
+    st.session_state[f"new_concepto_{id}"] = fila["Concepto"]
+    st.session_state[f"new_cantidad_{id}"] = float(fila["Cantidad"])
+    # (una fecha guardada que no es válida se muestra como la de hoy)
+    st.session_state[f"new_fecha_{id}"] = date.today() if pd.isna(fecha) else fecha.date()
+    st.session_state[f"edit_mode_{id}"] = True
+
+
+def guardar_edicion(id, mes):
+    fijar_sesion(st.session_state.sesion)
+    cambios = {"Concepto": st.session_state[f"new_concepto_{id}"], "Cantidad": st.session_state[f"new_cantidad_{id}"],
+               "Fecha": str(st.session_state[f"new_fecha_{id}"])}
+    try:
+        actualizar_gasto(nombre_archivo, id, cambios, mes=mes, antes=st.session_state[f"edit_antes_{id}"])
+    except ConflictoEdicion:
+        st.warning("Este gasto se ha modificado en otra sesión; vuelve a abrirlo para editarlo.")
+    else:
+        st.success("Gasto actualizado correctamente")
+    st.session_state[f"edit_mode_{id}"] = False
+
 
-# Filtrar los datos por mes
-df_mes = df[df["Mes"] == mes_seleccionado]
+# Avisar de los cambios de esta sesión que no se pudieron guardar porque otra había cambiado lo mismo
+for _, _, (operacion, _, _, _), concepto in tomar_conflictos(st.session_state.sesion):
+    st.warning(f"No se pudo {operacion} '{concepto}': otra sesión lo había cambiado.")
 
-if df_mes.empty:
-    st.session_state.gastos = pd.DataFrame(columns=["Mes", "Concepto", "Cantidad", "Pagado", "Categoría", "Fecha"])
-else:
-    st.session_state.gastos = df_mes
+# Cargar sólo los gastos del mes seleccionado
+st.session_state.gastos = cargar_datos(nombre_archivo, mes=mes_seleccionado)
+medicion.marcar("cargar_mes", filas=len(st.session_state.gastos))
+
+# Agrupar los gastos del mes por categoría y calcular los totales en una sola pasada
+vista_mes = VistaMes(st.session_state.gastos)
+medicion.marcar("agrupar_mes", filas=len(st.session_state.gastos))
 
 # Mostrar la tabla de gastos como un checklist editable (organizado por categorías)
 st.header(f"Gastos fijos de {mes_seleccionado}")
@@ -76,58 +131,112 @@ st.header(f"Gastos fijos de {mes_seleccionado}")
 # Iterar sobre cada categoría
 for categoria in categorias:
     with st.expander(f"{categoria}"):  # Crea un desplegable por categoría
-        gastos_categoria = st.session_state.gastos[st.session_state.gastos["Categoría"] == categoria]
+        gastos_categoria = vista_mes.gastos(categoria)
         
         if gastos_categoria.empty:
             st.write("No hay gastos en esta categoría.")
+        elif st.session_state.edicion_tabla:
+            # Tabla editable con los gastos de la página actual
+            pagina_gastos = paginar(gastos_categoria, f"{mes_seleccionado}_{categoria}")
+            clave_editor = f"editor_{mes_seleccionado}_{categoria}_{st.session_state.get('version_editor', 0)}"
+            # (la fecha como fecha, para editarla con el selector en vez de como texto)
+            tabla_editable = pagina_gastos[COLUMNAS_EDITABLES].assign(
+                Fecha=pd.to_datetime(pagina_gastos["Fecha"], format="ISO8601", errors="coerce").dt.date)
+            st.data_editor(tabla_editable, key=clave_editor, hide_index=True, num_rows="delete",
+                           column_config={
+                               "Cantidad": st.column_config.NumberColumn("Cantidad (€)", min_value=0, step=0.01, format="%.2f"),
+                               "Fecha": st.column_config.DateColumn("Fecha", format="YYYY-MM-DD"),
+                               "Pagado": st.column_config.CheckboxColumn("Pagado"),
+                           },
+                           on_change=aplicar_edicion_tabla, args=(clave_editor, pagina_gastos, mes_seleccionado))
         else:
-            # Mostrar los gastos en la categoría con checkbox
-            for index, row in gastos_categoria.iterrows():
-                pagado_checkbox = st.checkbox(f"{row['Concepto']} - {int(row['Cantidad'])} € - {row['Fecha']}", 
-                                              value=row['Pagado'], key=f"{mes_seleccionado}_{categoria}_{index}")
-                st.session_state.gastos.at[index, "Pagado"] = pagado_checkbox
+            # Mostrar los gastos de la página actual en la categoría con checkbox
+            for index, row in paginar(gastos_categoria, f"{mes_seleccionado}_{categoria}").iterrows():
+                # La casilla muestra siempre lo guardado (también lo que cambian otras sesiones o un deshacer);
+                # sólo se escribe al hacer clic, desde cambiar_pagado
+                clave_pagado = f"{mes_seleccionado}_{categoria}_{index}"
+                st.session_state[clave_pagado] = bool(row['Pagado'])
+                st.checkbox(f"{row['Concepto']} - {formatear_euros(row['Cantidad'])} - {row['Fecha']}", key=clave_pagado,
+                            on_change=cambiar_pagado, args=(clave_pagado, index, row['Concepto'], mes_seleccionado))
 
                 # Botón para editar cada gasto
                 if f"edit_mode_{index}" not in st.session_state:
                     st.session_state[f"edit_mode_{index}"] = False  # Estado de edición para cada gasto
 
                 if st.session_state[f"edit_mode_{index}"]:
-                    nuevo_concepto = st.text_input("Editar concepto", row["Concepto"], key=f"new_concepto_{index}")
-                    nueva_cantidad = st.number_input("Editar cantidad (€)", min_value=0, step=1, value=int(row["Cantidad"]), key=f"new_cantidad_{index}")
-                    nueva_fecha = st.date_input("Editar fecha", pd.to_datetime(row["Fecha"]).date(), key=f"new_fecha_{index}")
-                    if st.button("Guardar cambios", key=f"save_button_{index}"):
-                        st.session_state.gastos.at[index, "Concepto"] = nuevo_concepto
-                        st.session_state.gastos.at[index, "Cantidad"] = nueva_cantidad
-                        st.session_state.gastos.at[index, "Fecha"] = str(nueva_fecha)
-                        st.session_state[f"edit_mode_{index}"] = False
-                        st.success("Gasto actualizado correctamente")
+                    # Los campos empiezan con los valores que había al abrir el formulario (ver abrir_edicion)
+                    st.text_input("Editar concepto", key=f"new_concepto_{index}")
+                    st.number_input("Editar cantidad (€)", min_value=0.0, step=0.01, format="%.2f", key=f"new_cantidad_{index}")
+                    st.date_input("Editar fecha", key=f"new_fecha_{index}")
+                    st.button("Guardar cambios", key=f"save_button_{index}", on_click=guardar_edicion,
+                              args=(index, mes_seleccionado))
 
                 else:
-                    if st.button("Editar", key=f"edit_button_{index}"):
-                        st.session_state[f"edit_mode_{index}"] = True
+                    st.button("Editar", key=f"edit_button_{index}", on_click=abrir_edicion, args=(index, row))
 
                 # Botón para eliminar un gasto
                 if st.button("Eliminar", key=f"delete_{mes_seleccionado}_{index}"):
-                    st.session_state.gastos = st.session_state.gastos.drop(index).reset_index(drop=True)
+                    vista_mes.eliminar(st.session_state.gastos.loc[index])
+                    st.session_state.gastos = st.session_state.gastos.drop(index)
+                    eliminar_gasto(nombre_archivo, index, mes=mes_seleccionado)
                     st.success("Gasto eliminado correctamente")
 
-# Calcular el total de gastos, lo pagado y lo pendiente
-total_gastos = st.session_state.gastos["Cantidad"].sum()
-pagado_total = st.session_state.gastos[st.session_state.gastos["Pagado"] == True]["Cantidad"].sum()
-por_pagar_total = st.session_state.gastos[st.session_state.gastos["Pagado"] == False]["Cantidad"].sum()
+        if not gastos_categoria.empty:
+            totales_categoria = vista_mes.totales(categoria)
+            st.caption(f"Total: {formatear_euros(totales_categoria['total'])} - "
+                       f"Pagado: {formatear_euros(totales_categoria['pagado'])} - "
+                       f"Por pagar: {formatear_euros(totales_categoria['por_pagar'])}")
+
+medicion.marcar("categorias", filas=len(st.session_state.gastos))
+
+# El total de gastos, lo pagado y lo pendiente ya están calculados en la vista del mes
+balance = vista_mes.totales()
 
 # Mostrar el balance
 st.subheader(f"Balance de {mes_seleccionado}")
-st.write(f"Total de gastos: {int(total_gastos)} €")
-st.write(f"Total pagado: {int(pagado_total)} €")
-st.write(f"Por pagar: {int(por_pagar_total)} €")
+st.write(f"Total de gastos: {formatear_euros(balance['total'])}")
+st.write(f"Total pagado: {formatear_euros(balance['pagado'])}")
+st.write(f"Por pagar: {formatear_euros(balance['por_pagar'])}")
+medicion.marcar("balance")
+
+# Copiar los gastos fijos del mes a otro mes de una vez, sin pagar y con las fechas movidas
+with st.expander(f"Copiar los gastos de {mes_seleccionado} a otro mes"):
+    siguiente = siguiente_mes(mes_seleccionado)
+    destinos = [mes for mes in meses_disponibles(meses_gastos + [siguiente] if siguiente else meses_gastos, date.today())
+                if mes != mes_seleccionado]
+    mes_destino = st.selectbox("Mes de destino", destinos, key=f"destino_{mes_seleccionado}",
+                               index=destinos.index(siguiente) if siguiente else 0)
+    if st.button("Copiar gastos"):
+        try:
+            copiados = traspasar_mes(nombre_archivo, mes_seleccionado, mes_destino)
+        except ValueError as error:
+            st.warning(str(error))
+        else:
+            st.success(f"{len(copiados)} gastos copiados a {mes_destino} (los que ya estaban no se repiten).")
+medicion.marcar("traspasar_mes")
+
+# Evolución mes a mes, sacada del resumen por (Mes, Categoría): no hace falta leer los gastos
+st.header("Resumen por meses")
+resumen_meses = resumen_mensual(nombre_archivo).tabla()
+if resumen_meses.empty:
+    st.write("Todavía no hay gastos.")
+else:
+    anos = sorted({periodo[:4] for periodo in resumen_meses["Periodo"]}, reverse=True)
+    ano_resumen = st.selectbox("Año del resumen", ["Todos"] + anos)
+    if ano_resumen != "Todos":
+        resumen_meses = resumen_meses[resumen_meses["Periodo"].str.startswith(ano_resumen)]
+    st.bar_chart(resumen_meses, x="Periodo", y="total", color="Categoría", x_label="Mes", y_label="Total (€)")
+    st.line_chart(resumen_meses.groupby("Periodo")[["pagado", "por_pagar"]].sum(), x_label="Mes", y_label="€")
+    st.dataframe(resumen_meses.pivot_table(index="Categoría", columns="Periodo", values="total", aggfunc="sum",
+                                           fill_value=0))
+medicion.marcar("resumen_meses", filas=len(resumen_meses))
 
 
 # Formulario para agregar nuevos gastos (FORMULARIO ABAJO)
 st.header("Añadir nuevos gastos")
 with st.form("Añadir gasto"):
     concepto = st.text_input("Concepto del gasto")
-    cantidad = st.number_input("Cantidad (€)", min_value=0, step=1)  # Solo números enteros
+    cantidad = st.number_input("Cantidad (€)", min_value=0.0, step=0.01, format="%.2f")  # Con céntimos
     categoria = st.selectbox("Categoría", categorias)
     fecha = st.date_input("Fecha", value=date.today())
     pagado = st.checkbox("¿Está pagado?")
@@ -135,13 +244,42 @@ with st.form("Añadir gasto"):
 
 # Añadir nuevo gasto al DataFrame
 if submit and concepto:
-    nuevo_gasto = pd.DataFrame({"Mes": [mes_seleccionado], "Concepto": [concepto], "Cantidad": [cantidad], "Pagado": [pagado], "Categoría": [categoria], "Fecha": [str(fecha)]})
-    st.session_state.gastos = pd.concat([st.session_state.gastos, nuevo_gasto], ignore_index=True)
+    nuevo_gasto = {"Mes": mes_seleccionado, "Concepto": concepto, "Cantidad": cantidad, "Pagado": pagado, "Categoría": categoria, "Fecha": str(fecha)}
+    id_gasto = insertar_gasto(nombre_archivo, nuevo_gasto)
+    st.session_state.gastos = pd.concat([st.session_state.gastos, pd.DataFrame([nuevo_gasto], index=pd.Index([id_gasto], name="id"))])
     st.success("Gasto añadido correctamente")
+medicion.marcar("guardar_gasto", filas=1 if submit and concepto else 0)
 
-# Guardar los datos actualizados en el archivo JSON
-df = pd.concat([df[df["Mes"] != mes_seleccionado], st.session_state.gastos], ignore_index=True)
-guardar_datos(nombre_archivo, df)
+# Importar de una vez los movimientos de un extracto del banco (las reglas están en reglas_importacion.json)
+movimientos_leidos = 0
+with st.expander("Importar extracto del banco (CSV u OFX)"):
+    extracto = st.file_uploader("Extracto", type=["csv", "ofx", "qfx"])
+    if extracto is not None and st.button("Importar movimientos"):
+        try:
+            resultado = importar(extracto, nombre_archivo)
+        except ExtractoNoValido as error:
+            st.error(str(error))
+        else:
+            st.success(f"{resultado['importados']} gastos importados de {resultado['leidos']} movimientos "
+                       f"({resultado['repetidos']} ya estaban importados, {resultado['descartados']} descartados).")
+            movimientos_leidos = resultado["leidos"]
+medicion.marcar("importar_extracto", filas=movimientos_leidos)
+
+# Los cambios ya se han guardado fila a fila; aquí sólo se informa del estado del almacén
+estadisticas_escritor = escritor.estadisticas()
+estadisticas_cache = cache.estadisticas()
+opciones_avanzadas.caption(
+    f"Almacén: {type(obtener_almacen()).__name__} - "
+    f"Escrituras: {estadisticas_escritor['escrituras']} "
+    f"({estadisticas_escritor['fusionadas']} agrupadas, {estadisticas_escritor['pendientes']} pendientes) - "
+    f"tiempo total {estadisticas_escritor['tiempo_total'] * 1000:.1f} ms - "
+    f"Caché de lectura: {estadisticas_cache['aciertos']} aciertos, {estadisticas_cache['fallos']} fallos, "
+    f"{estadisticas_cache['bytes'] / 1024:.0f} KB - Errores al escribir: {estadisticas_escritor['errores']}"
+)
+# Cambios que se ven en la aplicación pero aún no se han podido guardar en disco (se siguen reintentando)
+if estadisticas_escritor["fallidas"]:
+    st.error(f"No se han podido guardar algunos cambios en disco ({estadisticas_escritor['ultimo_error']}). "
+             "Se volverá a intentar; mientras tanto no cierres la aplicación.")
 
 # Sección para gestionar CRUD de categorías
 st.header("Gestionar categorías")
@@ -164,8 +302,8 @@ categoria_a_editar = st.selectbox("Selecciona una categoría para editar o elimi
 nuevo_nombre_categoria = st.text_input("Editar nombre de la categoría", value=categoria_a_editar)
 if st.button("Guardar cambios en categoría"):
     if nuevo_nombre_categoria and nuevo_nombre_categoria not in categorias:
-        categorias[categorias.index(categoria_a_editar)] = nuevo_nombre_categoria
-        guardar_categorias(archivo_categorias, categorias)
+        # También cambia la categoría de los gastos que ya la tenían
+        categorias = renombrar_categoria(archivo_categorias, nombre_archivo, categoria_a_editar, nuevo_nombre_categoria)
         st.success(f"La categoría '{categoria_a_editar}' ha sido renombrada a '{nuevo_nombre_categoria}' correctamente.")
     elif nuevo_nombre_categoria in categorias:
         st.warning(f"El nombre '{nuevo_nombre_categoria}' ya existe.")
@@ -180,48 +318,14 @@ if st.button("Eliminar categoría"):
         st.success(f"La categoría '{categoria_a_editar}' ha sido eliminada correctamente.")
     else:
         st.warning(f"No se pudo eliminar la categoría '{categoria_a_editar}'.")
+medicion.marcar("gestionar_categorias", filas=len(categorias))
 
 
 
-# Funciones para guardar y cargar los eventos en un archivo JSON
-def cargar_eventos(nombre_archivo):
-    if os.path.exists(nombre_archivo):
-        try:
-            with open(nombre_archivo, 'r') as archivo:
-                data = archivo.read()
-                if data.strip():  # Verifica si el archivo no está vacío
-                    return pd.read_json(nombre_archivo)
-                else:
-                    return pd.DataFrame(columns=["Fecha", "Hora", "Quien", "Concepto", "Todo_el_dia"])
-        except ValueError:  # Atrapa cualquier error de lectura de JSON
-            return pd.DataFrame(columns=["Fecha", "Hora", "Quien", "Concepto", "Todo_el_dia"])
-    else:
-        return pd.DataFrame(columns=["Fecha", "Hora", "Quien", "Concepto", "Todo_el_dia"])
-
-# Funciones para guardar y cargar los eventos en un archivo JSON
-def cargar_eventos(nombre_archivo):
-    if os.path.exists(nombre_archivo):
-        try:
-            with open(nombre_archivo, 'r') as archivo:
-                data = archivo.read()
-                if data.strip():  # Verifica si el archivo no está vacío
-                    return pd.read_json(nombre_archivo)
-                else:
-                    return pd.DataFrame(columns=["Fecha", "Hora", "Quien", "Concepto", "Todo_el_dia"])
-        except ValueError:  # Atrapa cualquier error de lectura de JSON
-            return pd.DataFrame(columns=["Fecha", "Hora", "Quien", "Concepto", "Todo_el_dia"])
-    else:
-        return pd.DataFrame(columns=["Fecha", "Hora", "Quien", "Concepto", "Todo_el_dia"])
-
-def guardar_eventos(nombre_archivo, eventos):
-    with open(nombre_archivo, 'w') as archivo:
-        archivo.write(eventos.to_json(orient='records', date_format='iso'))
-
 # Nombre del archivo JSON para los eventos
 nombre_archivo_eventos = "eventos.json"
-
-# Cargar eventos desde el archivo JSON
-df_eventos = cargar_eventos(nombre_archivo_eventos)
+# Los eventos guardados con el formato antiguo (una fila por día) se pasan a rangos al arrancar
+compactar_eventos_guardados(nombre_archivo_eventos)
 
 # Título de la aplicación
 st.title("❤️ Gestión de Eventos")
@@ -239,30 +343,31 @@ with st.form("Añadir evento"):
     else:
         hora_evento = None
 
-    quien_evento = st.selectbox("¿Quién lo hace?", ["Juntos", "Quintero", "Andreea"])
+    quien_evento = st.selectbox("¿Quién lo hace?", QUIENES)
     concepto_evento = st.text_input("Concepto del evento")
+    repetir_evento = st.selectbox("¿Se repite?", list(RECURRENCIAS))
     
     # Botón de submit
     submit_evento = st.form_submit_button("Añadir evento")
 
 # Añadir el nuevo evento al DataFrame
 if submit_evento and concepto_evento:
-    fecha_inicio, fecha_fin = rango_fechas
-    rango_dias = pd.date_range(fecha_inicio, fecha_fin).tolist()
-    
-    for fecha in rango_dias:
-        nuevo_evento = pd.DataFrame({
-            "Fecha": [str(fecha.date())],
-            "Hora": [str(hora_evento) if hora_evento else "Todo el día"],
-            "Quien": [quien_evento],
-            "Concepto": [concepto_evento],
-            "Todo_el_dia": [todo_el_dia]
-        })
-        
-        df_eventos = pd.concat([df_eventos, nuevo_evento], ignore_index=True)
-    
-    guardar_eventos(nombre_archivo_eventos, df_eventos)
+    # Mientras se elige el rango el selector devuelve sólo la fecha de inicio
+    fecha_inicio, fecha_fin = rango_fechas if len(rango_fechas) == 2 else (rango_fechas[0], rango_fechas[0])
+
+    # Un único registro para todo el rango de días
+    nuevo_evento = {
+        "Fecha": str(fecha_inicio),
+        "Fecha_fin": str(fecha_fin),
+        "Hora": str(hora_evento) if hora_evento else "Todo el día",
+        "Quien": quien_evento,
+        "Concepto": concepto_evento,
+        "Todo_el_dia": todo_el_dia,
+        "Recurrencia": RECURRENCIAS[repetir_evento]
+    }
+    insertar_eventos(nombre_archivo_eventos, [nuevo_evento])
     st.success(f"Evento '{concepto_evento}' añadido correctamente para los días {fecha_inicio} a {fecha_fin}.")
+medicion.marcar("guardar_evento", filas=1 if submit_evento and concepto_evento else 0)
 
 # Mostrar calendario de eventos
 st.header("Calendario de eventos")
@@ -277,37 +382,167 @@ mes_seleccionado = st.sidebar.selectbox("Eventos Mes", [f"{mes_actual}/{ano_actu
 # Convertir la selección de mes en formato datetime
 mes, ano = map(int, mes_seleccionado.split('/'))
 
-# Filtrar eventos por mes y año seleccionados
-df_eventos_mes = df_eventos[
-    (pd.to_datetime(df_eventos["Fecha"]).dt.month == mes) &
-    (pd.to_datetime(df_eventos["Fecha"]).dt.year == ano)
-]
+# Eventos del mes y año seleccionados: un día por fila, sólo los días del mes, ordenados por fecha
+df_eventos_mes = calendario_eventos(nombre_archivo_eventos).del_mes(ano, mes)
+medicion.marcar("filtrar_eventos", filas=len(df_eventos_mes))
 
-# Ordenar los eventos por fecha
-df_eventos_mes = df_eventos_mes.sort_values(by="Fecha")
+# Borrar un evento lo borra entero, con todos sus días y repeticiones: antes se pide confirmarlo
+# junto al día en el que se ha pulsado
+def pedir_eliminar_evento(id, dia):
+    st.session_state.evento_a_eliminar = (id, dia)
 
-# Mostrar los eventos del mes seleccionado, día por día si están en un rango
+
+def eliminar_evento_completo(id, concepto):
+    fijar_sesion(st.session_state.sesion)
+    eliminar_evento(nombre_archivo_eventos, id)
+    st.session_state.evento_a_eliminar = None
+    st.success(f"Evento '{concepto}' eliminado correctamente.")
+
+
+def cancelar_eliminar_evento():
+    st.session_state.evento_a_eliminar = None
+
+
+# Mostrar los eventos del mes seleccionado (sólo la página actual), día por día si están en un rango
 if not df_eventos_mes.empty:
-    for index, evento in df_eventos_mes.iterrows():
-        fecha_evento = pd.to_datetime(evento["Fecha"])
+    for posicion, evento in paginar(df_eventos_mes, f"eventos_{mes_seleccionado}").iterrows():
+        index = evento["id"]
+        fecha_evento = evento["Fecha"]
         concepto_evento = evento["Concepto"]
         quien_evento = evento["Quien"]
-        hora_evento = evento["Hora"]
-
-        # Limpiar cualquier valor nulo en hora_evento
-        if pd.isna(hora_evento) or hora_evento == "Todo el día":
-            hora_evento_str = "Todo el día"
-        else:
-            hora_evento_str = pd.to_datetime(hora_evento).strftime('%H:%M')  # Formato HH:MM sin segundos
+        hora_evento_str = formatear_hora(evento["Hora"])  # Formato HH:MM sin segundos
 
         # Mostrar el evento en cada día con botones de edición y eliminación
         st.write(f"📅 {fecha_evento.strftime('%Y-%m-%d')} - {hora_evento_str} - {quien_evento} - {concepto_evento}")
 
-        # Botones eliminar
-
-        if st.button("Eliminar", key=f"delete_{index}"):
-            df_eventos = df_eventos.drop(index).reset_index(drop=True)
-            guardar_eventos(nombre_archivo_eventos, df_eventos)
-            st.success("Evento eliminado correctamente.")
+        # Botón eliminar (borra el evento entero, con todos sus días), con confirmación
+        dia_evento = fecha_evento.date()
+        if st.session_state.get("evento_a_eliminar") == (index, dia_evento):
+            repeticiones = " y todas sus repeticiones" if pd.notna(evento["Recurrencia"]) else ""
+            st.warning(f"Se eliminará '{concepto_evento}' entero, con todos sus días{repeticiones}. ¿Seguro?")
+            confirmar, cancelar = st.columns(2)
+            confirmar.button("Sí, eliminar", key=f"confirm_delete_{index}_{dia_evento}",
+                             on_click=eliminar_evento_completo, args=(index, concepto_evento))
+            cancelar.button("Cancelar", key=f"cancel_delete_{index}_{dia_evento}", on_click=cancelar_eliminar_evento)
+        else:
+            st.button("Eliminar evento completo", key=f"delete_{index}_{dia_evento}",
+                      on_click=pedir_eliminar_evento, args=(index, dia_evento))
 else:
-    st.write("No hay eventos para este mes.")
\ No newline at end of file
+    st.write("No hay eventos para este mes.")
+medicion.marcar("mostrar_eventos", filas=len(df_eventos_mes))
+
+# Búsqueda por concepto en todos los meses de gastos y eventos, con el índice de palabras
+# (sin acentos ni mayúsculas; "limp" encuentra "Limpiadora")
+st.title("🔎 Buscar en gastos y eventos")
+consulta = st.text_input("Buscar por concepto", placeholder="p. ej. limpiadora, viaje")
+encontrados = 0
+if consulta:
+    gastos_encontrados = indice_conceptos("gastos", nombre_archivo).buscar(consulta)
+    eventos_encontrados = indice_conceptos("eventos", nombre_archivo_eventos).buscar(consulta)
+    encontrados = len(gastos_encontrados) + len(eventos_encontrados)
+    if not encontrados:
+        st.write("No hay gastos ni eventos con ese concepto.")
+
+    if not gastos_encontrados.empty:
+        totales_busqueda = totales_por_mes(gastos_encontrados)
+        anos = sorted({periodo[:4] for periodo in totales_busqueda["Periodo"]}, reverse=True)
+        ano_busqueda = st.selectbox("Año de los gastos encontrados", ["Todos"] + anos)
+        if ano_busqueda != "Todos":
+            totales_busqueda = totales_busqueda[totales_busqueda["Periodo"].str.startswith(ano_busqueda)]
+        st.subheader(f"Gastos encontrados: {int(totales_busqueda['gastos'].sum())}")
+        st.write(f"Suma: {formatear_euros(totales_busqueda['total'].sum())} - "
+                 f"Pagado: {formatear_euros(totales_busqueda['pagado'].sum())} - "
+                 f"Por pagar: {formatear_euros(totales_busqueda['por_pagar'].sum())}")
+        st.dataframe(totales_busqueda.drop(columns="Periodo").set_index("Mes"))
+        with st.expander("Ver los gastos"):
+            st.dataframe(gastos_encontrados[gastos_encontrados["Mes"].isin(totales_busqueda["Mes"])]
+                         .sort_values("Fecha", ascending=False))
+
+    if not eventos_encontrados.empty:
+        eventos_encontrados.insert(0, "Próxima", proximas_fechas(eventos_encontrados, date.today()))
+        eventos_encontrados = eventos_encontrados.sort_values(["Próxima", "Fecha"], na_position="last")
+        st.subheader(f"Eventos encontrados: {len(eventos_encontrados)}")
+        proximo = eventos_encontrados.iloc[0]
+        if pd.notna(proximo["Próxima"]):
+            st.write(f"Próximo: {proximo['Concepto']} el {proximo['Próxima']:%Y-%m-%d} ({proximo['Quien']})")
+        st.dataframe(eventos_encontrados)
+medicion.marcar("buscar", filas=encontrados)
+
+# Historial de cambios: deshacer el último cambio, ver los datos tal como estaban un día y
+# los cambios de los días anteriores. El historial sólo se lee con el interruptor activado
+TIPOS_CAMBIO = {"insertar": "añadidas", "actualizar": "editadas", "eliminar": "borradas"}
+
+
+def describir_operaciones(operaciones):
+    tipos = pd.Series([operacion[0] for operacion in operaciones]).value_counts()
+    return ", ".join(f"{cantidad} {TIPOS_CAMBIO[tipo]}" for tipo, cantidad in tipos.items())
+
+
+def describir_fila(valores):
+    return ", ".join(f"{columna}: {valor}" for columna, valor in valores.items()) if isinstance(valores, dict) else ""
+
+
+# Se deshace antes de dibujar la página (como callback del botón), así todo se ve ya deshecho. Las
+# tablas editables cambian de clave y los formularios de edición abiertos se cierran: si no,
+# mostrarían los valores de antes de deshacer
+def deshacer(tabla, archivo):
+    fijar_sesion(st.session_state.sesion)
+    resultado = deshacer_ultimo_cambio(tabla, archivo)
+    # (otra sesión o proceso puede haberlo deshecho ya)
+    if resultado is None:
+        st.info("No hay cambios que deshacer.")
+        return
+    _, conflictos = resultado
+    if conflictos:
+        st.warning(f"{len(conflictos)} filas han vuelto a cambiar desde entonces y se han dejado como están.")
+    st.success("Cambio deshecho.")
+    st.session_state.version_editor = st.session_state.get("version_editor", 0) + 1
+    for clave in [clave for clave in st.session_state if str(clave).startswith("edit_mode_")]:
+        st.session_state[clave] = False
+
+
+st.title("🕓 Historial de cambios")
+cambios_leidos = 0
+if st.toggle("Ver el historial", key="ver_historial"):
+    tabla_historial = st.radio("Datos", ["Gastos", "Eventos"], horizontal=True, key="tabla_historial")
+    tabla, archivo = ("gastos", nombre_archivo) if tabla_historial == "Gastos" else ("eventos", nombre_archivo_eventos)
+
+    ultimo = ultimo_cambio(tabla, archivo)
+    if ultimo is None:
+        st.write("No hay cambios que deshacer.")
+    else:
+        st.write(f"Último cambio: {ultimo['momento'][:19].replace('T', ' ')} - "
+                 f"filas {describir_operaciones(ultimo['operaciones'])}")
+        st.button("Deshacer el último cambio", key="deshacer", on_click=deshacer, args=(tabla, archivo))
+
+    # El día elegido se incluye entero
+    fecha_historial = st.date_input("Ver los datos tal como estaban el día", value=date.today(),
+                                    max_value=date.today(), key="fecha_historial")
+    momento = f"{fecha_historial}T23:59:59.999"
+    if tabla == "gastos":
+        mes_historial = st.session_state["mes_gastos"]
+        st.subheader(f"Gastos de {mes_historial} el {fecha_historial}")
+        st.dataframe(datos_a_fecha("gastos", nombre_archivo, momento, mes=mes_historial))
+    else:
+        st.subheader(f"Eventos de {mes}/{ano} el {fecha_historial}")
+        st.dataframe(CalendarioEventos(datos_a_fecha("eventos", nombre_archivo_eventos, momento)).del_mes(ano, mes))
+
+    cambios = historial_cambios(tabla, archivo, desde=str(fecha_historial - timedelta(days=30)), hasta=momento)
+    cambios_leidos = len(cambios)
+    st.subheader(f"Cambios de los 30 días anteriores: {cambios_leidos}")
+    if not cambios.empty:
+        st.dataframe(pd.DataFrame({
+            "Momento": cambios["momento"].str.slice(0, 19).str.replace("T", " "),
+            "Cambio": cambios["tipo"].map(TIPOS_CAMBIO).str.slice(0, -1) + cambios["deshace"].notna().map({True: " (deshacer)", False: ""}),
+            "id": cambios["id"],
+            "Antes": cambios["antes"].map(describir_fila),
+            "Después": cambios["despues"].map(describir_fila),
+        }).iloc[::-1], hide_index=True)
+medicion.marcar("historial", filas=cambios_leidos)
+
+# Panel de rendimiento: fases de esta ejecución (también se guardan en rendimiento.jsonl)
+ejecucion = medicion.terminar(almacen=type(obtener_almacen()).__name__)
+if ejecucion is not None and st.session_state.get("panel_rendimiento"):
+    with st.sidebar.expander("Rendimiento", expanded=True):
+        st.caption(f"Ejecución completa: {ejecucion['ms']:.1f} ms")
+        st.dataframe(pd.DataFrame(ejecucion["fases"]).set_index("fase"), width="stretch")
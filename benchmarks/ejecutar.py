@@ -0,0 +1,232 @@
+"""Mide los caminos principales de la aplicación con datos generados de distintos tamaños.
+
+Se ejecuta sin navegador. Deja la mediana de los tiempos de cada caso en un JSON y la
+compara con la referencia guardada (benchmarks/referencia.json), ajustada a la velocidad
+de la máquina; termina con error si algún caso es más lento que la referencia por encima
+del umbral o si alguno no tiene referencia.
+
+    python benchmarks/ejecutar.py [--almacen json] [--tamanos 1000 10000 100000]
+                                  [--salida resultados.json] [--guardar-referencia | --completar-referencia]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(DIRECTORIO))
+
+import pandas as pd  # noqa: E402
+
+import almacenamiento  # noqa: E402
+from almacenamiento import (calendario_eventos, cargar_datos, cargar_eventos, compactar_eventos_guardados,  # noqa: E402
+                            guardar_datos, indice_conceptos, insertar_eventos, insertar_gasto, obtener_almacen)
+from gastos import VistaMes  # noqa: E402
+from generar import generar_archivos  # noqa: E402
+from persistencia import cache, escritor  # noqa: E402
+
+REFERENCIA = os.path.join(DIRECTORIO, "referencia.json")
+TAMANOS = [1000, 10000, 100000]
+# Un caso es una regresión si tarda más de UMBRAL veces la referencia y al menos MINIMO segundos más.
+# Por debajo de unos 50 ms manda MINIMO: a esa escala las diferencias son sobre todo ruido
+UMBRAL = 1.5
+MINIMO = 0.025
+
+
+# Trabajo fijo que se mide con cada tamaño: la referencia se ajusta a lo rápida que va la máquina
+# ahora comparado con cuando se guardó
+def _calibrar():
+    return sum(numero * numero for numero in range(200000))
+
+
+# Mediana de varias repeticiones; `preparar` se ejecuta antes de cada una sin medirse. Como en
+# timeit, el recolector de basura no se ejecuta mientras se mide
+def medir(funcion, repeticiones, preparar=None):
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar is not None:
+            preparar()
+        gc.collect()
+        gc.disable()
+        try:
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append(time.perf_counter() - inicio)
+        finally:
+            gc.enable()
+    return statistics.median(tiempos)
+
+
+# El almacén, la caché, los calendarios, los resúmenes y los índices de búsqueda son globales del proceso: se vacían para cada tamaño
+def _reiniciar(tipo):
+    escritor.vaciar()
+    cache.limpiar()
+    os.environ["PRESUPUESTO_ALMACEN"] = tipo
+    os.environ["PRESUPUESTO_DB"] = "presupuesto.db"
+    almacenamiento._almacen = None
+    almacenamiento._calendarios.clear()
+    almacenamiento._eventos_compactados.clear()
+    almacenamiento._resumenes.clear()
+    almacenamiento._indices.clear()
+
+
+# Una consulta con presupuesto.py en un proceso nuevo: incluye el arranque de Python y los imports
+def _consulta(*argumentos):
+    def medida():
+        subprocess.run([sys.executable, os.path.join(os.path.dirname(DIRECTORIO), "presupuesto.py"), *argumentos],
+                       check=True, stdout=subprocess.DEVNULL)
+    return medida
+
+
+def _escribir(funcion):
+    def medida():
+        funcion()
+        escritor.vaciar()
+    return medida
+
+
+def ejecutar(tipo, filas):
+    directorio = tempfile.mkdtemp(prefix=f"benchmark-{filas}-")
+    generar_archivos(directorio, filas)
+    anterior = os.getcwd()
+    os.chdir(directorio)
+    try:
+        _reiniciar(tipo)
+        repeticiones = 15 if filas <= 10000 else 7 if filas <= 100000 else 3
+        obtener_almacen()  # SQLite importa aquí los JSON generados
+        gastos = cargar_datos("gastos_fijos.json")  # El almacén particionado reparte los meses la primera vez
+        compactar_eventos_guardados("eventos.json")
+        escritor.vaciar()
+
+        mes = gastos["Mes"].mode().iloc[0]
+        gastos_mes = cargar_datos("gastos_fijos.json", mes=mes)
+        inicio_mes = pd.Timestamp(gastos_mes["Fecha"].iloc[0]).replace(day=1)
+        gasto = {"Mes": mes, "Concepto": "Nuevo", "Cantidad": 10, "Pagado": False, "Categoría": "Casa",
+                 "Fecha": inicio_mes.strftime("%Y-%m-%d")}
+        evento = {"Fecha": inicio_mes.strftime("%Y-%m-%d"),
+                  "Fecha_fin": (inicio_mes + pd.Timedelta(days=29)).strftime("%Y-%m-%d"),
+                  "Hora": "Todo el día", "Quien": "Juntos", "Concepto": "Vacaciones", "Todo_el_dia": True,
+                  "Recurrencia": None}
+
+        def filtrar_categorias():
+            vista_mes = VistaMes(gastos_mes)
+            return [vista_mes.gastos(categoria) for categoria in gastos_mes["Categoría"].unique()]
+
+        def editar_y_guardar():
+            datos = cargar_datos("gastos_fijos.json")
+            datos.iloc[0, datos.columns.get_loc("Cantidad")] += 1
+            guardar_datos("gastos_fijos.json", datos)
+
+        casos = {
+            "cargar_datos": (lambda: cargar_datos("gastos_fijos.json"), cache.limpiar),
+            "cargar_eventos": (lambda: cargar_eventos("eventos.json"), cache.limpiar),
+            "filtrar_mes": (lambda: cargar_datos("gastos_fijos.json", mes=mes), None),
+            "filtrar_categorias": (filtrar_categorias, None),
+            "balance": (lambda: VistaMes(gastos_mes).totales(), None),
+            "calendario": (lambda: calendario_eventos("eventos.json"), almacenamiento._calendarios.clear),
+            "eventos_mes": (lambda: calendario_eventos("eventos.json").del_mes(inicio_mes.year, inicio_mes.month), None),
+            "indice_conceptos": (lambda: indice_conceptos("gastos", "gastos_fijos.json"), almacenamiento._indices.clear),
+            "buscar": (lambda: indice_conceptos("gastos", "gastos_fijos.json").buscar("luz"), None),
+            "anadir_gasto": (_escribir(lambda: insertar_gasto("gastos_fijos.json", gasto)), None),
+            "anadir_evento_30_dias": (_escribir(lambda: insertar_eventos("eventos.json", [evento])), None),
+            "guardar_datos": (_escribir(editar_y_guardar), None),
+            "cli_balance": (_consulta("balance", mes), None),
+            "cli_eventos": (_consulta("eventos", f"{inicio_mes.month}/{inicio_mes.year}"), None),
+        }
+        resultados = []
+        for caso, (funcion, preparar) in casos.items():
+            segundos = medir(funcion, repeticiones, preparar)
+            resultados.append({"caso": caso, "filas": filas, "segundos": segundos,
+                               "calibracion": medir(_calibrar, repeticiones)})
+            print(f"{tipo:>12} {filas:>8} {caso:<22} {segundos * 1000:10.2f} ms", flush=True)
+        return resultados
+    finally:
+        escritor.vaciar()
+        os.chdir(anterior)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+# Casos más lentos que la referencia: (caso, filas, segundos, segundos de referencia). La referencia
+# se escala por lo que ha cambiado la calibración medida junto a cada caso
+def comparar(resultados, referencia):
+    anteriores = {(resultado["caso"], resultado["filas"]): resultado for resultado in referencia}
+    regresiones = []
+    for resultado in resultados:
+        anterior = anteriores.get((resultado["caso"], resultado["filas"]))
+        if anterior is None:
+            continue
+        segundos = anterior["segundos"]
+        if "calibracion" in anterior and "calibracion" in resultado:
+            segundos *= resultado["calibracion"] / anterior["calibracion"]
+        if resultado["segundos"] > max(segundos * UMBRAL, segundos + MINIMO):
+            regresiones.append((resultado["caso"], resultado["filas"], resultado["segundos"], segundos))
+    return regresiones
+
+
+# Casos medidos que no tienen referencia con la que compararlos: (caso, filas)
+def sin_referencia(resultados, referencia):
+    anteriores = {(resultado["caso"], resultado["filas"]) for resultado in referencia}
+    return [(resultado["caso"], resultado["filas"]) for resultado in resultados
+            if (resultado["caso"], resultado["filas"]) not in anteriores]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--almacen", default="json", choices=["json", "particionado", "sqlite"])
+    parser.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS)
+    parser.add_argument("--salida", default="resultados.json")
+    guardar = parser.add_mutually_exclusive_group()
+    guardar.add_argument("--guardar-referencia", action="store_true",
+                         help="guarda estos tiempos como la nueva referencia del almacén")
+    guardar.add_argument("--completar-referencia", action="store_true",
+                         help="guarda sólo los tiempos de los casos que aún no tienen referencia")
+    argumentos = parser.parse_args()
+
+    resultados = [resultado for filas in argumentos.tamanos for resultado in ejecutar(argumentos.almacen, filas)]
+    informe = {
+        "almacen": argumentos.almacen,
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "maquina": {"python": platform.python_version(), "pandas": pd.__version__, "sistema": platform.platform(),
+                    "procesador": platform.machine(), "nucleos": os.cpu_count()},
+        "resultados": resultados,
+    }
+    with open(argumentos.salida, 'w') as archivo:
+        json.dump(informe, archivo, indent=2)
+
+    referencias = {}
+    if os.path.exists(REFERENCIA):
+        with open(REFERENCIA, 'r') as archivo:
+            referencias = json.load(archivo)
+    anteriores = referencias.get(argumentos.almacen, {}).get("resultados", [])
+    if argumentos.guardar_referencia or argumentos.completar_referencia:
+        if argumentos.completar_referencia:
+            faltan = set(sin_referencia(resultados, anteriores))
+            informe["resultados"] = anteriores + [resultado for resultado in resultados
+                                                  if (resultado["caso"], resultado["filas"]) in faltan]
+        else:
+            # Se conservan los tamaños que no se han medido esta vez
+            medidos = {(resultado["caso"], resultado["filas"]) for resultado in resultados}
+            informe["resultados"] = [resultado for resultado in anteriores
+                                     if (resultado["caso"], resultado["filas"]) not in medidos] + resultados
+        referencias[argumentos.almacen] = informe
+        with open(REFERENCIA, 'w') as archivo:
+            json.dump(referencias, archivo, indent=2)
+        print(f"Referencia guardada en {REFERENCIA}")
+        sys.exit(0)
+
+    regresiones = comparar(resultados, anteriores)
+    for caso, filas, segundos, anterior in regresiones:
+        print(f"REGRESIÓN {caso} con {filas} filas: {segundos * 1000:.2f} ms "
+              f"(referencia ajustada {anterior * 1000:.2f} ms)")
+    # Un caso sin referencia no se puede dar por bueno: se avisa para guardarla con --completar-referencia
+    faltan = sin_referencia(resultados, anteriores)
+    for caso, filas in faltan:
+        print(f"SIN REFERENCIA {caso} con {filas} filas (guárdala con --completar-referencia)")
+    sys.exit(1 if regresiones or faltan else 0)
@@ -0,0 +1,87 @@
+"""Genera archivos de gastos, eventos y categorías de prueba con el formato de la aplicación.
+
+    python benchmarks/generar.py 100000 [directorio]
+"""
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre",
+         "Noviembre", "Diciembre"]
+CATEGORIAS = ["Casa", "Deporte", "Alimentación / Hogar", "Salir Fuera", "Coche", "Salud", "Viajes", "Regalos",
+              "Suscripciones", "Mascotas", "Ropa", "Educación"]
+CONCEPTOS_GASTOS = ["Renta Piso", "Luz / Agua", "Internet", "Gimnasio", "Supermercado", "Cena", "Gasolina",
+                    "Seguro", "Farmacia", "Netflix", "Veterinario", "Limpiadora"]
+QUIEN = ["Juntos", "Quintero", "Andreea", "Familia", "Amigos", "Trabajo"]
+CONCEPTOS_EVENTOS = ["Viaje a Alicante", "Cumpleaños", "Dentista", "Partido", "Cena con amigos", "Reunión",
+                     "Concierto", "Mudanza", "Boda", "Revisión coche"]
+
+
+# Primeros días de `cantidad` meses seguidos, terminando en diciembre de 2024
+def _inicios_mes(cantidad):
+    return pd.date_range(end="2024-12-01", periods=cantidad, freq="MS")
+
+
+def _nombre_mes(inicio):
+    return f"{MESES[inicio.month - 1]} {inicio.year}"
+
+
+# Unos 500 gastos por mes, entre 3 meses y 10 años
+def generar_gastos(filas, semilla=0):
+    generador = np.random.default_rng(semilla)
+    inicios = _inicios_mes(int(np.clip(filas // 500, 3, 120)))
+    mes = generador.integers(0, len(inicios), filas)
+    dia = generador.integers(0, 28, filas)
+    fechas = inicios[mes] + pd.to_timedelta(dia, unit="D")
+    conceptos = np.array(CONCEPTOS_GASTOS)[generador.integers(0, len(CONCEPTOS_GASTOS), filas)]
+    return pd.DataFrame({
+        "id": np.arange(filas),
+        "Mes": np.array([_nombre_mes(inicio) for inicio in inicios])[mes],
+        "Concepto": pd.Series(conceptos) + " " + pd.Series(generador.integers(1, 100, filas)).astype(str),
+        "Cantidad": np.round(generador.lognormal(3.5, 1.0, filas)).astype(int),
+        "Pagado": generador.random(filas) < 0.7,
+        "Categoría": np.array(CATEGORIAS)[generador.integers(0, len(CATEGORIAS), filas)],
+        "Fecha": fechas.strftime("%Y-%m-%d"),
+    })
+
+
+# Eventos de uno o varios días; algunos de todo el día y unos pocos recurrentes
+def generar_eventos(filas, semilla=0):
+    generador = np.random.default_rng(semilla + 1)
+    inicios = _inicios_mes(int(np.clip(filas // 200, 3, 120)))
+    fechas = inicios[0] + pd.to_timedelta(generador.integers(0, (inicios[-1] - inicios[0]).days + 28, filas), unit="D")
+    duracion = np.where(generador.random(filas) < 0.8, 0, generador.integers(1, 15, filas))
+    todo_el_dia = generador.random(filas) < 0.3
+    minutos = generador.integers(8 * 60, 22 * 60, filas)
+    horas = pd.Series(minutos // 60).map("{:02d}".format) + ":" + pd.Series(minutos % 60).map("{:02d}".format) + ":00"
+    recurrencia = np.array([None, "semanal", "mensual", "anual"], dtype=object)[
+        np.where(generador.random(filas) < 0.02, generador.integers(1, 4, filas), 0)]
+    return pd.DataFrame({
+        "id": np.arange(filas),
+        "Fecha": fechas.strftime("%Y-%m-%d"),
+        "Fecha_fin": (fechas + pd.to_timedelta(duracion, unit="D")).strftime("%Y-%m-%d"),
+        "Hora": horas.where(~todo_el_dia, "Todo el día"),
+        "Quien": np.array(QUIEN)[generador.integers(0, len(QUIEN), filas)],
+        "Concepto": np.array(CONCEPTOS_EVENTOS)[generador.integers(0, len(CONCEPTOS_EVENTOS), filas)],
+        "Todo_el_dia": todo_el_dia,
+        "Recurrencia": recurrencia,
+    })
+
+
+# Escribe gastos_fijos.json y eventos.json con `filas` filas cada uno, y categorias.json
+def generar_archivos(directorio, filas, semilla=0):
+    os.makedirs(directorio, exist_ok=True)
+    generar_gastos(filas, semilla).to_json(os.path.join(directorio, "gastos_fijos.json"), orient="records")
+    generar_eventos(filas, semilla).to_json(os.path.join(directorio, "eventos.json"), orient="records")
+    with open(os.path.join(directorio, "categorias.json"), 'w') as archivo:
+        json.dump(CATEGORIAS, archivo)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python benchmarks/generar.py FILAS [directorio]")
+        sys.exit(1)
+    generar_archivos(sys.argv[2] if len(sys.argv) > 2 else ".", int(sys.argv[1]))
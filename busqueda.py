@@ -0,0 +1,102 @@
+import bisect
+import re
+import threading
+import unicodedata
+
+import pandas as pd
+
+# Mayor que cualquier carácter que pueda seguir a un prefijo: las palabras que empiezan por
+# `prefijo` son las que quedan entre `prefijo` y `prefijo + _ULTIMO`
+_ULTIMO = "\U0010ffff"
+
+
+# "Revisión Coche / ÑU" -> ["revision", "coche", "nu"]: sin acentos ni mayúsculas
+def palabras(texto):
+    if not isinstance(texto, str):
+        return []
+    texto = "".join(letra for letra in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(letra))
+    return re.findall(r"\w+", texto.casefold())
+
+
+class IndiceConceptos:
+    """Índice invertido de las palabras de "Concepto" de una tabla (gastos o eventos).
+
+    Cada palabra, sin acentos ni mayúsculas, apunta a los ids de las filas que la
+    contienen; además se guardan ordenadas, así las que empiezan por un prefijo son
+    un corte con búsqueda binaria. Guarda también los valores de cada fila para
+    devolver los resultados sin leer la tabla. Al añadir, editar o borrar filas se
+    actualiza en su sitio, sin volver a construirse.
+    """
+
+    def __init__(self, datos, version=None):
+        self.version = version
+        self._bloqueo = threading.Lock()
+        self._columnas = list(datos.columns)
+        self._concepto = self._columnas.index("Concepto")
+        self._filas = {}  # id -> tupla con los valores de la fila
+        self._ids = {}  # palabra -> ids de las filas que la contienen
+        self._palabras = []  # las palabras de self._ids, ordenadas
+        self._anadir(datos)
+
+    def anadir(self, datos):
+        with self._bloqueo:
+            self._anadir(datos)
+
+    def actualizar(self, id, cambios):
+        with self._bloqueo:
+            fila = self._filas.get(id)
+            if fila is None:
+                return
+            nueva = tuple(cambios.get(columna, valor) for columna, valor in zip(self._columnas, fila))
+            self._filas[id] = nueva
+            if nueva[self._concepto] != fila[self._concepto]:
+                self._quitar(id, fila[self._concepto])
+                self._poner([id], nueva[self._concepto])
+
+    def eliminar(self, ids):
+        with self._bloqueo:
+            for id in ids:
+                fila = self._filas.pop(id, None)
+                if fila is not None:
+                    self._quitar(id, fila[self._concepto])
+
+    # Filas cuyo concepto tiene, por cada palabra buscada, alguna que empieza por ella ("limp" encuentra
+    # "Limpiadora"), ordenadas por id. Vacía si no se busca nada
+    def buscar(self, consulta):
+        ids = None
+        with self._bloqueo:
+            # Primero las palabras más largas, que suelen dejar menos candidatos
+            for palabra in sorted(set(palabras(consulta)), key=len, reverse=True):
+                inicio = bisect.bisect_left(self._palabras, palabra)
+                fin = bisect.bisect_left(self._palabras, palabra + _ULTIMO, inicio)
+                encontrados = set().union(*(self._ids[encontrada] for encontrada in self._palabras[inicio:fin]))
+                ids = encontrados if ids is None else ids & encontrados
+                if not ids:
+                    break
+            ids = sorted(ids or [])
+            filas = [self._filas[id] for id in ids]
+        return pd.DataFrame(filas, index=pd.Index(ids, name="id", dtype="int64"), columns=self._columnas)
+
+    # Cada concepto distinto se parte en palabras una sola vez
+    def _anadir(self, datos):
+        self._filas.update(zip(datos.index.tolist(), datos.itertuples(index=False, name=None)))
+        conceptos = datos["Concepto"].astype(object)
+        for concepto, posiciones in conceptos.groupby(conceptos, sort=False).indices.items():
+            self._poner(datos.index[posiciones].tolist(), concepto)
+
+    def _poner(self, ids, concepto):
+        for palabra in set(palabras(concepto)):
+            if palabra not in self._ids:
+                self._ids[palabra] = set()
+                bisect.insort(self._palabras, palabra)
+            self._ids[palabra].update(ids)
+
+    def _quitar(self, id, concepto):
+        for palabra in set(palabras(concepto)):
+            ids = self._ids.get(palabra)
+            if ids is None:
+                continue
+            ids.discard(id)
+            if not ids:
+                del self._ids[palabra]
+                del self._palabras[bisect.bisect_left(self._palabras, palabra)]
@@ -0,0 +1,209 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Opciones del formulario -> valor guardado en la columna "Recurrencia"
+RECURRENCIAS = {"No se repite": None, "Cada semana": "semanal", "Cada mes": "mensual", "Cada año": "anual"}
+# Opciones de "¿Quién lo hace?"
+QUIENES = ["Juntos", "Quintero", "Andreea"]
+
+# Columnas que identifican a un mismo evento repetido día a día en el formato antiguo
+_CLAVES_EVENTO = ["Hora", "Quien", "Concepto", "Todo_el_dia"]
+
+
+# Une las filas antiguas de un evento (una por día) en un solo rango Fecha - Fecha_fin
+def compactar_eventos(eventos):
+    datos = eventos.copy()
+    datos["Fecha_fin"] = datos["Fecha_fin"].where(datos["Fecha_fin"].notna(), datos["Fecha"])
+    sueltos = datos[datos["Recurrencia"].isna() & (datos["Fecha"] == datos["Fecha_fin"])]
+    if len(sueltos) < 2:
+        return datos
+
+    orden = sueltos[_CLAVES_EVENTO].astype(str).assign(_dia=pd.to_datetime(sueltos["Fecha"]))
+    orden = orden.sort_values(_CLAVES_EVENTO + ["_dia"], kind="stable")
+    # Empieza un tramo nuevo cuando cambia el evento o los días dejan de ser consecutivos
+    nuevo_tramo = (orden[_CLAVES_EVENTO] != orden[_CLAVES_EVENTO].shift()).any(axis=1)
+    nuevo_tramo |= orden["_dia"].diff() != pd.Timedelta(days=1)
+    tramos = orden.groupby(nuevo_tramo.cumsum())
+
+    primeros = tramos.head(1).index
+    compactados = datos.loc[primeros].copy()
+    compactados["Fecha_fin"] = tramos["_dia"].max().dt.strftime("%Y-%m-%d").to_numpy()
+    return pd.concat([datos.drop(index=sueltos.index), compactados]).sort_index()
+
+
+# Sin Fecha_fin (eventos antiguos aún sin compactar) el evento dura sólo el día de Fecha
+def indice_intervalos(eventos):
+    inicios = pd.to_datetime(eventos["Fecha"])
+    return pd.IntervalIndex.from_arrays(inicios, pd.to_datetime(eventos["Fecha_fin"]).fillna(inicios), closed="both")
+
+
+# Eventos que ocupan algún día de [desde, hasta), más los recurrentes que empiezan antes de `hasta`
+def eventos_en_rango(eventos, desde, hasta):
+    if eventos.empty:
+        return eventos
+    desde, hasta = pd.Timestamp(desde), pd.Timestamp(hasta)
+    intervalos = indice_intervalos(eventos)
+    solapan = intervalos.overlaps(pd.Interval(desde, hasta, closed="left"))
+    recurrentes = eventos["Recurrencia"].notna().to_numpy() & (intervalos.left < hasta)
+    return eventos[solapan | recurrentes]
+
+
+def _desplazar(fecha, recurrencia, veces):
+    if recurrencia == "semanal":
+        return fecha + pd.Timedelta(weeks=veces)
+    if recurrencia == "mensual":
+        return fecha + pd.DateOffset(months=veces)
+    return fecha + pd.DateOffset(years=veces)
+
+
+# Repeticiones (inicio, fin) de un evento recurrente que caen dentro de [desde, hasta)
+def _repeticiones(inicio, fin, recurrencia, desde, hasta):
+    duracion = fin - inicio
+    # Se empieza un poco antes de `desde` para no perder repeticiones que empiezan el mes anterior
+    if recurrencia == "semanal":
+        veces = (desde - duracion - inicio).days // 7
+    elif recurrencia == "mensual":
+        veces = (desde.year - inicio.year) * 12 + desde.month - inicio.month - duracion.days // 28 - 1
+    else:
+        veces = desde.year - inicio.year - duracion.days // 365 - 1
+    veces = max(veces, 0)
+
+    repeticiones = []
+    while True:
+        inicio_repeticion = _desplazar(inicio, recurrencia, veces)
+        if inicio_repeticion >= hasta:
+            return repeticiones
+        if inicio_repeticion + duracion >= desde:
+            repeticiones.append((inicio_repeticion, inicio_repeticion + duracion))
+        veces += 1
+
+
+# Una fila por cada día del mes en el que hay un evento, ordenadas por fecha y hora
+def expandir_mes(eventos, ano, mes):
+    desde = pd.Timestamp(ano, mes, 1)
+    hasta = desde + pd.DateOffset(months=1)
+    del_mes = eventos_en_rango(eventos, desde, hasta).reset_index()
+
+    inicios = pd.to_datetime(del_mes["Fecha"])
+    fines = pd.to_datetime(del_mes["Fecha_fin"]).fillna(inicios)
+    tramos = [(posicion, inicio, fin) for posicion, (inicio, fin) in enumerate(zip(inicios, fines))
+              if pd.isna(del_mes.at[posicion, "Recurrencia"])]
+    for posicion in np.flatnonzero(del_mes["Recurrencia"].notna().to_numpy()):
+        tramos += [(posicion, inicio, fin) for inicio, fin in
+                   _repeticiones(inicios[posicion], fines[posicion], del_mes.at[posicion, "Recurrencia"], desde, hasta)]
+    if not tramos:
+        return del_mes.iloc[0:0]
+
+    posiciones, inicios_tramo, fines_tramo = map(list, zip(*tramos))
+    # Se recorta cada tramo al mes y se repite la fila una vez por día
+    inicios_tramo = pd.Series(inicios_tramo).clip(lower=desde).to_numpy()
+    fines_tramo = pd.Series(fines_tramo).clip(upper=hasta - pd.Timedelta(days=1)).to_numpy()
+    dias = (fines_tramo - inicios_tramo).astype("timedelta64[D]").astype(int) + 1
+    repetidas = np.repeat(np.arange(len(tramos)), dias)
+    desplazamiento = np.arange(len(repetidas)) - np.repeat(np.cumsum(dias) - dias, dias)
+
+    expandidos = del_mes.iloc[np.asarray(posiciones)[repetidas]].reset_index(drop=True)
+    expandidos["Fecha"] = inicios_tramo[repetidas] + pd.to_timedelta(desplazamiento, unit="D")
+    # Los eventos de todo el día (sin hora) van primero
+    return expandidos.sort_values(["Fecha", "Hora"], kind="stable", na_position="first").reset_index(drop=True)
+
+
+# Día en que toca cada evento a partir de `hoy` (hoy mismo si está en curso), o NaT si ya pasó
+# y no se repite. Recorre los eventos uno a uno: pensado para pocos, p. ej. los de una búsqueda
+def proximas_fechas(eventos, hoy):
+    hoy = pd.Timestamp(hoy).normalize()
+    datos = _tipar(eventos)
+    proximas = []
+    for inicio, fin, recurrencia in zip(datos["Fecha"], datos["Fecha_fin"], datos["Recurrencia"]):
+        if pd.isna(recurrencia):
+            proximas.append(max(inicio, hoy) if fin >= hoy else pd.NaT)
+            continue
+        # Cualquier evento recurrente vuelve a ocurrir antes de un año
+        repeticiones = _repeticiones(inicio, fin, recurrencia, hoy, hoy + pd.DateOffset(years=1, days=1))
+        proximas.append(max(repeticiones[0][0], hoy) if repeticiones else pd.NaT)
+    return pd.to_datetime(pd.Series(proximas, index=eventos.index, dtype=object))
+
+
+# "HH:MM" para una hora ya convertida a Timedelta, o "Todo el día" si no tiene hora
+def formatear_hora(hora):
+    if pd.isna(hora):
+        return "Todo el día"
+    minutos = int(hora.total_seconds()) // 60
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+
+# Fechas como datetime64 y la hora como Timedelta (NaT si es "Todo el día")
+def _tipar(eventos):
+    datos = eventos.copy()
+    datos["Fecha"] = pd.to_datetime(datos["Fecha"])
+    datos["Fecha_fin"] = pd.to_datetime(datos["Fecha_fin"]).fillna(datos["Fecha"])
+    datos["Hora"] = pd.to_timedelta(datos["Hora"].where(datos["Hora"] != "Todo el día"), errors="coerce")
+    return datos
+
+
+class CalendarioEventos:
+    """Eventos en memoria con las fechas ya convertidas y ordenados por fecha de inicio.
+
+    Los eventos de un mes se buscan con una búsqueda binaria y un corte. Al añadir o
+    borrar eventos se actualiza en su sitio, sin volver a construirse.
+    """
+
+    def __init__(self, eventos, version=None):
+        self.version = version
+        self._bloqueo = threading.Lock()
+        datos = _tipar(eventos)
+        recurrentes = datos["Recurrencia"].notna()
+        self._recurrentes = datos[recurrentes]
+        self._rangos = datos[~recurrentes].sort_values("Fecha", kind="stable")
+        self._duracion_maxima = self._duracion(self._rangos)
+        self._meses = {}  # (año, mes) -> (primera, última) posición en self._rangos
+
+    def __len__(self):
+        return len(self._rangos) + len(self._recurrentes)
+
+    # Una fila por cada día del mes con un evento (ver expandir_mes)
+    def del_mes(self, ano, mes):
+        with self._bloqueo:
+            primera, ultima = self._posiciones(ano, mes)
+            candidatos = pd.concat([self._rangos.iloc[primera:ultima], self._recurrentes])
+        return expandir_mes(candidatos, ano, mes)
+
+    def anadir(self, eventos):
+        nuevos = _tipar(eventos)
+        recurrentes = nuevos["Recurrencia"].notna()
+        rangos = nuevos[~recurrentes].sort_values("Fecha", kind="stable")
+        with self._bloqueo:
+            if recurrentes.any():
+                self._recurrentes = pd.concat([self._recurrentes, nuevos[recurrentes]])
+            if len(rangos):
+                # Cada evento nuevo se coloca en su sitio según la fecha de inicio
+                posiciones = np.searchsorted(self._rangos["Fecha"].to_numpy(), rangos["Fecha"].to_numpy(), "right")
+                total = len(self._rangos)
+                orden = np.insert(np.arange(total), posiciones, np.arange(total, total + len(rangos)))
+                self._rangos = pd.concat([self._rangos, rangos]).iloc[orden]
+                self._duracion_maxima = max(self._duracion_maxima, self._duracion(rangos))
+            self._meses.clear()
+
+    def eliminar(self, ids):
+        with self._bloqueo:
+            self._rangos = self._rangos.drop(index=ids, errors="ignore")
+            self._recurrentes = self._recurrentes.drop(index=ids, errors="ignore")
+            self._meses.clear()
+
+    def _duracion(self, rangos):
+        if rangos.empty:
+            return pd.Timedelta(0)
+        return (rangos["Fecha_fin"] - rangos["Fecha"]).max()
+
+    def _posiciones(self, ano, mes):
+        if (ano, mes) not in self._meses:
+            desde = pd.Timestamp(ano, mes, 1)
+            hasta = desde + pd.DateOffset(months=1)
+            inicios = self._rangos["Fecha"].to_numpy()
+            # Un evento que empieza antes del mes puede llegar a él como mucho `duracion_maxima` días después
+            primera = np.searchsorted(inicios, (desde - self._duracion_maxima).to_datetime64(), "left")
+            ultima = np.searchsorted(inicios, hasta.to_datetime64(), "left")
+            self._meses[(ano, mes)] = (int(primera), int(ultima))
+        return self._meses[(ano, mes)]
@@ -0,0 +1,177 @@
+import pandas as pd
+
+from meses import partes_mes, periodo
+
+TOTALES = ["total", "pagado", "por_pagar"]
+
+
+# Importe para mostrar: sin decimales si son euros enteros (como se han mostrado siempre) y con dos
+# decimales y coma si tiene céntimos (p. ej. los gastos importados de un extracto)
+def formatear_euros(valor):
+    valor = round(float(valor), 2)
+    if valor.is_integer():
+        return f"{int(valor)} €"
+    return f"{valor:.2f} €".replace(".", ",")
+
+
+# Importe de una fila repartido entre total, pagado y por pagar
+def _importes(fila):
+    cantidad = pd.to_numeric(fila["Cantidad"], errors="coerce")
+    cantidad = 0 if pd.isna(cantidad) else cantidad
+    pagado = fila["Pagado"] == True  # Puede ser un bool de numpy, no vale `is True`
+    return [cantidad, cantidad if pagado else 0, 0 if pagado else cantidad]
+
+
+class VistaMes:
+    """Gastos de un mes agrupados por categoría, con los totales de cada una.
+
+    Se construye una vez por ejecución con un único groupby. Los cambios que se
+    hacen después (pagar, editar, eliminar) ajustan los totales sin volver a
+    recorrer la tabla.
+    """
+
+    def __init__(self, gastos):
+        self._gastos = gastos
+        cantidad = pd.to_numeric(gastos["Cantidad"], errors="coerce").fillna(0)
+        pagado = gastos["Pagado"].eq(True)
+        importes = pd.DataFrame({
+            "total": cantidad,
+            "pagado": cantidad.where(pagado, 0),
+            "por_pagar": cantidad.where(~pagado, 0),
+        })
+
+        # Con "Categoría" categórica se agrupa por los códigos enteros
+        grupos = importes.groupby(gastos["Categoría"], sort=False, dropna=False, observed=True)
+        self._posiciones = grupos.indices
+        sumas = grupos.sum()
+        self._totales = {categoria: valores for categoria, valores in zip(sumas.index, sumas[TOTALES].to_numpy().tolist())}
+
+    # Filas de una categoría (vacía si no tiene gastos)
+    def gastos(self, categoria):
+        posiciones = self._posiciones.get(categoria)
+        if posiciones is None:
+            return self._gastos.iloc[0:0]
+        return self._gastos.iloc[posiciones]
+
+    def totales(self, categoria=None):
+        if categoria is not None:
+            return dict(zip(TOTALES, self._totales.get(categoria, [0, 0, 0])))
+        return dict(zip(TOTALES, (sum(valores) for valores in zip([0, 0, 0], *self._totales.values()))))
+
+    def anadir(self, fila):
+        self._sumar(fila, 1)
+
+    def actualizar(self, fila, cambios):
+        self._sumar(fila, -1)
+        self._sumar({**dict(fila), **cambios}, 1)
+
+    def eliminar(self, fila):
+        self._sumar(fila, -1)
+
+    def _sumar(self, fila, signo):
+        totales = self._totales.setdefault(fila["Categoría"], [0, 0, 0])
+        for posicion, importe in enumerate(_importes(fila)):
+            totales[posicion] += signo * importe
+
+
+# Copia en bloque los gastos de `mes_origen` a `mes_destino`: la fecha se mueve los mismos meses
+# (sin pasar del último día del mes) y quedan sin pagar. Se saltan los que ya están en el destino
+# (`existentes`) con el mismo concepto y categoría. Devuelve las filas nuevas, sin id
+def traspasar_gastos(gastos, mes_origen, mes_destino, existentes):
+    origen, destino = partes_mes(mes_origen), partes_mes(mes_destino)
+    if origen is None or destino is None:
+        raise ValueError(f"Mes no válido: '{mes_origen if origen is None else mes_destino}'")
+    desplazamiento = (destino[0] - origen[0]) * 12 + destino[1] - origen[1]
+
+    claves = ["Concepto", "Categoría"]
+    repetidos = pd.MultiIndex.from_frame(gastos[claves].astype(object)).isin(
+        pd.MultiIndex.from_frame(existentes[claves].astype(object)))
+    gastos = gastos[~repetidos]
+    fechas = pd.to_datetime(gastos["Fecha"], errors="coerce") + pd.DateOffset(months=desplazamiento)
+    return pd.DataFrame({
+        "Mes": mes_destino,
+        "Concepto": gastos["Concepto"].astype(object),
+        "Cantidad": gastos["Cantidad"],
+        "Pagado": False,
+        "Categoría": gastos["Categoría"].astype(object),
+        "Fecha": fechas.dt.strftime("%Y-%m-%d").fillna(f"{destino[0]}-{destino[1]:02d}-01"),
+    }, index=gastos.index).reset_index(drop=True)
+
+
+class ResumenMensual:
+    """Totales de los gastos por (Mes, Categoría): total, pagado, por pagar y número de gastos.
+
+    Se calcula una vez con un groupby sobre todos los gastos y después se ajusta
+    con cada gasto añadido, editado o eliminado, sin volver a recorrerlos.
+    `version` es la versión de los datos con la que está al día; si se ha leído
+    de disco, en su lugar está `huella`, la de los datos de los que se calculó.
+    """
+
+    def __init__(self, sumas=None, version=None, huella=None):
+        self.version = version
+        self.huella = huella
+        self._sumas = sumas or {}  # (mes, categoría) -> [total, pagado, por_pagar, gastos]
+
+    @classmethod
+    def desde_gastos(cls, gastos, version=None):
+        cantidad = pd.to_numeric(gastos["Cantidad"], errors="coerce").fillna(0)
+        pagado = gastos["Pagado"].eq(True)
+        importes = pd.DataFrame({
+            "total": cantidad,
+            "pagado": cantidad.where(pagado, 0),
+            "por_pagar": cantidad.where(~pagado, 0),
+            "gastos": 1,
+        })
+        sumas = importes.groupby([gastos["Mes"], gastos["Categoría"]], sort=False, observed=True).sum()
+        return cls({clave: [total, pagado, por_pagar, int(numero)]
+                    for clave, (total, pagado, por_pagar, numero) in zip(sumas.index, sumas.to_numpy().tolist())}, version)
+
+    # Lo guardado con registros()
+    @classmethod
+    def desde_registros(cls, registros, huella=None):
+        return cls({(registro["Mes"], registro["Categoría"]): [registro[columna] for columna in TOTALES + ["gastos"]]
+                    for registro in registros}, huella=huella)
+
+    def registros(self):
+        return [{"Mes": mes, "Categoría": categoria, **dict(zip(TOTALES + ["gastos"], valores))}
+                for (mes, categoria), valores in self._sumas.items()]
+
+    def anadir(self, fila):
+        self._sumar(fila, 1)
+
+    # Meses con algún gasto
+    def meses(self):
+        return list(dict.fromkeys(mes for (mes, _), valores in self._sumas.items() if valores[3] > 0))
+
+    def actualizar(self, fila, cambios):
+        self._sumar(fila, -1)
+        self._sumar({**dict(fila), **cambios}, 1)
+
+    def eliminar(self, fila):
+        self._sumar(fila, -1)
+
+    def renombrar_categoria(self, anterior, nueva):
+        for mes, categoria in [clave for clave in self._sumas if clave[1] == anterior]:
+            valores = self._sumas.pop((mes, categoria))
+            destino = self._sumas.setdefault((mes, nueva), [0, 0, 0, 0])
+            for posicion, valor in enumerate(valores):
+                destino[posicion] += valor
+
+    # Una fila por (Mes, Categoría) con gastos, ordenadas por mes; "Periodo" es "AAAA-MM" (o el
+    # texto del mes si no tiene la forma "Octubre 2024")
+    def tabla(self):
+        tabla = pd.DataFrame(self.registros(), columns=["Mes", "Categoría"] + TOTALES + ["gastos"])
+        tabla = tabla[tabla["gastos"] > 0]
+        tabla.insert(1, "Periodo", tabla["Mes"].map(periodo).fillna(tabla["Mes"]))
+        return tabla.sort_values(["Periodo", "Categoría"], kind="stable").reset_index(drop=True)
+
+    def _sumar(self, fila, signo):
+        valores = self._sumas.setdefault((fila["Mes"], fila["Categoría"]), [0, 0, 0, 0])
+        for posicion, importe in enumerate(_importes(fila) + [1]):
+            valores[posicion] += signo * importe
+
+
+# Totales por mes de unos gastos cualesquiera (p. ej. los encontrados al buscar), ordenados por mes
+def totales_por_mes(gastos):
+    tabla = ResumenMensual.desde_gastos(gastos).tabla()
+    return tabla.groupby(["Periodo", "Mes"], sort=True)[TOTALES + ["gastos"]].sum().reset_index()
@@ -0,0 +1,194 @@
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from persistencia import escribir_atomico
+
+# Al pasar de este tamaño (o del de la tabla, si es mayor), el tramo actual del registro se cierra con
+# una instantánea de la tabla: para reconstruir cualquier versión nunca hay que repetir más de un tramo,
+# y las instantáneas nunca ocupan más que los cambios que resumen
+TAMANO_TRAMO = 256 * 1024
+# Lo mismo en SQLite, contado en operaciones (o en filas de la tabla, si hay más)
+OPERACIONES_POR_INSTANTANEA = 2000
+# Tramos (o instantáneas en SQLite) que se guardan; los más antiguos se borran
+INSTANTANEAS_GUARDADAS = 10
+
+_TRAMO = re.compile(r"cambios-(\d+)\.jsonl$")
+_accion_local = threading.local()
+
+
+# Fecha y hora local con milisegundos, igual que strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime') en SQLite
+def momento_actual():
+    return datetime.now().isoformat(timespec="milliseconds")
+
+
+# Los cambios hechos dentro del bloque, en uno o varios archivos, son una sola acción y se deshacen juntos.
+# `deshace` es la acción que estos cambios deshacen. Un bloque dentro de otro forma parte del de fuera
+@contextmanager
+def accion(deshace=None):
+    if getattr(_accion_local, "actual", None) is not None:
+        yield
+        return
+    _accion_local.actual = (uuid.uuid4().hex, deshace)
+    try:
+        yield
+    finally:
+        _accion_local.actual = None
+
+
+# (acción, acción que deshace) del bloque actual; fuera de un bloque, cada cambio es una acción nueva
+def accion_actual():
+    return getattr(_accion_local, "actual", None) or (uuid.uuid4().hex, None)
+
+
+# Repite unas operaciones (tipo, id, antes, después) sobre las filas {id: fila}
+def aplicar(filas, operaciones):
+    for tipo, id, _, despues in operaciones:
+        if tipo == "insertar":
+            filas[id] = {"id": id, **despues}
+        elif tipo == "eliminar":
+            filas.pop(id, None)
+        elif id in filas:
+            filas[id] = {**filas[id], **despues}
+
+
+# La acción más reciente de `cambios` (del más antiguo al más reciente) que se puede deshacer: la última
+# que no deshace otra ni se ha deshecho ya. Devuelve {"accion", "momento", "operaciones"} o None
+def ultima_accion(cambios):
+    deshechas = {cambio.get("deshace") for cambio in cambios}
+    for cambio in reversed(cambios):
+        if cambio.get("deshace") is None and cambio["accion"] not in deshechas:
+            partes = [parte for parte in cambios if parte["accion"] == cambio["accion"]]
+            return {"accion": cambio["accion"], "momento": cambio["momento"],
+                    "operaciones": [operacion for parte in partes for operacion in parte["operaciones"]]}
+    return None
+
+
+def _valor_json(valor):
+    return valor.item() if hasattr(valor, "item") else str(valor)
+
+
+class Historial:
+    """Historial de cambios de un archivo de datos, en el directorio "<archivo>.historial".
+
+    Cada cambio es una línea de "cambios-N.jsonl" con su momento, su acción y sus
+    operaciones por fila (insertar, actualizar o eliminar, con los valores de antes
+    y de después); al registro sólo se le añaden líneas al final. Cada tramo N
+    empieza con "instantanea-N.json", la tabla completa en ese momento, y cuando
+    pasa de TAMANO_TRAMO o del tamaño de la tabla se empieza otro. Sólo se guardan
+    los últimos INSTANTANEAS_GUARDADAS tramos. El almacén lo escribe con el archivo
+    de datos bloqueado, justo después de escribirlo.
+    """
+
+    def __init__(self, nombre_archivo):
+        self.directorio = f"{os.path.splitext(nombre_archivo)[0]}.historial"
+
+    def existe(self):
+        return bool(self._tramos())
+
+    # Sin historial, la próxima escritura empieza uno nuevo con la tabla que haya entonces
+    def borrar(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    # `cambios`: [{"accion", "deshace", "operaciones"}]. `contenido` es la tabla que se acaba de escribir
+    # y `anterior` la que había antes: la primera vez es la instantánea de partida
+    def registrar(self, cambios, contenido, anterior=None):
+        if not cambios:
+            return
+        tramos = self._tramos()
+        if not tramos:
+            os.makedirs(self.directorio, exist_ok=True)
+            self._empezar_tramo(0, anterior if anterior is not None else "[]")
+            tramos = [0]
+        ruta = self._ruta_tramo(tramos[-1])
+        momento = momento_actual()
+        lineas = "".join(json.dumps({"momento": momento, **cambio}, ensure_ascii=False, default=_valor_json) + "\n"
+                         for cambio in cambios)
+        with open(ruta, 'a', encoding="utf-8") as archivo:
+            archivo.write(lineas)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        if os.path.getsize(ruta) > max(TAMANO_TRAMO, len(contenido.encode("utf-8"))):
+            self._empezar_tramo(tramos[-1] + 1, contenido)
+            self._podar(tramos + [tramos[-1] + 1])
+
+    # Cambios con momento entre `desde` y `hasta` (textos ISO, incluidos), del más antiguo al más reciente.
+    # Sólo se leen los tramos que tocan ese periodo
+    def cambios(self, desde=None, hasta=None):
+        tramos = self._tramos()
+        inicios = [self._inicio(numero) for numero in tramos]
+        resultado = []
+        for posicion, numero in enumerate(tramos):
+            if desde is not None and posicion + 1 < len(tramos) and inicios[posicion + 1] < desde:
+                continue
+            if hasta is not None and inicios[posicion] > hasta:
+                break
+            resultado += [cambio for cambio in self._leer_tramo(numero)
+                          if (desde is None or cambio["momento"] >= desde) and (hasta is None or cambio["momento"] <= hasta)]
+        return resultado
+
+    # Cambios de los últimos `cantidad` tramos, y si con ellos están todos
+    def recientes(self, cantidad):
+        tramos = self._tramos()
+        return [cambio for numero in tramos[-cantidad:] for cambio in self._leer_tramo(numero)], len(tramos) <= cantidad
+
+    # Filas de la tabla tal como estaban en `momento`: la instantánea anterior más los cambios de su tramo
+    # hasta ese momento (antes del tramo más antiguo que se guarda, su instantánea). None si no hay
+    # historial (los datos no han cambiado desde que existe)
+    def estado(self, momento):
+        tramos = self._tramos()
+        if not tramos:
+            return None
+        numero = next((numero for numero in reversed(tramos) if self._inicio(numero) <= momento), tramos[0])
+        with open(self._ruta_instantanea(numero), 'r', encoding="utf-8") as archivo:
+            filas = {fila["id"]: fila for fila in json.loads(archivo.read() or "[]")}
+        for cambio in self._leer_tramo(numero):
+            if cambio["momento"] > momento:
+                break
+            aplicar(filas, cambio["operaciones"])
+        return list(filas.values())
+
+    def _ruta_tramo(self, numero):
+        return os.path.join(self.directorio, f"cambios-{numero:06d}.jsonl")
+
+    def _ruta_instantanea(self, numero):
+        return os.path.join(self.directorio, f"instantanea-{numero:06d}.json")
+
+    def _tramos(self):
+        try:
+            nombres = os.listdir(self.directorio)
+        except FileNotFoundError:
+            return []
+        return sorted(int(encontrado.group(1)) for encontrado in map(_TRAMO.match, nombres) if encontrado)
+
+    # La instantánea se escribe antes que el tramo: un tramo que existe siempre tiene la suya
+    def _empezar_tramo(self, numero, contenido):
+        escribir_atomico(self._ruta_instantanea(numero), contenido)
+        escribir_atomico(self._ruta_tramo(numero), json.dumps({"instantanea": numero, "momento": momento_actual()}) + "\n")
+
+    # Se borran los tramos más antiguos, cada uno antes que su instantánea
+    def _podar(self, tramos):
+        for numero in tramos[:-INSTANTANEAS_GUARDADAS]:
+            os.remove(self._ruta_tramo(numero))
+            os.remove(self._ruta_instantanea(numero))
+
+    # Momento de la instantánea con la que empieza el tramo (su primera línea)
+    def _inicio(self, numero):
+        with open(self._ruta_tramo(numero), 'r', encoding="utf-8") as archivo:
+            return json.loads(archivo.readline())["momento"]
+
+    def _leer_tramo(self, numero):
+        cambios = []
+        with open(self._ruta_tramo(numero), 'r', encoding="utf-8") as archivo:
+            archivo.readline()
+            for linea in archivo:
+                try:
+                    cambios.append(json.loads(linea))
+                except ValueError:
+                    break  # Una línea a medio escribir
+        return cambios
@@ -0,0 +1,292 @@
+"""Importa de una vez los movimientos de un extracto del banco (CSV u OFX) como gastos.
+
+El extracto se lee por trozos, las columnas se asignan según las reglas (ver
+REGLAS_POR_DEFECTO, se pueden cambiar en reglas_importacion.json) y todos los
+gastos nuevos se guardan en una sola escritura. Un índice con la huella de cada
+movimiento ya importado permite repetir la importación sin duplicar nada.
+
+    python importacion.py extracto.csv [--archivo gastos_fijos.json] [--reglas reglas_importacion.json]
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+
+import pandas as pd
+
+from almacenamiento import ARCHIVO_CATEGORIAS, cargar_categorias, guardar_categorias, insertar_gastos
+from meses import MESES
+from persistencia import bloqueo_archivo, escribir_atomico, escritor
+
+ARCHIVO_REGLAS = "reglas_importacion.json"
+
+REGLAS_POR_DEFECTO = {
+    # Nombres posibles de cada columna en el CSV (sin distinguir mayúsculas); se usa el primero que exista
+    "columnas": {
+        "Fecha": ["Fecha", "Fecha operación", "Fecha valor", "F. Operación", "Date"],
+        "Concepto": ["Concepto", "Descripción", "Description", "Movimiento", "Payee"],
+        "Cantidad": ["Importe", "Cantidad", "Amount"],
+    },
+    "separador": None,  # None: se deduce del propio archivo
+    "codificacion": "utf-8-sig",
+    "saltar_filas": 0,  # Líneas antes de la cabecera (muchos bancos ponen ahí el titular y la cuenta)
+    "formato_fecha": "%d/%m/%Y",  # Las fechas que no lo cumplan se prueban como "AAAA-MM-DD"
+    # Separador decimal y de miles de los importes. None: se deducen de los importes del extracto
+    # ("-3.50" y "1.234,56" no dejan dudas); si todos son dudosos ("1.234") la importación se para
+    "decimal": None,
+    "miles": None,
+    "solo_cargos": True,  # Se importan sólo los importes negativos (los ingresos se descartan)
+    "pagado": True,
+    # [expresión regular sobre el concepto, categoría]; gana la primera que coincida
+    "categorias": [
+        ["alquiler|renta|comunidad|iberdrola|endesa|naturgy|agua|internet|movistar|vodafone", "Casa"],
+        ["mercadona|carrefour|lidl|aldi|eroski|dia |supermercado|ikea", "Alimentación / Hogar"],
+        ["gimnasio|gym|decathlon|padel|piscina", "Deporte"],
+        ["restaurante|bar |cafeter|glovo|just eat|uber eats|cine", "Salir Fuera"],
+    ],
+    "categoria_por_defecto": "Sin categoría",
+    "filas_por_trozo": 10000,
+}
+
+COLUMNAS_MOVIMIENTO = ["Fecha", "Concepto", "Importe", "Referencia"]
+
+
+class ExtractoNoValido(ValueError):
+    """El extracto no se puede leer: formato o codificación incorrectos, faltan columnas o los importes son dudosos."""
+
+
+def cargar_reglas(nombre_archivo=ARCHIVO_REGLAS):
+    reglas = dict(REGLAS_POR_DEFECTO)
+    if os.path.exists(nombre_archivo):
+        with open(nombre_archivo, 'r') as archivo:
+            reglas.update(json.load(archivo))
+    return reglas
+
+
+# Índice de movimientos ya importados: "<archivo>.importados.json" con la huella de cada uno
+def _ruta_indice(nombre_archivo):
+    return f"{os.path.splitext(nombre_archivo)[0]}.importados.json"
+
+
+def _leer_indice(ruta):
+    try:
+        with open(ruta, 'r') as archivo:
+            return set(json.load(archivo))
+    except (FileNotFoundError, ValueError):
+        return set()
+
+
+def _abrir(origen, codificacion):
+    if isinstance(origen, (str, os.PathLike)):
+        return open(origen, 'r', encoding=codificacion, newline="")
+    return io.TextIOWrapper(origen, encoding=codificacion, newline="")  # Archivo subido (binario)
+
+
+# Separador decimal según los importes que no dejan dudas: el último de dos separadores distintos
+# ("1.234,56"), uno que no separa grupos de tres cifras ("-3,5", "12.00", "1234.567"), o el contrario
+# de uno que se repite ("1.234.567"). Falla si los importes se contradicen o si hacía falta saberlo
+# y ninguno lo aclara. `anterior` es el deducido en los trozos anteriores del extracto
+def _separador_decimal(texto, anterior=None):
+    cifras = texto.str.replace(r"[^\d,.]", "", regex=True)
+    pistas = {}
+    for separador, otro in ((",", "."), (".", ",")):
+        separador_re, otro_re = re.escape(separador), re.escape(otro)
+        pistas[separador] = (cifras.str.contains(rf"{otro_re}\d*{separador_re}\d*$") |
+                             cifras.str.fullmatch(rf"\d*{separador_re}(\d{{1,2}}|\d{{4,}})|\d{{4,}}{separador_re}\d+") |
+                             cifras.str.contains(rf"{otro_re}\d{{3}}{otro_re}"))
+    deducidos = [separador for separador, pista in pistas.items() if pista.any()]
+    if anterior is not None:
+        deducidos = list(dict.fromkeys([anterior] + deducidos))
+    if len(deducidos) > 1:
+        ejemplos = [cifras[pista].iloc[0] for pista in pistas.values() if pista.any()]
+        raise ExtractoNoValido(f"Los importes del extracto usan separadores decimales distintos (p. ej. {' y '.join(ejemplos)}); "
+                         f"indica \"decimal\" y \"miles\" en {ARCHIVO_REGLAS}")
+    if deducidos:
+        return deducidos[0]
+    dudosos = cifras[cifras.str.fullmatch(r"\d{1,3}[.,]\d{3}")]
+    if len(dudosos):
+        raise ExtractoNoValido(f"No se puede saber si en el importe '{dudosos.iloc[0]}' el separador es decimal o de miles; "
+                         f"indica \"decimal\" y \"miles\" en {ARCHIVO_REGLAS}")
+    return None
+
+
+def _importes(texto, decimal, miles):
+    texto = texto.str.replace(r"[^\d,.\-+]", "", regex=True)
+    if miles:
+        texto = texto.str.replace(miles, "", regex=False)
+    return pd.to_numeric(texto.str.replace(decimal, ".", regex=False), errors="coerce")
+
+
+# Movimientos de un CSV, por trozos de `filas_por_trozo` filas
+def _trozos_csv(origen, reglas):
+    with _abrir(origen, reglas["codificacion"]) as archivo:
+        lector = pd.read_csv(archivo, sep=reglas["separador"], engine="python" if reglas["separador"] is None else "c",
+                             dtype=str, skiprows=reglas["saltar_filas"], chunksize=reglas["filas_por_trozo"])
+        columnas, decimal = None, reglas["decimal"]
+        for trozo in lector:
+            if columnas is None:
+                columnas = _asignar_columnas(trozo.columns, reglas["columnas"])
+            importes = trozo[columnas["Cantidad"]].fillna("")
+            miles = reglas["miles"]
+            if reglas["decimal"] is None:
+                decimal = _separador_decimal(importes, decimal)
+                miles = {",": ".", ".": ","}.get(decimal)
+            fechas = trozo[columnas["Fecha"]].str.strip()
+            fecha = pd.to_datetime(fechas, format=reglas["formato_fecha"], errors="coerce")
+            fecha = fecha.fillna(pd.to_datetime(fechas.where(fecha.isna()), format="ISO8601", errors="coerce"))
+            yield pd.DataFrame({
+                "Fecha": fecha,
+                "Concepto": trozo[columnas["Concepto"]].fillna("").str.strip(),
+                "Importe": _importes(importes, decimal or ".", miles),
+                "Referencia": None,
+            })
+
+
+def _asignar_columnas(disponibles, candidatas):
+    por_nombre = {str(columna).strip().lower(): columna for columna in disponibles}
+    columnas = {}
+    for destino, nombres in candidatas.items():
+        encontrada = next((por_nombre[nombre.lower()] for nombre in nombres if nombre.lower() in por_nombre), None)
+        if encontrada is None:
+            raise ExtractoNoValido(f"No se encuentra la columna de '{destino}' en el extracto (se buscó {', '.join(nombres)}); "
+                             f"columnas del archivo: {', '.join(map(str, disponibles))}")
+        columnas[destino] = encontrada
+    return columnas
+
+
+# Movimientos de un OFX/QFX (<STMTTRN> con DTPOSTED, TRNAMT, NAME/MEMO y FITID), leyendo línea a línea
+def _trozos_ofx(origen, reglas):
+    movimientos, pendiente = [], ""
+    with _abrir(origen, reglas["codificacion"]) as archivo:
+        for linea in archivo:
+            pendiente += linea
+            if "</STMTTRN>" not in pendiente.upper():
+                continue
+            bloques = re.split(r"</STMTTRN>", pendiente, flags=re.IGNORECASE)
+            pendiente = bloques.pop()
+            for bloque in bloques:
+                etiquetas = {nombre.upper(): valor.strip()
+                             for nombre, valor in re.findall(r"<(\w+)>([^<\r\n]*)", bloque[bloque.upper().find("<STMTTRN>"):])}
+                movimientos.append([etiquetas.get("DTPOSTED", "")[:8], etiquetas.get("NAME") or etiquetas.get("MEMO", ""),
+                                    etiquetas.get("TRNAMT", ""), etiquetas.get("FITID")])
+            if len(movimientos) >= reglas["filas_por_trozo"]:
+                yield _movimientos_ofx(movimientos)
+                movimientos = []
+    if movimientos:
+        yield _movimientos_ofx(movimientos)
+
+
+def _movimientos_ofx(movimientos):
+    trozo = pd.DataFrame(movimientos, columns=COLUMNAS_MOVIMIENTO)
+    trozo["Fecha"] = pd.to_datetime(trozo["Fecha"], format="%Y%m%d", errors="coerce")
+    trozo["Importe"] = pd.to_numeric(trozo["Importe"].str.replace(",", ".", regex=False), errors="coerce")
+    return trozo
+
+
+# Huella de cada movimiento: la referencia del banco si la hay; si no, fecha, importe y concepto más
+# cuántas veces ha salido ya ese mismo movimiento en el extracto (dos cafés iguales el mismo día son dos gastos).
+# `vistos` lleva la cuenta entre trozos
+def _huellas(movimientos, vistos):
+    if movimientos.empty:
+        return pd.Series([], index=movimientos.index, dtype=object)
+    claves = (movimientos["Fecha"].dt.strftime("%Y-%m-%d") + "|" + movimientos["Importe"].map("{:.2f}".format).astype(str)
+              + "|" + movimientos["Concepto"].str.lower().str.split().str.join(" "))
+    repeticion = claves.groupby(claves, sort=False).cumcount() + claves.map(vistos).fillna(0).astype(int)
+    for clave, veces in claves.value_counts(sort=False).items():
+        vistos[clave] = vistos.get(clave, 0) + veces
+    claves = ("ref|" + movimientos["Referencia"]).where(movimientos["Referencia"].notna(),
+                                                        claves + "|" + repeticion.astype(str))
+    return claves.map(lambda clave: hashlib.blake2b(clave.encode(), digest_size=12).hexdigest())
+
+
+# Los errores al leer el extracto (del lector de CSV, de codificación...) como ExtractoNoValido
+def _leer(trozos):
+    try:
+        yield from trozos
+    except ExtractoNoValido:
+        raise
+    except (ValueError, KeyError, IndexError, csv.Error, UnicodeError) as error:
+        raise ExtractoNoValido(f"No se puede leer el extracto: {error}") from error
+
+
+# Convierte movimientos en gastos: Mes sale de la fecha y la categoría de las reglas
+def _gastos(movimientos, reglas):
+    cantidad = -movimientos["Importe"] if reglas["solo_cargos"] else movimientos["Importe"].abs()
+    categoria = pd.Series(None, index=movimientos.index, dtype=object)
+    for patron, nombre in reglas["categorias"]:
+        categoria = categoria.where(categoria.notna() | ~movimientos["Concepto"].str.contains(patron, case=False, regex=True),
+                                    nombre)
+    return pd.DataFrame({
+        "Mes": (movimientos["Fecha"].dt.month - 1).map(dict(enumerate(MESES))) + " " + movimientos["Fecha"].dt.year.astype(str),
+        "Concepto": movimientos["Concepto"],
+        "Cantidad": cantidad.round(2),
+        "Pagado": bool(reglas["pagado"]),
+        "Categoría": categoria.fillna(reglas["categoria_por_defecto"]),
+        "Fecha": movimientos["Fecha"].dt.strftime("%Y-%m-%d"),
+    })
+
+
+# Importa un extracto (ruta o archivo binario abierto). `formato` es "csv" u "ofx"; si no se da, sale de la
+# extensión. Devuelve cuántos movimientos se han leído, importado, saltado por repetidos y descartado.
+# Si el extracto no se puede leer lanza ExtractoNoValido, sin haber importado nada
+def importar(origen, nombre_archivo, reglas=None, formato=None):
+    reglas = reglas or cargar_reglas()
+    if formato is None:
+        nombre = origen if isinstance(origen, (str, os.PathLike)) else getattr(origen, "name", "")
+        formato = "ofx" if os.path.splitext(str(nombre))[1].lower() in (".ofx", ".qfx") else "csv"
+    trozos = _leer(_trozos_ofx(origen, reglas) if formato == "ofx" else _trozos_csv(origen, reglas))
+
+    ruta_indice = _ruta_indice(nombre_archivo)
+    resultado = {"leidos": 0, "importados": 0, "repetidos": 0, "descartados": 0}
+    # El índice queda bloqueado toda la importación: dos importaciones a la vez no pueden meter lo mismo
+    with bloqueo_archivo(ruta_indice):
+        indice = _leer_indice(ruta_indice)
+        nuevos, huellas_nuevas, vistos = [], [], {}
+        for movimientos in trozos:
+            resultado["leidos"] += len(movimientos)
+            validos = movimientos["Fecha"].notna() & movimientos["Importe"].notna()
+            if reglas["solo_cargos"]:
+                validos &= movimientos["Importe"] < 0
+            movimientos = movimientos[validos]
+            resultado["descartados"] += int((~validos).sum())
+            if movimientos.empty:  # P. ej. un trozo sólo con ingresos
+                continue
+            huellas = _huellas(movimientos, vistos)
+            repetidos = huellas.isin(indice)
+            resultado["repetidos"] += int(repetidos.sum())
+            nuevos.append(_gastos(movimientos[~repetidos], reglas))
+            huellas_nuevas += list(huellas[~repetidos])
+        if not huellas_nuevas:
+            return resultado
+
+        gastos = pd.concat(nuevos, ignore_index=True)
+        categorias = cargar_categorias(ARCHIVO_CATEGORIAS)
+        faltan = [categoria for categoria in gastos["Categoría"].unique() if categoria not in categorias]
+        if faltan:
+            guardar_categorias(ARCHIVO_CATEGORIAS, categorias + faltan)
+        insertar_gastos(nombre_archivo, gastos.to_dict("records"))
+        # El índice se escribe cuando los gastos ya están en disco: si algo falla antes, se pueden volver a importar
+        escritor.vaciar()
+        escribir_atomico(ruta_indice, json.dumps(sorted(indice.union(huellas_nuevas))))
+    resultado["importados"] = len(huellas_nuevas)
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("extracto")
+    parser.add_argument("--archivo", default="gastos_fijos.json")
+    parser.add_argument("--reglas", default=ARCHIVO_REGLAS)
+    parser.add_argument("--formato", choices=["csv", "ofx"])
+    argumentos = parser.parse_args()
+    try:
+        resultado = importar(argumentos.extracto, argumentos.archivo, cargar_reglas(argumentos.reglas), argumentos.formato)
+    except ExtractoNoValido as error:
+        print(error)
+        sys.exit(1)
+    print(f"{resultado['leidos']} movimientos leídos: {resultado['importados']} importados, "
+          f"{resultado['repetidos']} ya importados antes, {resultado['descartados']} descartados")
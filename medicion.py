@@ -0,0 +1,53 @@
+import json
+import logging
+import time
+from logging.handlers import RotatingFileHandler
+
+from persistencia import contadores
+
+# Registro JSONL con una línea por ejecución del script; se rota al pasar de 1 MB
+ARCHIVO_REGISTRO = "rendimiento.jsonl"
+_registro = logging.getLogger("presupuesto.rendimiento")
+
+
+def _preparar_registro():
+    if not _registro.handlers:
+        manejador = RotatingFileHandler(ARCHIVO_REGISTRO, maxBytes=1024 * 1024, backupCount=3, encoding="utf-8")
+        manejador.setFormatter(logging.Formatter("%(message)s"))
+        _registro.addHandler(manejador)
+        _registro.setLevel(logging.INFO)
+        _registro.propagate = False
+
+
+class Medicion:
+    """Tiempo, filas y bytes leídos o escritos de cada fase de una ejecución del script.
+
+    El script se recorre de arriba abajo, así que cada fase se cierra con `marcar()`
+    y abarca todo lo ejecutado desde la marca anterior (cálculos y widgets).
+    Desactivada, `marcar()` vuelve sin hacer nada.
+    """
+
+    def __init__(self, activa):
+        self.activa = activa
+        self.fases = []
+        self._inicio = self._ultimo = time.perf_counter()
+        self._leidos, self._escritos = contadores["bytes_leidos"], contadores["bytes_escritos"]
+
+    def marcar(self, fase, filas=None):
+        if not self.activa:
+            return
+        ahora = time.perf_counter()
+        leidos, escritos = contadores["bytes_leidos"], contadores["bytes_escritos"]
+        self.fases.append({"fase": fase, "ms": (ahora - self._ultimo) * 1000, "filas": filas,
+                           "bytes_leidos": leidos - self._leidos, "bytes_escritos": escritos - self._escritos})
+        self._ultimo, self._leidos, self._escritos = ahora, leidos, escritos
+
+    # Añade la ejecución al registro y la devuelve (None si la medición está desactivada)
+    def terminar(self, **datos):
+        if not self.activa:
+            return None
+        ejecucion = {"momento": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "ms": (time.perf_counter() - self._inicio) * 1000, **datos, "fases": self.fases}
+        _preparar_registro()
+        _registro.info(json.dumps(ejecucion, ensure_ascii=False, default=str))
+        return ejecucion
@@ -0,0 +1,41 @@
+# Nombres de mes de la aplicación ("Octubre 2024"). Sólo usa la biblioteca estándar,
+# así la línea de comandos puede ordenar meses sin importar pandas
+
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre",
+         "Noviembre", "Diciembre"]
+
+
+# "Octubre 2024" -> (2024, 10), o None si el texto no es un mes
+def partes_mes(mes):
+    partes = str(mes).split()
+    if len(partes) != 2 or partes[0].capitalize() not in MESES or not partes[1].isdigit():
+        return None
+    return int(partes[1]), MESES.index(partes[0].capitalize()) + 1
+
+
+def nombre_mes(ano, mes):
+    return f"{MESES[mes - 1]} {ano}"
+
+
+# "Octubre 2024" -> "2024-10", para ordenar los meses (None si el texto no es un mes)
+def periodo(mes):
+    partes = partes_mes(mes)
+    return f"{partes[0]}-{partes[1]:02d}" if partes else None
+
+
+def siguiente_mes(mes):
+    partes = partes_mes(mes)
+    if partes is None:
+        return None
+    return nombre_mes(partes[0] + partes[1] // 12, partes[1] % 12 + 1)
+
+
+# En orden cronológico; los que no tienen la forma "Octubre 2024" van al final
+def ordenar_meses(meses):
+    return sorted(meses, key=lambda mes: (periodo(mes) is None, periodo(mes) or str(mes)))
+
+
+# Meses que se pueden elegir: los que tienen gastos más el actual y el siguiente del calendario
+def meses_disponibles(meses_con_gastos, hoy):
+    actual = nombre_mes(hoy.year, hoy.month)
+    return ordenar_meses(set(meses_con_gastos) | {actual, siguiente_mes(actual)})
@@ -0,0 +1,30 @@
+import math
+
+import streamlit as st
+
+TAMANOS_PAGINA = [10, 20, 50, 100]
+
+
+def _mover_pagina(clave, paso, total_paginas):
+    st.session_state[clave] = min(max(st.session_state.get(clave, 0) + paso, 0), total_paginas - 1)
+
+
+# Devuelve sólo las filas de la página actual de una lista y dibuja los botones para moverse.
+# La página de cada lista se guarda en st.session_state[f"pagina_{clave}"]
+def paginar(filas, clave):
+    tamano = st.session_state.get("tamano_pagina", TAMANOS_PAGINA[1])
+    total_paginas = max(1, math.ceil(len(filas) / tamano))
+    clave_pagina = f"pagina_{clave}"
+    # Si la lista se ha quedado más corta (p. ej. tras eliminar) se vuelve a la última página
+    pagina = min(st.session_state.get(clave_pagina, 0), total_paginas - 1)
+    st.session_state[clave_pagina] = pagina
+
+    if total_paginas > 1:
+        anterior, posicion, siguiente = st.columns([1, 2, 1])
+        anterior.button("◀ Anterior", key=f"anterior_{clave}", disabled=pagina == 0,
+                        on_click=_mover_pagina, args=(clave_pagina, -1, total_paginas))
+        posicion.caption(f"Página {pagina + 1} de {total_paginas} ({len(filas)} filas)")
+        siguiente.button("Siguiente ▶", key=f"siguiente_{clave}", disabled=pagina == total_paginas - 1,
+                         on_click=_mover_pagina, args=(clave_pagina, 1, total_paginas))
+
+    return filas.iloc[pagina * tamano:(pagina + 1) * tamano]
@@ -0,0 +1,308 @@
+import atexit
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_registro = logging.getLogger("presupuesto.escritor")
+# Una escritura que falla se reintenta cada vez más tarde, hasta esperar como mucho estos segundos
+REINTENTO_MAXIMO = 30
+
+
+# Bloqueo entre procesos de un archivo, usando un archivo auxiliar "<archivo>.lock".
+# Con `compartido=True` varios lectores pueden tenerlo a la vez (en Windows siempre es exclusivo)
+@contextmanager
+def bloqueo_archivo(nombre_archivo, compartido=False):
+    with open(f"{nombre_archivo}.lock", 'a+') as archivo:
+        if fcntl is not None:
+            fcntl.flock(archivo.fileno(), fcntl.LOCK_SH if compartido else fcntl.LOCK_EX)
+        else:
+            archivo.seek(0)
+            msvcrt.locking(archivo.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(archivo.fileno(), fcntl.LOCK_UN)
+            else:
+                archivo.seek(0)
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Bytes leídos y escritos en disco por el proceso (para medir el rendimiento)
+contadores = {"bytes_leidos": 0, "bytes_escritos": 0}
+_bloqueo_contadores = threading.Lock()
+
+
+def _contar(clave, cantidad):
+    with _bloqueo_contadores:
+        contadores[clave] += cantidad
+
+
+# Escribe el contenido en un archivo temporal y lo renombra sobre el destino,
+# así nunca queda un archivo a medio escribir. Devuelve la firma del archivo escrito
+def escribir_atomico(nombre_archivo, contenido):
+    directorio = os.path.dirname(os.path.abspath(nombre_archivo))
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'w') as archivo:
+            archivo.write(contenido)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+            firma = _firma_stat(os.fstat(archivo.fileno()))
+        os.replace(temporal, nombre_archivo)
+        _contar("bytes_escritos", firma[1])
+        return firma
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+# Devuelve las etiquetas de las filas añadidas, eliminadas o modificadas entre dos tablas
+def filas_modificadas(antes, despues):
+    columnas = sorted(set(antes.columns) | set(despues.columns))
+    hash_antes = pd.util.hash_pandas_object(antes.reindex(columns=columnas).astype(object), index=False)
+    hash_despues = pd.util.hash_pandas_object(despues.reindex(columns=columnas).astype(object), index=False)
+
+    comunes = hash_antes.index.intersection(hash_despues.index)
+    cambiadas = comunes[hash_antes[comunes].to_numpy() != hash_despues[comunes].to_numpy()]
+    return set(cambiadas) | set(hash_antes.index.difference(comunes)) | set(hash_despues.index.difference(comunes))
+
+
+class EscritorDiferido:
+    """Agrupa las escrituras de cada archivo y las hace en segundo plano.
+
+    Si llegan varias escrituras del mismo archivo antes de que pase `retardo`,
+    sólo se hace la última, llamando a `escribir(datos)`. Lo pendiente se vacía
+    al cerrar el proceso. Si una escritura falla (disco lleno, permisos...), los
+    datos siguen pendientes y se reintenta más tarde; el fallo se ve en estadisticas().
+    """
+
+    def __init__(self, retardo=0.5):
+        self.retardo = retardo
+        self._pendientes = {}  # nombre_archivo -> (datos, escribir, momento)
+        self._escribiendo = {}  # nombre_archivo -> datos que se están escribiendo ahora
+        self._condicion = threading.Condition()
+        self._hilo = None
+        self._fallos = {}  # nombre_archivo -> escrituras seguidas que han fallado
+        self.escrituras = 0
+        self.fusionadas = 0
+        self.errores = 0
+        self.ultimo_error = None
+        self.tiempo_total = 0.0
+        self.ultima_duracion = 0.0
+        atexit.register(self.vaciar)
+
+    def programar(self, nombre_archivo, datos, escribir):
+        with self._condicion:
+            momento = time.monotonic()
+            if nombre_archivo in self._pendientes:
+                # Se conserva el momento de la primera escritura para no retrasarla indefinidamente
+                self.fusionadas += 1
+                momento = self._pendientes[nombre_archivo][2]
+            self._pendientes[nombre_archivo] = (datos, escribir, momento)
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="escritor-diferido", daemon=True)
+                self._hilo.start()
+            self._condicion.notify()
+
+    # Datos aún no escritos en disco para el archivo, o None si no hay nada pendiente
+    def pendiente(self, nombre_archivo):
+        with self._condicion:
+            entrada = self._pendientes.get(nombre_archivo)
+            if entrada is None:
+                return self._escribiendo.get(nombre_archivo)
+        return entrada[0]
+
+    # Escribe todo lo pendiente, esperando antes a la escritura que esté haciendo el hilo en ese momento.
+    # Se repite mientras las propias escrituras programen otras nuevas. Lo que falla se intenta
+    # una sola vez: queda pendiente para que lo reintente el hilo
+    def vaciar(self):
+        fallidos = set()
+        while True:
+            with self._condicion:
+                while self._escribiendo:
+                    self._condicion.wait()
+                pendientes = [(nombre_archivo, entrada) for nombre_archivo, entrada in self._pendientes.items()
+                              if nombre_archivo not in fallidos]
+                if not pendientes:
+                    return
+                for nombre_archivo, (datos, _, _) in pendientes:
+                    del self._pendientes[nombre_archivo]
+                    self._escribiendo[nombre_archivo] = datos
+            for nombre_archivo, (datos, escribir, _) in pendientes:
+                if not self._escribir(nombre_archivo, datos, escribir):
+                    fallidos.add(nombre_archivo)
+
+    def estadisticas(self):
+        with self._condicion:
+            return {
+                "escrituras": self.escrituras,
+                "fusionadas": self.fusionadas,
+                "pendientes": len(self._pendientes),
+                "tiempo_total": self.tiempo_total,
+                "ultima_duracion": self.ultima_duracion,
+                "errores": self.errores,
+                "fallidas": len(self._fallos),  # Archivos cuya última escritura ha fallado
+                "ultimo_error": self.ultimo_error,
+            }
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                while not self._pendientes:
+                    self._condicion.wait()
+                nombre_archivo, (datos, escribir, momento) = min(self._pendientes.items(), key=lambda item: item[1][2])
+                espera = momento + self.retardo - time.monotonic()
+                if espera > 0:
+                    self._condicion.wait(espera)
+                    continue
+                del self._pendientes[nombre_archivo]
+                self._escribiendo[nombre_archivo] = datos
+            self._escribir(nombre_archivo, datos, escribir)
+
+    # Devuelve si se ha escrito. Si falla, los datos vuelven a quedar pendientes (salvo que entretanto
+    # se haya programado otra escritura del archivo, que ya los incluye) y se reintentan, esperando
+    # el doble tras cada fallo seguido, hasta REINTENTO_MAXIMO
+    def _escribir(self, nombre_archivo, datos, escribir):
+        inicio = time.perf_counter()
+        error = None
+        try:
+            escribir(datos)
+        except Exception as excepcion:
+            error = excepcion
+            _registro.error("No se pudo escribir %s; se reintentará", nombre_archivo, exc_info=True)
+        finally:
+            with self._condicion:
+                if self._escribiendo.get(nombre_archivo) is datos:
+                    del self._escribiendo[nombre_archivo]
+                if error is not None:
+                    fallos = self._fallos[nombre_archivo] = self._fallos.get(nombre_archivo, 0) + 1
+                    self.errores += 1
+                    self.ultimo_error = f"{nombre_archivo}: {error}"
+                    if nombre_archivo not in self._pendientes:
+                        espera = min(self.retardo * (2 ** fallos - 1), REINTENTO_MAXIMO)
+                        self._pendientes[nombre_archivo] = (datos, escribir, time.monotonic() + espera)
+                self._condicion.notify_all()
+        if error is not None:
+            return False
+        duracion = time.perf_counter() - inicio
+        with self._condicion:
+            self._fallos.pop(nombre_archivo, None)
+            self.escrituras += 1
+            self.tiempo_total += duracion
+            self.ultima_duracion = duracion
+        return True
+
+
+# Un único escritor por proceso, compartido por todas las sesiones
+escritor = EscritorDiferido()
+
+
+# Con Copy-on-Write (pandas >= 3.0) basta una copia superficial para no tocar los datos de la caché
+_COPIA_PROFUNDA = int(pd.__version__.split(".")[0]) < 3
+
+
+# Copia barata de una tabla compartida que la sesión puede modificar sin afectar a las demás
+def vista(datos):
+    return datos.copy(deep=_COPIA_PROFUNDA)
+
+
+def _firma_stat(info):
+    return (info.st_mtime_ns, info.st_size, info.st_ino)
+
+
+# Firma (ETag) de un archivo: cambia con cada escritura, ya que cada una crea un archivo nuevo
+def firma_archivo(nombre_archivo):
+    try:
+        return _firma_stat(os.stat(nombre_archivo))
+    except FileNotFoundError:
+        return None
+
+
+def _tamano(valor, firma):
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(deep=True).sum())
+    return firma[1] if firma else 0
+
+
+class CacheLectura:
+    """Caché de archivos ya leídos, compartida por todas las sesiones del proceso.
+
+    Cada entrada se guarda con la fecha de modificación, tamaño e inodo del archivo;
+    si cambian en disco se vuelve a leer. Las entradas menos usadas se descartan
+    al pasar de `max_bytes`. Lo que devuelve es compartido: no debe modificarse.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # clave -> (firma, valor, tamaño)
+        self._ocupado = 0
+        self._bloqueo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    # Con `con_firma=True` devuelve (valor, firma del archivo del que se leyó)
+    def obtener(self, nombre_archivo, leer, tipo=None, con_firma=False):
+        clave = (os.path.abspath(nombre_archivo), tipo)
+        firma = firma_archivo(nombre_archivo)
+        with self._bloqueo:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == firma:
+                self.aciertos += 1
+                self._entradas.move_to_end(clave)
+                return (entrada[1], firma) if con_firma else entrada[1]
+            self.fallos += 1
+
+        valor = leer(nombre_archivo)
+        if firma is not None:
+            _contar("bytes_leidos", firma[1])
+        if firma is None or firma != firma_archivo(nombre_archivo):
+            # El archivo no existe o cambió mientras se leía: no se guarda, y la firma es desconocida
+            return (valor, None) if con_firma else valor
+        self.poner(nombre_archivo, valor, firma, tipo)
+        return (valor, firma) if con_firma else valor
+
+    # Guarda un valor que ya se conoce (p. ej. lo que se acaba de escribir) sin volver a leer el archivo
+    def poner(self, nombre_archivo, valor, firma, tipo=None):
+        clave = (os.path.abspath(nombre_archivo), tipo)
+        tamano = _tamano(valor, firma)
+        with self._bloqueo:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._ocupado -= anterior[2]
+            self._entradas[clave] = (firma, valor, tamano)
+            self._ocupado += tamano
+            while self._ocupado > self.max_bytes and len(self._entradas) > 1:
+                _, (_, _, liberado) = self._entradas.popitem(last=False)
+                self._ocupado -= liberado
+
+    # Olvida todo lo leído (p. ej. para medir una lectura en frío)
+    def limpiar(self):
+        with self._bloqueo:
+            self._entradas.clear()
+            self._ocupado = 0
+
+    def estadisticas(self):
+        with self._bloqueo:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "entradas": len(self._entradas),
+                "bytes": self._ocupado,
+            }
+
+
+cache = CacheLectura()
@@ -0,0 +1,287 @@
+"""Consultas de gastos y eventos desde la línea de comandos, sin abrir la aplicación.
+
+    python presupuesto.py balance "Noviembre 2024" [--json]
+    python presupuesto.py gastos "Noviembre 2024" [--categoria Casa] [--json]
+    python presupuesto.py eventos 12/2024 [--json]
+    python presupuesto.py meses [--json]
+    python presupuesto.py resumen [2024] [--json]
+    python presupuesto.py buscar limpiadora [--ano 2024] [--json]
+    python presupuesto.py cambios [gastos|eventos] [--desde 2024-11-01] [--hasta 2024-11-30] [--id 12] [--json]
+
+Opciones comunes: --archivo, --eventos, --almacen (json, particionado o sqlite) y --db.
+
+Este módulo sólo importa la biblioteca estándar al cargarse; pandas y el almacén
+se importan dentro de cada función cuando hacen falta. balance, meses y resumen
+leen primero el resumen por meses guardado (<archivo>.resumen.json) y, si sigue
+al día con los datos, responden sin importar pandas ni leer los gastos.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from datetime import date
+
+from meses import ordenar_meses
+
+ARCHIVO_GASTOS = "gastos_fijos.json"
+ARCHIVO_EVENTOS = "eventos.json"
+TOTALES = ["total", "pagado", "por_pagar"]
+
+
+# Huella de los gastos en disco, calculada sin importar el almacén (ni pandas).
+# Tiene que dar lo mismo que huella() del almacén elegido en PRESUPUESTO_ALMACEN; si no coincide
+# con la del resumen guardado, sólo se pierde el atajo
+def _huella(nombre_archivo):
+    tipo = os.environ.get("PRESUPUESTO_ALMACEN", "json")
+    try:
+        if tipo == "sqlite":
+            ruta = os.environ.get("PRESUPUESTO_DB", "presupuesto.db")
+            if not os.path.exists(ruta):
+                return None
+            conexion = sqlite3.connect(ruta)
+            try:
+                return ["sqlite", conexion.execute("SELECT version FROM versiones WHERE tabla = 'gastos'").fetchone()[0]]
+            finally:
+                conexion.close()
+        if tipo == "particionado":
+            directorio = os.path.splitext(nombre_archivo)[0]
+            with open(os.path.join(directorio, "manifiesto.json"), 'r') as archivo:
+                particiones = json.load(archivo)["meses"].values()
+            return {nombre: _firma(os.path.join(directorio, nombre)) for nombre in particiones}
+        return _firma(nombre_archivo)
+    except (OSError, ValueError, KeyError, TypeError, sqlite3.Error):
+        return None
+
+
+# La misma firma que persistencia.firma_archivo, como lista (así queda en el JSON)
+def _firma(ruta):
+    info = os.stat(ruta)
+    return [info.st_mtime_ns, info.st_size, info.st_ino]
+
+
+# Filas (Mes, Categoría, total, pagado, por_pagar, gastos) del resumen por meses. Si el guardado ya
+# no corresponde a los datos se calcula con el almacén, que además lo deja guardado para la próxima vez
+def registros_resumen(nombre_archivo=ARCHIVO_GASTOS):
+    try:
+        with open(f"{os.path.splitext(nombre_archivo)[0]}.resumen.json", 'r') as archivo:
+            guardado = json.load(archivo)
+    except (OSError, ValueError):
+        guardado = None
+    if guardado is not None and guardado.get("huella") == _huella(nombre_archivo):
+        return guardado["filas"]
+
+    from almacenamiento import resumen_mensual
+    return resumen_mensual(nombre_archivo).registros()
+
+
+# Total, pagado y por pagar de un mes, en total y por categoría
+def balance(mes, nombre_archivo=ARCHIVO_GASTOS):
+    resultado = {"mes": mes, **dict.fromkeys(TOTALES, 0), "gastos": 0, "categorias": {}}
+    for registro in registros_resumen(nombre_archivo):
+        if registro["Mes"] != mes or not registro["gastos"]:
+            continue
+        resultado["categorias"][registro["Categoría"]] = {columna: registro[columna] for columna in TOTALES}
+        for columna in TOTALES + ["gastos"]:
+            resultado[columna] += registro[columna]
+    return resultado
+
+
+def meses(nombre_archivo=ARCHIVO_GASTOS):
+    return ordenar_meses({registro["Mes"] for registro in registros_resumen(nombre_archivo) if registro["gastos"]})
+
+
+# Totales de cada mes (de un año, si se indica), en orden
+def resumen(ano=None, nombre_archivo=ARCHIVO_GASTOS):
+    por_mes = {}
+    for registro in registros_resumen(nombre_archivo):
+        if not registro["gastos"] or (ano is not None and not str(registro["Mes"]).endswith(f" {ano}")):
+            continue
+        totales = por_mes.setdefault(registro["Mes"], {"mes": registro["Mes"], **dict.fromkeys(TOTALES, 0), "gastos": 0})
+        for columna in TOTALES + ["gastos"]:
+            totales[columna] += registro[columna]
+    return [por_mes[mes] for mes in ordenar_meses(por_mes)]
+
+
+def gastos_del_mes(mes, categoria=None, nombre_archivo=ARCHIVO_GASTOS):
+    from almacenamiento import cargar_datos
+    datos = cargar_datos(nombre_archivo, mes=mes)
+    if categoria is not None:
+        datos = datos[datos["Categoría"] == categoria]
+    return datos
+
+
+# Un evento por día del mes en que ocurre, ordenados por fecha. Sólo se leen los eventos que tocan
+# el mes (y los recurrentes), sin construir el calendario completo que usa la aplicación
+def eventos_del_mes(ano, mes, nombre_archivo=ARCHIVO_EVENTOS):
+    from almacenamiento import cargar_eventos
+    from eventos import CalendarioEventos
+    siguiente = f"{ano + mes // 12}-{mes % 12 + 1:02d}-01"
+    eventos = cargar_eventos(nombre_archivo, desde=f"{ano}-{mes:02d}-01", hasta=siguiente)
+    return CalendarioEventos(eventos).del_mes(ano, mes)
+
+
+# Gastos y eventos cuyo concepto contiene las palabras buscadas (ver busqueda.IndiceConceptos): los
+# totales de los gastos por mes (de un año, si se indica) y cada evento con el próximo día en que toca
+def buscar(texto, ano=None, nombre_archivo=ARCHIVO_GASTOS, archivo_eventos=ARCHIVO_EVENTOS):
+    from almacenamiento import indice_conceptos
+    from eventos import proximas_fechas
+    from gastos import totales_por_mes
+    totales = totales_por_mes(indice_conceptos("gastos", nombre_archivo).buscar(texto))
+    if ano is not None:
+        totales = totales[totales["Periodo"].str.startswith(f"{ano}-")]
+    eventos = indice_conceptos("eventos", archivo_eventos).buscar(texto)
+    eventos.insert(0, "Próxima", proximas_fechas(eventos, date.today()))
+    return totales.drop(columns="Periodo"), eventos.sort_values(["Próxima", "Fecha"], na_position="last")
+
+
+# Historial de cambios de gastos o eventos (ver almacenamiento.historial_cambios). `desde` y `hasta`
+# son fechas "AAAA-MM-DD" o momentos ISO; una fecha como `hasta` incluye el día entero
+def cambios(tabla="gastos", desde=None, hasta=None, id=None, nombre_archivo=ARCHIVO_GASTOS):
+    from almacenamiento import historial_cambios
+    if hasta is not None and len(hasta) == 10:
+        hasta += "T23:59:59.999"
+    return historial_cambios(tabla, nombre_archivo, desde, hasta, id)
+
+
+def _euros(valor):
+    return f"{valor:,.2f} €".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def _registros(tabla):
+    return json.loads(tabla.reset_index().to_json(orient="records", date_format="iso", force_ascii=False))
+
+
+def _mostrar_balance(argumentos):
+    datos = balance(argumentos.mes, argumentos.archivo)
+    if argumentos.json:
+        return datos
+    lineas = [f"Balance de {datos['mes']} ({datos['gastos']} gastos)"]
+    lineas += [f"  {categoria:<24} {_euros(totales['total']):>14}  pagado {_euros(totales['pagado']):>14}"
+               for categoria, totales in datos["categorias"].items()]
+    lineas += [f"Total: {_euros(datos['total'])} - Pagado: {_euros(datos['pagado'])} - "
+               f"Por pagar: {_euros(datos['por_pagar'])}"]
+    return "\n".join(lineas)
+
+
+def _mostrar_gastos(argumentos):
+    datos = gastos_del_mes(argumentos.mes, argumentos.categoria, argumentos.archivo)
+    if argumentos.json:
+        return _registros(datos)
+    return "\n".join(f"{fila.Fecha}  {fila.Categoría:<22} {fila.Concepto:<30} {_euros(fila.Cantidad):>12}  "
+                     f"{'pagado' if fila.Pagado else 'por pagar'}" for fila in datos.itertuples()) or "No hay gastos."
+
+
+def _mostrar_eventos(argumentos):
+    try:
+        mes, ano = map(int, argumentos.mes.split("/"))
+    except ValueError:
+        raise ValueError(f"Mes no válido: '{argumentos.mes}' (tiene que ser MM/AAAA, p. ej. 12/2024)")
+    if not 1 <= mes <= 12:
+        raise ValueError(f"Mes no válido: '{argumentos.mes}'")
+    from eventos import formatear_hora
+    datos = eventos_del_mes(ano, mes, argumentos.eventos)
+    if argumentos.json:
+        return _registros(datos.assign(Fecha=datos["Fecha"].dt.strftime("%Y-%m-%d"),
+                                       Fecha_fin=datos["Fecha_fin"].dt.strftime("%Y-%m-%d"),
+                                       Hora=datos["Hora"].map(formatear_hora)).set_index("id"))
+    return "\n".join(f"{fila.Fecha:%Y-%m-%d}  {formatear_hora(fila.Hora):<11} {fila.Quien:<10} {fila.Concepto}"
+                     for fila in datos.itertuples()) or "No hay eventos para este mes."
+
+
+def _mostrar_busqueda(argumentos):
+    totales, eventos = buscar(argumentos.texto, argumentos.ano, argumentos.archivo, argumentos.eventos)
+    resultado = dict(zip(TOTALES + ["gastos"], totales[TOTALES + ["gastos"]].sum().tolist()))
+    proximas = eventos["Próxima"].dt.strftime("%Y-%m-%d")
+    if argumentos.json:
+        return {"texto": argumentos.texto, **resultado, "meses": _registros(totales.set_index("Mes")),
+                "eventos": _registros(eventos.assign(Próxima=proximas))}
+    lineas = [f"Gastos con '{argumentos.texto}': {resultado['gastos']} - Total: {_euros(resultado['total'])} - "
+              f"Pagado: {_euros(resultado['pagado'])} - Por pagar: {_euros(resultado['por_pagar'])}"]
+    lineas += [f"  {fila.Mes:<16} {_euros(fila.total):>14}  ({fila.gastos} gastos)" for fila in totales.itertuples()]
+    lineas += [f"Eventos con '{argumentos.texto}': {len(eventos)}"]
+    lineas += [f"  {proxima if isinstance(proxima, str) else 'ya pasó':<10}  {fila.Quien:<10} {fila.Concepto}"
+               for fila, proxima in zip(eventos.itertuples(), proximas)]
+    return "\n".join(lineas)
+
+
+def _mostrar_cambios(argumentos):
+    archivo = argumentos.archivo if argumentos.tabla == "gastos" else argumentos.eventos
+    datos = cambios(argumentos.tabla, argumentos.desde, argumentos.hasta, argumentos.id, archivo)
+    if argumentos.json:
+        return _registros(datos.set_index("momento"))
+    return "\n".join(f"{fila.momento[:19].replace('T', ' ')}  {fila.tipo:<10} {fila.id:>6}  "
+                     f"{fila.antes or ''} -> {fila.despues or ''}" + ("  (deshacer)" if isinstance(fila.deshace, str) else "")
+                     for fila in datos.itertuples()) or "No hay cambios."
+
+
+def _mostrar_meses(argumentos):
+    lista = meses(argumentos.archivo)
+    return lista if argumentos.json else "\n".join(lista)
+
+
+def _mostrar_resumen(argumentos):
+    datos = resumen(argumentos.ano, argumentos.archivo)
+    if argumentos.json:
+        return datos
+    return "\n".join(f"{totales['mes']:<16} {_euros(totales['total']):>14}  pagado {_euros(totales['pagado']):>14}  "
+                     f"por pagar {_euros(totales['por_pagar']):>12}" for totales in datos) or "No hay gastos."
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="presupuesto", description=__doc__.splitlines()[0])
+    parser.add_argument("--archivo", default=ARCHIVO_GASTOS, help="archivo de gastos")
+    parser.add_argument("--eventos", default=ARCHIVO_EVENTOS, help="archivo de eventos")
+    parser.add_argument("--almacen", choices=["json", "particionado", "sqlite"],
+                        help="tipo de almacén (por defecto, PRESUPUESTO_ALMACEN o json)")
+    parser.add_argument("--db", help="base SQLite (por defecto, PRESUPUESTO_DB o presupuesto.db)")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    comando = comandos.add_parser("balance", help="totales de un mes")
+    comando.add_argument("mes", help='p. ej. "Noviembre 2024"')
+    comando.set_defaults(mostrar=_mostrar_balance)
+    comando = comandos.add_parser("gastos", help="gastos de un mes")
+    comando.add_argument("mes")
+    comando.add_argument("--categoria")
+    comando.set_defaults(mostrar=_mostrar_gastos)
+    comando = comandos.add_parser("eventos", help="eventos de un mes, día a día")
+    comando.add_argument("mes", help="MM/AAAA, p. ej. 12/2024")
+    comando.set_defaults(mostrar=_mostrar_eventos)
+    comando = comandos.add_parser("meses", help="meses con gastos")
+    comando.set_defaults(mostrar=_mostrar_meses)
+    comando = comandos.add_parser("resumen", help="totales de cada mes")
+    comando.add_argument("ano", nargs="?", type=int, help="sólo los meses de este año")
+    comando.set_defaults(mostrar=_mostrar_resumen)
+    comando = comandos.add_parser("buscar", help="gastos y eventos por concepto, en todos los meses")
+    comando.add_argument("texto", help="palabras o principios de palabra, sin importar acentos ni mayúsculas")
+    comando.add_argument("--ano", type=int, help="sólo los gastos de este año")
+    comando.set_defaults(mostrar=_mostrar_busqueda)
+    comando = comandos.add_parser("cambios", help="historial de cambios, del más antiguo al más reciente")
+    comando.add_argument("tabla", nargs="?", default="gastos", choices=["gastos", "eventos"])
+    comando.add_argument("--desde", help="AAAA-MM-DD")
+    comando.add_argument("--hasta", help="AAAA-MM-DD (incluido)")
+    comando.add_argument("--id", type=int, help="sólo los cambios de este registro")
+    comando.set_defaults(mostrar=_mostrar_cambios)
+    for comando in comandos.choices.values():
+        comando.add_argument("--json", action="store_true", help="salida en JSON")
+
+    argumentos = parser.parse_args(argv)
+    if argumentos.almacen:
+        os.environ["PRESUPUESTO_ALMACEN"] = argumentos.almacen
+    if argumentos.db:
+        os.environ["PRESUPUESTO_DB"] = argumentos.db
+    try:
+        salida = argumentos.mostrar(argumentos)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    try:
+        print(json.dumps(salida, ensure_ascii=False, indent=2, default=str) if argumentos.json else salida)
+    except BrokenPipeError:
+        # La salida va a un programa que ya terminó (p. ej. `| head`)
+        sys.stdout = None
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
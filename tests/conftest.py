@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import almacenamiento  # noqa: E402
+from persistencia import escritor  # noqa: E402
+
+ALMACENES = ["json", "particionado", "sqlite"]
+
+
+# Cada prueba trabaja en su propio directorio y con un almacén nuevo (el de PRESUPUESTO_ALMACEN, o
+# "json"). Los archivos se nombran con su ruta completa: las cachés del proceso los distinguen por nombre
+@pytest.fixture
+def directorio(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PRESUPUESTO_DB", str(tmp_path / "presupuesto.db"))
+    monkeypatch.setattr(almacenamiento, "_almacen", None)
+    yield tmp_path
+    escritor.vaciar()
+
+
+# Lo mismo con cada uno de los almacenes
+@pytest.fixture(params=ALMACENES)
+def almacen(request, directorio, monkeypatch):
+    monkeypatch.setenv("PRESUPUESTO_ALMACEN", request.param)
+    return request.param
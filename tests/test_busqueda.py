@@ -0,0 +1,67 @@
+import pandas as pd
+
+from almacenamiento import (actualizar_gasto, cargar_datos, eliminar_gasto, guardar_datos, indice_conceptos,
+                            insertar_gasto)
+from busqueda import IndiceConceptos, palabras
+from persistencia import escritor
+
+DATOS = pd.DataFrame({"Concepto": ["Luz / Agua", "Limpiadora", "Revisión Coche", None, "Cine"],
+                      "Cantidad": [40.0, 36.0, 120.0, 5.0, 12.0]},
+                     index=pd.Index([1, 2, 3, 4, 7], name="id"))
+
+
+def _ids(resultado):
+    return resultado.index.tolist()
+
+
+def test_palabras():
+    assert palabras("Revisión Coche / ÑU") == ["revision", "coche", "nu"]
+    assert palabras(None) == []
+
+
+# Cada palabra buscada es un prefijo de alguna del concepto, sin acentos ni mayúsculas
+def test_buscar():
+    indice = IndiceConceptos(DATOS)
+    assert _ids(indice.buscar("l")) == [1, 2]
+    assert _ids(indice.buscar("LIMP")) == [2]
+    assert _ids(indice.buscar("revision co")) == [3]
+    assert _ids(indice.buscar("revisión luz")) == []
+    assert _ids(indice.buscar("")) == []
+    assert indice.buscar("cine").to_dict("records") == [{"Concepto": "Cine", "Cantidad": 12.0}]
+
+
+# Añadir, editar y borrar filas deja el índice igual que construirlo de nuevo
+def test_indice_incremental():
+    indice = IndiceConceptos(DATOS)
+    indice.anadir(pd.DataFrame({"Concepto": ["Luz del garaje"], "Cantidad": [8.0]}, index=pd.Index([9], name="id")))
+    indice.actualizar(2, {"Concepto": "Seguro coche"})
+    indice.actualizar(1, {"Cantidad": 41.0})
+    indice.eliminar([3])
+    assert _ids(indice.buscar("luz")) == [1, 9]
+    assert _ids(indice.buscar("limp")) == []
+    assert _ids(indice.buscar("coche")) == [2]
+    assert indice.buscar("agua").at[1, "Cantidad"] == 41.0
+    assert indice._palabras == sorted(indice._ids)
+
+
+# El índice compartido recibe los cambios hechos con el almacén, y se vuelve a construir si la tabla
+# se guarda entera
+def test_indice_conceptos(almacen, directorio):
+    gastos = str(directorio / "gastos_fijos.json")
+    gasto = {"Mes": "Octubre 2024", "Categoría": "Casa", "Pagado": False, "Fecha": "2024-10-01"}
+    luz = insertar_gasto(gastos, {**gasto, "Concepto": "Luz", "Cantidad": 40.0})
+    agua = insertar_gasto(gastos, {**gasto, "Concepto": "Agua", "Cantidad": 20.0})
+    indice = indice_conceptos("gastos", gastos)
+    assert _ids(indice.buscar("luz")) == [luz]
+
+    actualizar_gasto(gastos, agua, {"Concepto": "Luz del garaje"}, mes="Octubre 2024")
+    eliminar_gasto(gastos, luz, mes="Octubre 2024")
+    assert indice_conceptos("gastos", gastos) is indice
+    assert _ids(indice.buscar("luz")) == [agua]
+
+    datos = cargar_datos(gastos)
+    datos.loc[agua, "Concepto"] = "Gas"
+    guardar_datos(gastos, datos)
+    escritor.vaciar()
+    assert _ids(indice_conceptos("gastos", gastos).buscar("luz")) == []
+    assert _ids(indice_conceptos("gastos", gastos).buscar("gas")) == [agua]
@@ -0,0 +1,144 @@
+import multiprocessing
+
+import pandas as pd
+import pytest
+
+import almacenamiento
+from almacenamiento import (ConflictoEdicion, actualizar_gasto, cargar_datos, eliminar_gasto, insertar_gasto,
+                            tomar_conflictos)
+from persistencia import escritor
+
+MESES = ["Octubre 2024", "Noviembre 2024"]
+PROCESOS = 4
+GASTOS = 10
+
+# Cada proceso empieza de cero, con su propio almacén, caché y escritor
+_contexto = multiprocessing.get_context("spawn")
+
+
+def _gasto(concepto, mes=MESES[0]):
+    return {"Mes": mes, "Concepto": concepto, "Cantidad": 0.0, "Pagado": False, "Categoría": "Casa",
+            "Fecha": "2024-10-01"}
+
+
+def _ejecutar(procesos):
+    for proceso in procesos:
+        proceso.start()
+    for proceso in procesos:
+        proceso.join(timeout=60)
+    assert [proceso.exitcode for proceso in procesos] == [0] * len(procesos)
+
+
+# Inserta sus propios gastos y después los edita y marca como pagados
+def _escritor(gastos, numero):
+    ids = [insertar_gasto(gastos, _gasto(f"p{numero}-{posicion}", MESES[posicion % len(MESES)]))
+           for posicion in range(GASTOS)]
+    for posicion, id in enumerate(ids):
+        actualizar_gasto(gastos, id, {"Cantidad": float(posicion)}, mes=MESES[posicion % len(MESES)])
+        actualizar_gasto(gastos, id, {"Pagado": True}, mes=MESES[posicion % len(MESES)])
+    escritor.vaciar()
+
+
+# Edita el gasto `id` tal como lo ha leído, cuando `listo` lo permite. Por `resultados` devuelve
+# (numero, si se le avisó del conflicto): al editar o después, al escribir
+def _editor(gastos, id, numero, leido, listo, resultados):
+    cantidad = cargar_datos(gastos).at[id, "Cantidad"]
+    leido.wait()
+    listo.wait()
+    try:
+        actualizar_gasto(gastos, id, {"Cantidad": float(numero)}, mes=MESES[0], antes={"Cantidad": cantidad})
+    except ConflictoEdicion:
+        resultados.put((numero, True))
+        return
+    escritor.vaciar()
+    resultados.put((numero, bool(tomar_conflictos())))
+
+
+# Borra el gasto `id` cuando el otro proceso ya lo ha leído, y avisa con `listo`
+def _borrador(gastos, id, leido, listo):
+    leido.wait()
+    eliminar_gasto(gastos, id, mes=MESES[0])
+    escritor.vaciar()
+    listo.set()
+
+
+# Procesos que escriben a la vez filas distintas: no se pierde ni se duplica ningún cambio
+def test_escrituras_concurrentes(almacen, directorio):
+    gastos = str(directorio / "gastos_fijos.json")
+    _ejecutar([_contexto.Process(target=_escritor, args=(gastos, numero)) for numero in range(PROCESOS)])
+
+    datos = cargar_datos(gastos)
+    assert datos.index.is_unique
+    assert len(datos) == PROCESOS * GASTOS
+    for numero in range(PROCESOS):
+        for posicion in range(GASTOS):
+            fila = datos[datos["Concepto"] == f"p{numero}-{posicion}"].iloc[0]
+            assert fila["Cantidad"] == posicion and fila["Pagado"]
+    assert tomar_conflictos() == []
+
+
+# Dos procesos editan a la vez el mismo gasto que han leído: uno gana y al otro se le avisa
+def test_misma_fila(almacen, directorio):
+    gastos = str(directorio / "gastos_fijos.json")
+    id = insertar_gasto(gastos, _gasto("Luz"))
+    escritor.vaciar()
+
+    leido = _contexto.Barrier(2)
+    listo = _contexto.Barrier(2)
+    resultados = _contexto.Queue()
+    _ejecutar([_contexto.Process(target=_editor, args=(gastos, id, numero, leido, listo, resultados))
+               for numero in (1, 2)])
+
+    avisados = dict(resultados.get(timeout=5) for _ in range(2))
+    assert sorted(avisados.values()) == [False, True]
+    ganador = next(numero for numero, avisado in avisados.items() if not avisado)
+    assert cargar_datos(gastos).at[id, "Cantidad"] == ganador
+
+
+# Un proceso edita un gasto que otro ha borrado después de que lo leyera: se le avisa y sigue borrado
+def test_fila_borrada(almacen, directorio):
+    gastos = str(directorio / "gastos_fijos.json")
+    id = insertar_gasto(gastos, _gasto("Luz"))
+    escritor.vaciar()
+
+    leido = _contexto.Barrier(2)
+    listo = _contexto.Event()
+    resultados = _contexto.Queue()
+    _ejecutar([_contexto.Process(target=_borrador, args=(gastos, id, leido, listo)),
+               _contexto.Process(target=_editor, args=(gastos, id, 1, leido, listo, resultados))])
+
+    assert resultados.get(timeout=5) == (1, True)
+    assert id not in cargar_datos(gastos).index
+
+
+# Al escribir sobre lo que ha cambiado otro proceso se repiten las operaciones propias: se descartan
+# las que chocan con sus cambios, y las que él ya hizo igual o que no tocan lo suyo se aplican
+def test_fusion_de_operaciones():
+    datos = pd.DataFrame({"Concepto": ["Luz", "Agua", "Gas", "Móvil"], "Cantidad": [40.0, 20.0, 30.0, 15.0]},
+                         index=pd.Index([1, 2, 3, 4], name="id"))
+    operaciones = [
+        ("actualizar", 1, {"Cantidad": 40.0}, {"Cantidad": 45.0}),  # Nadie más la ha tocado
+        ("actualizar", 2, {"Cantidad": 10.0}, {"Cantidad": 20.0}),  # El otro hizo el mismo cambio
+        ("actualizar", 3, {"Cantidad": 25.0}, {"Cantidad": 35.0}),  # El otro la cambió a otro valor
+        ("actualizar", 5, {"Cantidad": 5.0}, {"Cantidad": 6.0}),  # El otro la borró
+        ("eliminar", 4, {"Concepto": "Móvil", "Cantidad": 12.0}, None),  # El otro la cambió
+        ("eliminar", 6, {"Concepto": "Tasa", "Cantidad": 9.0}, None),  # El otro también la borró
+        ("insertar", 7, None, {"Concepto": "Seguro", "Cantidad": 60.0}),
+    ]
+    fusionados, descartadas = almacenamiento._aplicar_operaciones(datos, operaciones)
+    assert descartadas == [operaciones[2], operaciones[3], operaciones[4]]
+    assert fusionados["Cantidad"].to_dict() == {1: 45.0, 2: 20.0, 3: 30.0, 4: 15.0, 7: 60.0}
+
+
+# Una edición con los valores que se vieron falla si el gasto ha cambiado o se ha borrado desde entonces
+def test_conflicto_al_editar(almacen, directorio):
+    gastos = str(directorio / "gastos_fijos.json")
+    id = insertar_gasto(gastos, _gasto("Luz"))
+    actualizar_gasto(gastos, id, {"Cantidad": 40.0}, mes=MESES[0], antes={"Cantidad": 0.0})
+    with pytest.raises(ConflictoEdicion):
+        actualizar_gasto(gastos, id, {"Cantidad": 50.0}, mes=MESES[0], antes={"Cantidad": 0.0})
+    eliminar_gasto(gastos, id, mes=MESES[0])
+    with pytest.raises(ConflictoEdicion):
+        actualizar_gasto(gastos, id, {"Cantidad": 50.0}, mes=MESES[0], antes={"Cantidad": 40.0})
+    escritor.vaciar()
+    assert cargar_datos(gastos).empty
@@ -0,0 +1,81 @@
+import pandas as pd
+
+from eventos import CalendarioEventos, compactar_eventos, eventos_en_rango, expandir_mes
+
+
+def _eventos(filas):
+    datos = pd.DataFrame(filas, columns=["Fecha", "Fecha_fin", "Hora", "Quien", "Concepto", "Todo_el_dia",
+                                         "Recurrencia"])
+    return datos.set_index(pd.Index(range(1, len(datos) + 1), name="id"))
+
+
+# Día a día: [(fecha, concepto)] del mes expandido
+def _dias(expandidos):
+    return [(fecha.strftime("%Y-%m-%d"), concepto) for fecha, concepto in zip(expandidos["Fecha"], expandidos["Concepto"])]
+
+
+EVENTOS = _eventos([
+    ["2024-10-28", "2024-11-02", "Todo el día", "Juntos", "Vacaciones", True, None],
+    ["2024-11-05", "2024-11-05", "18:00", "Andreea", "Dentista", False, None],
+    ["2024-09-30", "2024-09-30", "20:00", "Juntos", "Cena", False, "semanal"],
+    ["2024-01-31", "2024-01-31", "Todo el día", "Quintero", "Recibo", True, "mensual"],
+    ["2023-11-30", "2023-12-01", "Todo el día", "Juntos", "Aniversario", True, "anual"],
+])
+
+
+# Las filas antiguas de un mismo evento en días seguidos pasan a ser un solo rango
+def test_compactar_eventos():
+    antiguos = _eventos([
+        ["2024-10-01", None, "Todo el día", "Juntos", "Viaje", True, None],
+        ["2024-10-02", None, "Todo el día", "Juntos", "Viaje", True, None],
+        ["2024-10-03", None, "Todo el día", "Juntos", "Viaje", True, None],
+        ["2024-10-05", None, "Todo el día", "Juntos", "Viaje", True, None],
+        ["2024-10-02", None, "10:00", "Andreea", "Viaje", False, None],
+        ["2024-10-01", None, "Todo el día", "Juntos", "Cena", True, "semanal"],
+    ])
+    compactados = compactar_eventos(antiguos)
+    assert compactados[["Fecha", "Fecha_fin", "Concepto"]].values.tolist() == [
+        ["2024-10-01", "2024-10-03", "Viaje"],
+        ["2024-10-05", "2024-10-05", "Viaje"],
+        ["2024-10-02", "2024-10-02", "Viaje"],
+        ["2024-10-01", "2024-10-01", "Cena"],
+    ]
+
+
+# Los rangos que tocan algún día del periodo, más todos los recurrentes que ya han empezado
+def test_eventos_en_rango():
+    assert eventos_en_rango(EVENTOS, "2024-11-01", "2024-11-05").index.tolist() == [1, 3, 4, 5]
+    assert eventos_en_rango(EVENTOS, "2024-11-03", "2024-11-05").index.tolist() == [3, 4, 5]
+    assert eventos_en_rango(EVENTOS, "2023-12-01", "2024-01-01").index.tolist() == [5]
+
+
+# Un rango se recorta al mes y los recurrentes se repiten en él, también los que empiezan el mes anterior
+def test_expandir_mes():
+    assert _dias(expandir_mes(EVENTOS, 2024, 11)) == [
+        ("2024-11-01", "Vacaciones"), ("2024-11-02", "Vacaciones"),
+        ("2024-11-04", "Cena"), ("2024-11-05", "Dentista"), ("2024-11-11", "Cena"), ("2024-11-18", "Cena"),
+        ("2024-11-25", "Cena"), ("2024-11-30", "Recibo"), ("2024-11-30", "Aniversario"),
+    ]
+    # El aniversario del año anterior llega hasta el 1 de diciembre; el recibo del 31 cae el 31
+    assert _dias(expandir_mes(EVENTOS, 2024, 12)) == [
+        ("2024-12-01", "Aniversario"), ("2024-12-02", "Cena"), ("2024-12-09", "Cena"), ("2024-12-16", "Cena"),
+        ("2024-12-23", "Cena"), ("2024-12-30", "Cena"), ("2024-12-31", "Recibo"),
+    ]
+    assert _dias(expandir_mes(EVENTOS, 2024, 8)) == [("2024-08-31", "Recibo")]
+
+
+# El calendario da cada mes los mismos días que expandir todos los eventos, también después de añadir y
+# borrar (el orden dentro de un día puede cambiar: el calendario ordena por la hora ya convertida)
+def test_calendario_eventos():
+    calendario = CalendarioEventos(EVENTOS)
+    nuevos = _eventos([
+        ["2024-10-15", "2024-12-10", "Todo el día", "Quintero", "Obras", True, None],
+        ["2024-11-20", "2024-11-20", "09:00", "Juntos", "Médico", False, None],
+    ]).set_index(pd.Index([8, 9], name="id"))
+    calendario.del_mes(2024, 11)  # Deja calculadas las posiciones del mes, que añadir tiene que olvidar
+    calendario.anadir(nuevos)
+    calendario.eliminar([2])
+    todos = pd.concat([EVENTOS, nuevos]).drop(index=[2])
+    assert len(calendario) == len(todos)
+    for ano, mes in [(2024, 9), (2024, 10), (2024, 11), (2024, 12), (2025, 1)]:
+        assert sorted(_dias(calendario.del_mes(ano, mes))) == sorted(_dias(expandir_mes(todos, ano, mes)))
@@ -0,0 +1,77 @@
+import pandas as pd
+
+import almacenamiento
+from almacenamiento import actualizar_gasto, eliminar_gasto, insertar_gasto, obtener_almacen, resumen_mensual
+from gastos import ResumenMensual
+from persistencia import cache, escritor
+
+GASTOS = pd.DataFrame({
+    "Mes": ["Octubre 2024", "Octubre 2024", "Octubre 2024", "Noviembre 2024"],
+    "Categoría": ["Casa", "Casa", "Ocio", "Casa"],
+    "Concepto": ["Luz", "Agua", "Cine", "Luz"],
+    "Cantidad": [40.0, 20.5, 12.0, 42.0],
+    "Pagado": [True, False, True, False],
+    "Fecha": ["2024-10-01", "2024-10-02", "2024-10-10", "2024-11-01"],
+})
+
+
+# Una fila por (Mes, Categoría), ordenadas por mes
+def test_resumen_desde_gastos():
+    tabla = ResumenMensual.desde_gastos(GASTOS).tabla()
+    assert tabla[["Periodo", "Categoría", "total", "pagado", "por_pagar", "gastos"]].values.tolist() == [
+        ["2024-10", "Casa", 60.5, 40.0, 20.5, 2],
+        ["2024-10", "Ocio", 12.0, 12.0, 0.0, 1],
+        ["2024-11", "Casa", 42.0, 0.0, 42.0, 1],
+    ]
+
+
+# Ajustado gasto a gasto queda igual que calculado de nuevo con los gastos resultantes
+def test_resumen_incremental():
+    resumen = ResumenMensual.desde_gastos(GASTOS)
+    nuevo = {"Mes": "Noviembre 2024", "Categoría": "Ocio", "Concepto": "Teatro", "Cantidad": 30.0,
+             "Pagado": False, "Fecha": "2024-11-15"}
+    resumen.anadir(nuevo)
+    resumen.actualizar(GASTOS.loc[1], {"Pagado": True, "Cantidad": 21.0})
+    resumen.eliminar(GASTOS.loc[2])
+
+    gastos = pd.concat([GASTOS, pd.DataFrame([nuevo])], ignore_index=True).drop(index=2)
+    gastos.loc[1, ["Pagado", "Cantidad"]] = [True, 21.0]
+    assert resumen.tabla().equals(ResumenMensual.desde_gastos(gastos).tabla())
+    assert resumen.meses() == ["Octubre 2024", "Noviembre 2024"]
+
+
+# Tras reiniciar el proceso, sin que el almacén ni la caché conserven nada
+def _reiniciar(monkeypatch):
+    escritor.vaciar()
+    cache.limpiar()
+    monkeypatch.setattr(almacenamiento, "_almacen", None)
+    monkeypatch.setattr(almacenamiento, "_resumenes", {})
+
+
+# El resumen se guarda con la huella de los datos: al arrancar se lee sin recorrer los gastos mientras
+# la huella coincida, y se vuelve a calcular si los datos han cambiado por otro lado
+def test_resumen_guardado(almacen, directorio, monkeypatch):
+    gastos = str(directorio / "gastos_fijos.json")
+    ids = [insertar_gasto(gastos, fila) for fila in GASTOS.to_dict("records")]
+    resumen_mensual(gastos)  # Desde aquí, los cambios lo ajustan
+    actualizar_gasto(gastos, ids[1], {"Pagado": True}, mes="Octubre 2024")
+    eliminar_gasto(gastos, ids[3], mes="Noviembre 2024")
+    esperado = resumen_mensual(gastos).tabla()
+    assert esperado["gastos"].sum() == 3
+
+    _reiniciar(monkeypatch)
+    tipo = type(obtener_almacen())
+
+    def cargar(*argumentos, **opciones):
+        raise AssertionError("el resumen guardado no debería leer los gastos")
+    with monkeypatch.context() as parche:
+        parche.setattr(tipo, "cargar", cargar)
+        assert resumen_mensual(gastos).tabla().equals(esperado)
+
+    # Un gasto añadido sin el resumen en memoria no lo ajusta: el guardado deja de coincidir
+    _reiniciar(monkeypatch)
+    insertar_gasto(gastos, {**GASTOS.loc[0].to_dict(), "Cantidad": 10.0})
+    _reiniciar(monkeypatch)
+    tabla = resumen_mensual(gastos).tabla()
+    assert tabla.loc[tabla["Periodo"] == "2024-10", "total"].sum() == esperado.loc[
+        esperado["Periodo"] == "2024-10", "total"].sum() + 10.0
@@ -0,0 +1,64 @@
+import json
+import os
+import time
+
+import almacenamiento
+import historial
+from almacenamiento import (actualizar_gasto, cargar_categorias, cargar_datos, datos_a_fecha, deshacer_ultimo_cambio,
+                            guardar_categorias, insertar_gasto, renombrar_categoria)
+from persistencia import escritor
+
+
+# Al deshacer un cambio de nombre de categoría, la lista de categorías también vuelve atrás
+def test_deshacer_renombrar_categoria(almacen, directorio):
+    categorias, gastos = str(directorio / "categorias.json"), str(directorio / "gastos_fijos.json")
+    guardar_categorias(categorias, ["Casa", "Ocio"])
+    insertar_gasto(gastos, {"Mes": "Octubre 2024", "Categoría": "Casa", "Concepto": "Luz", "Cantidad": 40.0,
+                            "Pagado": False, "Fecha": "2024-10-01"})
+    renombrar_categoria(categorias, gastos, "Casa", "Hogar")
+    escritor.vaciar()
+    assert cargar_categorias(categorias) == ["Hogar", "Ocio"]
+
+    assert deshacer_ultimo_cambio("gastos", gastos) is not None
+    assert cargar_categorias(categorias) == ["Casa", "Ocio"]
+    assert cargar_datos(gastos)["Categoría"].tolist() == ["Casa"]
+    with open(categorias, 'r') as archivo:
+        assert json.load(archivo) == ["Casa", "Ocio"]
+
+    # Lo siguiente que se deshace es el alta del gasto, que no toca la lista
+    deshacer_ultimo_cambio("gastos", gastos)
+    assert cargar_categorias(categorias) == ["Casa", "Ocio"]
+    assert cargar_datos(gastos).empty
+
+
+# Las instantáneas se espacian según el tamaño de la tabla y sólo se guardan las últimas; lo que
+# queda del historial sigue reconstruyendo la tabla y deshaciendo
+def test_instantaneas_acotadas(almacen, directorio, monkeypatch):
+    monkeypatch.setattr(historial, "TAMANO_TRAMO", 0)
+    monkeypatch.setattr(historial, "INSTANTANEAS_GUARDADAS", 3)
+    monkeypatch.setattr(almacenamiento, "OPERACIONES_POR_INSTANTANEA", 0)
+    monkeypatch.setattr(almacenamiento, "INSTANTANEAS_GUARDADAS", 3)
+    gastos = str(directorio / "gastos_fijos.json")
+    for numero in range(5):
+        insertar_gasto(gastos, {"Mes": "Octubre 2024", "Categoría": "Casa", "Concepto": f"Gasto {numero}",
+                                "Cantidad": 1.0, "Pagado": False, "Fecha": "2024-10-01"})
+    escritor.vaciar()
+    for cantidad in range(2, 40):
+        actualizar_gasto(gastos, 1, {"Cantidad": float(cantidad)})
+        escritor.vaciar()
+    time.sleep(0.01)
+    momento = historial.momento_actual()
+    time.sleep(0.01)
+
+    if os.environ["PRESUPUESTO_ALMACEN"] == "sqlite":
+        with almacenamiento.obtener_almacen()._conexion() as conexion:
+            instantaneas = conexion.execute("SELECT COUNT(*) FROM instantaneas WHERE tabla = 'gastos'").fetchone()[0]
+    else:
+        instantaneas = len(list(directorio.rglob("instantanea-*.json")))
+    assert 1 < instantaneas <= 3
+
+    actualizar_gasto(gastos, 1, {"Cantidad": 100.0})
+    escritor.vaciar()
+    assert datos_a_fecha("gastos", gastos, momento).loc[1, "Cantidad"] == 39.0
+    deshacer_ultimo_cambio("gastos", gastos)
+    assert cargar_datos(gastos).loc[1, "Cantidad"] == 39.0
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from almacenamiento import cargar_datos
+from importacion import ExtractoNoValido, cargar_reglas, importar
+
+
+# Con la ruta completa (ver conftest.directorio)
+def _gastos(directorio):
+    return str(directorio / "gastos_fijos.json")
+
+
+def _extracto(directorio, lineas):
+    ruta = directorio / "extracto.csv"
+    ruta.write_text("\n".join(lineas) + "\n", encoding="utf-8")
+    return str(ruta)
+
+
+# Sólo ingresos: todos se descartan y no se escribe nada
+def test_extracto_solo_ingresos(directorio):
+    extracto = _extracto(directorio, ["Fecha;Concepto;Importe", "01/10/2024;Nomina;1.500,00"])
+    resultado = importar(extracto, _gastos(directorio))
+    assert resultado == {"leidos": 1, "importados": 0, "repetidos": 0, "descartados": 1}
+    assert not os.path.exists(_gastos(directorio))
+
+
+# Un trozo que se queda vacío después de filtrar no impide importar los demás
+def test_trozo_vacio_tras_filtrar(directorio):
+    reglas = {**cargar_reglas(), "filas_por_trozo": 2}
+    extracto = _extracto(directorio, ["Fecha;Concepto;Importe", "01/10/2024;Nomina;1.500,00",
+                                      "02/10/2024;Devolución;12,00", "03/10/2024;Luz;-40,10"])
+    resultado = importar(extracto, _gastos(directorio), reglas)
+    assert resultado == {"leidos": 3, "importados": 1, "repetidos": 0, "descartados": 2}
+
+
+# El separador decimal sale de cada extracto: "-3.50" son 3,50 €, no 350 €
+@pytest.mark.parametrize("cabecera, importe, cantidad", [
+    ("Date,Payee,Amount", '"-1,234.50"', 1234.5),
+    ("Date,Payee,Amount", "-3.50", 3.5),
+    ("Fecha;Concepto;Importe", "-1.234,50", 1234.5),
+    ("Fecha;Concepto;Importe", "-3,50", 3.5),
+])
+def test_separador_decimal_deducido(directorio, cabecera, importe, cantidad):
+    separador = ";" if ";" in cabecera else ","
+    extracto = _extracto(directorio, [cabecera, separador.join(["2024-10-01", "Cafe", importe])])
+    assert importar(extracto, _gastos(directorio))["importados"] == 1
+    assert cargar_datos(_gastos(directorio))["Cantidad"].tolist() == [cantidad]
+
+
+# Si ningún importe aclara el separador no se importa nada
+def test_separador_decimal_dudoso(directorio):
+    extracto = _extracto(directorio, ["Date,Payee,Amount", '2024-10-01,Cafe,"-1,234"'])
+    with pytest.raises(ExtractoNoValido, match="decimal"):
+        importar(extracto, _gastos(directorio))
+
+
+# Un archivo que no es un extracto se rechaza con ExtractoNoValido, no con el error del lector
+def test_extracto_ilegible(directorio):
+    ruta = directorio / "extracto.csv"
+    ruta.write_bytes(b"\xff\xfe\x00no es un extracto")
+    with pytest.raises(ExtractoNoValido):
+        importar(str(ruta), _gastos(directorio))
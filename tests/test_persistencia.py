@@ -0,0 +1,58 @@
+import json
+
+import almacenamiento
+from almacenamiento import cargar_datos, historial_cambios, insertar_gasto
+from persistencia import EscritorDiferido, escritor
+
+GASTO = {"Mes": "Octubre 2024", "Categoría": "Casa", "Concepto": "Luz", "Cantidad": 40.0, "Pagado": False,
+         "Fecha": "2024-10-01"}
+
+
+# Una escritura que falla no se pierde ni para el escritor: queda pendiente, se cuenta y se reintenta
+def test_escritura_fallida_se_reintenta():
+    escritas = []
+
+    def escribir(datos):
+        if not escritas:
+            escritas.append(None)
+            raise OSError(28, "No queda espacio en el dispositivo")
+        escritas.append(datos)
+
+    escritor_prueba = EscritorDiferido(retardo=60)
+    escritor_prueba.programar("gastos.json", "datos", escribir)
+    escritor_prueba.vaciar()  # Falla, y no se queda reintentando
+    estadisticas = escritor_prueba.estadisticas()
+    assert (estadisticas["errores"], estadisticas["fallidas"], estadisticas["escrituras"]) == (1, 1, 0)
+    assert "No queda espacio" in estadisticas["ultimo_error"]
+    assert escritor_prueba.pendiente("gastos.json") == "datos"
+
+    escritor_prueba.vaciar()
+    estadisticas = escritor_prueba.estadisticas()
+    assert escritas == [None, "datos"]
+    assert (estadisticas["fallidas"], estadisticas["escrituras"], estadisticas["pendientes"]) == (0, 1, 0)
+
+
+# Lo que no llega al archivo tampoco llega al historial, y se escribe (con su historial) al reintentarlo.
+# Con el almacén JSON, que es el que escribe el archivo entero en segundo plano
+def test_gasto_no_escrito_sigue_pendiente(directorio, monkeypatch):
+    monkeypatch.setenv("PRESUPUESTO_ALMACEN", "json")
+    gastos = str(directorio / "gastos_fijos.json")
+    escribir_atomico = almacenamiento.escribir_atomico
+
+    def sin_espacio(nombre_archivo, contenido):
+        if nombre_archivo == gastos:
+            raise OSError(28, "No queda espacio en el dispositivo")
+        return escribir_atomico(nombre_archivo, contenido)
+
+    monkeypatch.setattr(almacenamiento, "escribir_atomico", sin_espacio)
+    insertar_gasto(gastos, GASTO)
+    escritor.vaciar()
+    assert not (directorio / "gastos_fijos.json").exists()
+    assert cargar_datos(gastos)["Concepto"].tolist() == ["Luz"]
+    assert historial_cambios("gastos", gastos).empty
+
+    monkeypatch.setattr(almacenamiento, "escribir_atomico", escribir_atomico)
+    escritor.vaciar()
+    with open(gastos, 'r') as archivo:
+        assert [gasto["Concepto"] for gasto in json.load(archivo)] == ["Luz"]
+    assert historial_cambios("gastos", gastos)["tipo"].tolist() == ["insertar"]
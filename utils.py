@@ -1,42 +1,9 @@
 import streamlit as st
 import pandas as pd
-import json
-import os
 from datetime import date
-
-# Funciones para guardar y cargar los datos en un archivo JSON
-def cargar_datos(nombre_archivo):
-    if os.path.exists(nombre_archivo):
-        try:
-            with open(nombre_archivo, 'r') as archivo:
-                data = archivo.read()
-                if data.strip():  # Verifica si el archivo no está vacío
-                    return pd.read_json(nombre_archivo)
-                else:
-                    return pd.DataFrame(columns=["Mes", "Concepto", "Cantidad", "Pagado", "Categoría", "Fecha"])
-        except ValueError:  # Atrapa cualquier error de lectura de JSON
-            return pd.DataFrame(columns=["Mes", "Concepto", "Cantidad", "Pagado", "Categoría", "Fecha"])
-    else:
-        return pd.DataFrame(columns=["Mes", "Concepto", "Cantidad", "Pagado", "Categoría", "Fecha"])
-
-def guardar_datos(nombre_archivo, datos):
-    with open(nombre_archivo, 'w') as archivo:
-        archivo.write(datos.to_json(orient='records', date_format='iso'))
-
-# Funciones para gestionar categorías
-def cargar_categorias(nombre_archivo):
-    if os.path.exists(nombre_archivo):
-        try:
-            with open(nombre_archivo, 'r') as archivo:
-                return json.load(archivo)
-        except ValueError:
-            return ["Casa", "Deporte", "Alimentación / Hogar", "Salir Fuera"]  # Categorías por defecto
-    else:
-        return ["Casa", "Deporte", "Alimentación / Hogar", "Salir Fuera"]
-
-def guardar_categorias(nombre_archivo, categorias):
-    with open(nombre_archivo, 'w') as archivo:
-        json.dump(categorias, archivo)
+from almacenamiento import (ConflictoEdicion, actualizar_gasto, cargar_categorias, cargar_datos, eliminar_gasto,
+                            guardar_categorias, insertar_gasto)
+from gastos import formatear_euros
 
 # Archivo para las categorías
 archivo_categorias = "categorias.json"
@@ -44,14 +11,36 @@ categorias = cargar_categorias(archivo_categorias)
 
 nombre_archivo = "gastos_fijos.json"
 
-# Cargar datos desde el archivo JSON
-df = cargar_datos(nombre_archivo)
 
-# Validar si existe la columna 'Mes' y 'Categoría', si no, agregarla
-if 'Mes' not in df.columns:
-    df['Mes'] = None  # Inicializar la columna 'Mes' si no existe
-if 'Categoría' not in df.columns:
-    df['Categoría'] = None  # Inicializar la columna 'Categoría' si no existe
+# Cada cambio se guarda en su fila (con el id que le da el almacén) y sólo cuando el usuario toca un
+# widget. `antes` son los valores que mostraba el widget: si otra sesión los ha cambiado, no se sobrescriben
+def cambiar_pagado(clave, id, concepto):
+    pagado = st.session_state[clave]
+    try:
+        actualizar_gasto(nombre_archivo, id, {"Pagado": pagado}, antes={"Pagado": not pagado})
+    except ConflictoEdicion:
+        st.warning(f"'{concepto}' se ha modificado en otra sesión; no se ha guardado tu cambio.")
+
+
+def abrir_edicion(id, fila):
+    st.session_state[f"edit_antes_{id}"] = {"Concepto": fila["Concepto"], "Cantidad": fila["Cantidad"], "Fecha": fila["Fecha"]}
+    st.session_state[f"new_concepto_{id}"] = fila["Concepto"]
+    st.session_state[f"new_cantidad_{id}"] = float(fila["Cantidad"])
+    st.session_state[f"new_fecha_{id}"] = pd.to_datetime(fila["Fecha"]).date()
+    st.session_state[f"edit_mode_{id}"] = True
+
+
+def guardar_edicion(id):
+    cambios = {"Concepto": st.session_state[f"new_concepto_{id}"], "Cantidad": st.session_state[f"new_cantidad_{id}"],
+               "Fecha": str(st.session_state[f"new_fecha_{id}"])}
+    try:
+        actualizar_gasto(nombre_archivo, id, cambios, antes=st.session_state[f"edit_antes_{id}"])
+    except ConflictoEdicion:
+        st.warning("Este gasto se ha modificado en otra sesión; vuelve a abrirlo para editarlo.")
+    else:
+        st.success("Gasto actualizado correctamente")
+    st.session_state[f"edit_mode_{id}"] = False
+
 
 # Título de la aplicación
 st.title("❤️ Gestión de Gastos Fijos Mensuales")
@@ -60,13 +49,8 @@ st.title("❤️ Gestión de Gastos Fijos Mensuales")
 mes_seleccionado = st.sidebar.selectbox("Selecciona el mes", 
                                         ["Octubre 2024", "Noviembre 2024", "Diciembre 2024"])
 
-# Filtrar los datos por mes
-df_mes = df[df["Mes"] == mes_seleccionado]
-
-if df_mes.empty:
-    st.session_state.gastos = pd.DataFrame(columns=["Mes", "Concepto", "Cantidad", "Pagado", "Categoría", "Fecha"])
-else:
-    st.session_state.gastos = df_mes
+# Cargar sólo los gastos del mes (su índice es el id de cada gasto)
+st.session_state.gastos = cargar_datos(nombre_archivo, mes=mes_seleccionado)
 
 # Mostrar la tabla de gastos como un checklist editable (organizado por categorías)
 st.header(f"Gastos fijos de {mes_seleccionado}")
@@ -81,32 +65,29 @@ for categoria in categorias:
         else:
             # Mostrar los gastos en la categoría con checkbox
             for index, row in gastos_categoria.iterrows():
-                pagado_checkbox = st.checkbox(f"{row['Concepto']} - {int(row['Cantidad'])} € - {row['Fecha']}", 
-                                              value=row['Pagado'], key=f"{mes_seleccionado}_{categoria}_{index}")
-                st.session_state.gastos.at[index, "Pagado"] = pagado_checkbox
+                # La casilla muestra siempre lo guardado; sólo se escribe al hacer clic
+                clave_pagado = f"{mes_seleccionado}_{categoria}_{index}"
+                st.session_state[clave_pagado] = bool(row['Pagado'])
+                st.checkbox(f"{row['Concepto']} - {formatear_euros(row['Cantidad'])} - {row['Fecha']}", key=clave_pagado,
+                            on_change=cambiar_pagado, args=(clave_pagado, index, row['Concepto']))
 
                 # Botón para editar cada gasto
                 if f"edit_mode_{index}" not in st.session_state:
                     st.session_state[f"edit_mode_{index}"] = False  # Estado de edición para cada gasto
 
                 if st.session_state[f"edit_mode_{index}"]:
-                    nuevo_concepto = st.text_input("Editar concepto", row["Concepto"], key=f"new_concepto_{index}")
-                    nueva_cantidad = st.number_input("Editar cantidad (€)", min_value=0, step=1, value=int(row["Cantidad"]), key=f"new_cantidad_{index}")
-                    nueva_fecha = st.date_input("Editar fecha", pd.to_datetime(row["Fecha"]).date(), key=f"new_fecha_{index}")
-                    if st.button("Guardar cambios", key=f"save_button_{index}"):
-                        st.session_state.gastos.at[index, "Concepto"] = nuevo_concepto
-                        st.session_state.gastos.at[index, "Cantidad"] = nueva_cantidad
-                        st.session_state.gastos.at[index, "Fecha"] = str(nueva_fecha)
-                        st.session_state[f"edit_mode_{index}"] = False
-                        st.success("Gasto actualizado correctamente")
+                    st.text_input("Editar concepto", key=f"new_concepto_{index}")
+                    st.number_input("Editar cantidad (€)", min_value=0.0, step=0.01, format="%.2f", key=f"new_cantidad_{index}")
+                    st.date_input("Editar fecha", key=f"new_fecha_{index}")
+                    st.button("Guardar cambios", key=f"save_button_{index}", on_click=guardar_edicion, args=(index,))
 
                 else:
-                    if st.button("Editar", key=f"edit_button_{index}"):
-                        st.session_state[f"edit_mode_{index}"] = True
+                    st.button("Editar", key=f"edit_button_{index}", on_click=abrir_edicion, args=(index, row))
 
-                # Botón para eliminar un gasto
+                # Botón para eliminar un gasto (sólo esa fila; los ids de los demás no cambian)
                 if st.button("Eliminar", key=f"delete_{mes_seleccionado}_{index}"):
-                    st.session_state.gastos = st.session_state.gastos.drop(index).reset_index(drop=True)
+                    eliminar_gasto(nombre_archivo, index, mes=mes_seleccionado)
+                    st.session_state.gastos = st.session_state.gastos.drop(index)
                     st.success("Gasto eliminado correctamente")
 
 # Calcular el total de gastos, lo pagado y lo pendiente
@@ -116,31 +97,27 @@ por_pagar_total = st.session_state.gastos[st.session_state.gastos["Pagado"] == F
 
 # Mostrar el balance
 st.subheader(f"Balance de {mes_seleccionado}")
-st.write(f"Total de gastos: {int(total_gastos)} €")
-st.write(f"Total pagado: {int(pagado_total)} €")
-st.write(f"Por pagar: {int(por_pagar_total)} €")
+st.write(f"Total de gastos: {formatear_euros(total_gastos)}")
+st.write(f"Total pagado: {formatear_euros(pagado_total)}")
+st.write(f"Por pagar: {formatear_euros(por_pagar_total)}")
 
 
 # Formulario para agregar nuevos gastos (FORMULARIO ABAJO)
 st.header("Añadir nuevos gastos")
 with st.form("Añadir gasto"):
     concepto = st.text_input("Concepto del gasto")
-    cantidad = st.number_input("Cantidad (€)", min_value=0, step=1)  # Solo números enteros
+    cantidad = st.number_input("Cantidad (€)", min_value=0.0, step=0.01, format="%.2f")  # Con céntimos
     categoria = st.selectbox("Categoría", categorias)
     fecha = st.date_input("Fecha", value=date.today())
     pagado = st.checkbox("¿Está pagado?")
     submit = st.form_submit_button("Añadir gasto")
 
-# Añadir nuevo gasto al DataFrame
+# Añadir el nuevo gasto: se guarda sólo esa fila, con un id nuevo
 if submit and concepto:
-    nuevo_gasto = pd.DataFrame({"Mes": [mes_seleccionado], "Concepto": [concepto], "Cantidad": [cantidad], "Pagado": [pagado], "Categoría": [categoria], "Fecha": [str(fecha)]})
-    st.session_state.gastos = pd.concat([st.session_state.gastos, nuevo_gasto], ignore_index=True)
+    insertar_gasto(nombre_archivo, {"Mes": mes_seleccionado, "Concepto": concepto, "Cantidad": cantidad, "Pagado": pagado,
+                                    "Categoría": categoria, "Fecha": str(fecha)})
     st.success("Gasto añadido correctamente")
 
-# Guardar los datos actualizados en el archivo JSON
-df = pd.concat([df[df["Mes"] != mes_seleccionado], st.session_state.gastos], ignore_index=True)
-guardar_datos(nombre_archivo, df)
-
 # Formulario para agregar nuevas categorías
 st.header("Agregar nueva categoría")
 nueva_categoria = st.text_input("Nombre de la nueva categoría")